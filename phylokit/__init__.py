@@ -1,23 +1,53 @@
 from .balance import b1_index  # NOQA
 from .balance import b2_index  # NOQA
 from .balance import colless_index  # NOQA
+from .balance import forest_b1_index  # NOQA
+from .balance import forest_b2_index  # NOQA
+from .balance import forest_colless_index  # NOQA
+from .balance import forest_sackin_index  # NOQA
+from .balance import forest_tree_statistics  # NOQA
 from .balance import sackin_index  # NOQA
+from .balance import tree_statistics  # NOQA
+from .convert import forest_to_tskit  # NOQA
 from .convert import from_newick  # NOQA
 from .convert import from_tskit  # NOQA
+from .convert import from_tskit_sequence  # NOQA
+from .convert import read_trees  # NOQA
 from .convert import to_newick  # NOQA
 from .convert import to_tskit  # NOQA
 from .dataset import open_dataset
 from .dataset import save_dataset
+from .distance import append_mrca_index
 from .distance import kc_distance
+from .distance import kc_distance_matrix
+from .distance import kc_vector
+from .distance import kc_vectors
 from .distance import mrca
+from .distance import mrca_batch
+from .distance import patristic_distances
 from .distance import rf_distance
+from .distance import rf_distance_matrix
 from .maximum_likelihood.felsenstein import likelihood_felsenstein
+from .maximum_likelihood.felsenstein import log_likelihood_felsenstein
+from .maximum_likelihood.felsenstein import transition_matrices
+from .maximum_likelihood.felsenstein import update_transition_matrix
+from .maximum_likelihood.models import gamma_rate_categories
+from .maximum_likelihood.models import gtr_model
+from .maximum_likelihood.models import hky_model
+from .maximum_likelihood.models import jc69_model
+from .maximum_likelihood.models import SubstitutionModel
+from .maximum_likelihood.state import LikelihoodState
 from .parsimony.hartigan import append_parsimony_score
 from .parsimony.hartigan import get_hartigan_parsimony_score
 from .parsimony.hartigan import numba_hartigan_parsimony_vectorised
+from .patterns import append_site_patterns
+from .patterns import site_patterns
+from .simulate import sim_trees
 from .transform import permute_tree
 from .traversal import _postorder
 from .traversal import _preorder
+from .traversal import forest_postorder
+from .traversal import forest_preorder
 from .traversal import postorder
 from .traversal import preorder
 from .util import _get_node_branch_length
@@ -31,28 +61,58 @@ __all__ = [
     "colless_index",
     "b1_index",
     "b2_index",
+    "forest_sackin_index",
+    "forest_colless_index",
+    "forest_b1_index",
+    "forest_b2_index",
+    "tree_statistics",
+    "forest_tree_statistics",
     "from_tskit",
+    "from_tskit_sequence",
     "from_newick",
+    "read_trees",
     "to_tskit",
+    "forest_to_tskit",
     "to_newick",
     "mrca",
+    "mrca_batch",
+    "append_mrca_index",
     "branch_length",
     "kc_distance",
+    "kc_vector",
+    "kc_vectors",
+    "kc_distance_matrix",
     "rf_distance",
+    "rf_distance_matrix",
+    "patristic_distances",
     "postorder",
     "preorder",
     "_preorder",
     "_postorder",
+    "forest_postorder",
+    "forest_preorder",
     "is_unary",
     "get_num_roots",
     "get_node_branch_length",
     "_get_node_branch_length",
     "check_node_bounds",
     "permute_tree",
+    "sim_trees",
     "open_dataset",
     "save_dataset",
     "numba_hartigan_parsimony_vectorised",
     "get_hartigan_parsimony_score",
     "append_parsimony_score",
+    "site_patterns",
+    "append_site_patterns",
     "likelihood_felsenstein",
+    "log_likelihood_felsenstein",
+    "transition_matrices",
+    "update_transition_matrix",
+    "SubstitutionModel",
+    "jc69_model",
+    "hky_model",
+    "gtr_model",
+    "gamma_rate_categories",
+    "LikelihoodState",
 ]
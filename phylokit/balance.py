@@ -2,29 +2,32 @@
 import math
 
 import numpy as np
+from numba import prange
 
 from . import jit
 from . import util
+from .traversal import _push_children
 
 
 @jit.numba_njit()
 def _sackin_index(virtual_root, left_child, right_sib):
-    stack = []
-    root = left_child[virtual_root]
-    while root != -1:
-        stack.append((root, 0))
-        root = right_sib[root]
+    # The depth of each node on the stack is kept in the same slot of a
+    # parallel payload stack.
+    stack = np.empty(left_child.shape[0], dtype=np.int32)
+    depth = np.empty(left_child.shape[0], dtype=np.int64)
+    stack_top = _push_children(virtual_root, left_child, right_sib, stack, -1)
+    depth[: stack_top + 1] = 0
     total_depth = 0
-    while len(stack) > 0:
-        u, depth = stack.pop()
-        v = left_child[u]
-        if v == -1:
-            total_depth += depth
+    while stack_top >= 0:
+        u = stack[stack_top]
+        u_depth = depth[stack_top]
+        stack_top -= 1
+        if left_child[u] == -1:
+            total_depth += u_depth
         else:
-            depth += 1
-            while v != -1:
-                stack.append((v, depth))
-                v = right_sib[v]
+            start = stack_top + 1
+            stack_top = _push_children(u, left_child, right_sib, stack, stack_top)
+            depth[start : stack_top + 1] = u_depth + 1
     return total_depth
 
 
@@ -43,6 +46,35 @@ def sackin_index(ds):
     return _sackin_index(-1, ds.node_left_child.data, ds.node_right_sib.data)
 
 
+@jit.numba_njit(parallel=True)
+def _forest_sackin_index(left_child, right_sib, node_offset):
+    num_trees = node_offset.shape[0] - 1
+    ret = np.zeros(num_trees, dtype=np.int64)
+    for j in prange(num_trees):
+        start = node_offset[j]
+        stop = node_offset[j + 1]
+        ret[j] = _sackin_index(-1, left_child[start:stop], right_sib[start:stop])
+    return ret
+
+
+def forest_sackin_index(ds):
+    """
+    Returns the Sackin imbalance index for each tree in a forest dataset.
+
+    .. seealso::
+        See :func:`sackin_index` for details.
+
+    :param xarray.DataSet ds: The forest dataset to compute the Sackin indexes of.
+    :return : The Sackin index of each tree.
+    :rtype : numpy.ndarray
+    """
+    return _forest_sackin_index(
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        ds.tree_node_offset.data,
+    )
+
+
 @jit.numba_njit()
 def _colless_index(postorder, left_child, right_sib):
     num_leaves = np.zeros_like(left_child)
@@ -60,7 +92,8 @@ def _colless_index(postorder, left_child, right_sib):
             v = left_child[u]
             total += abs(num_leaves[right_sib[v]] - num_leaves[v])
         else:
-            raise ValueError("Colless index not defined for nonbinary trees")
+            # Not defined for nonbinary trees.
+            return np.nan
     return total
 
 
@@ -82,23 +115,26 @@ def colless_index(ds):
     """
     if util.get_num_roots(ds) != 1:
         raise ValueError("Colless index not defined for multiroot trees")
-    return _colless_index(
+    ret = _colless_index(
         ds.traversal_postorder.data,
         ds.node_left_child.data,
         ds.node_right_sib.data,
     )
+    if np.isnan(ret):
+        raise ValueError("Colless index not defined for nonbinary trees")
+    return ret
 
 
 @jit.numba_njit()
 def _b1_index(postorder, left_child, right_sib, parent):
-    max_path_length = np.zeros_like(postorder)
+    max_path_length = np.zeros_like(left_child)
     total = 0.0
     for u in postorder:
         v = left_child[u]
-        if parent[u] != -1 and v != -1:
-            max_path_length[u] = (
-                max(max_path_length[v], max_path_length[right_sib[v]]) + 1
-            )
+        while v != -1:
+            max_path_length[u] = max(max_path_length[u], max_path_length[v] + 1)
+            v = right_sib[v]
+        if parent[u] != -1 and left_child[u] != -1:
             total += 1 / max_path_length[u]
     return total
 
@@ -123,40 +159,29 @@ def b1_index(ds):
     )
 
 
-@jit.numba_njit()
-def general_log(x, base):
-    """
-    Compute the logarithm of x in base `base`.
-
-    :param x: The number to compute the logarithm of.
-    :param base: The base of the logarithm.
-    :return: The logarithm of x in base `base`.
-    :rtype: float
-    """
-    return math.log(x) / math.log(base)
-
-
 @jit.numba_njit()
 def _b2_index(virtual_root, left_child, right_sib, base):
-    root = left_child[virtual_root]
-    stack = [(root, 1)]
-    total_proba = 0.0
-    while len(stack) > 0:
-        u, path_product = stack.pop()
+    # The payload stack holds the log of the probability of reaching each
+    # node, which doesn't underflow for very deep trees. For multiroot trees,
+    # this is the sum of the B2 indexes of the roots.
+    stack = np.empty(left_child.shape[0], dtype=np.int32)
+    log_proba = np.empty(left_child.shape[0])
+    stack_top = _push_children(virtual_root, left_child, right_sib, stack, -1)
+    log_proba[: stack_top + 1] = 0
+    total = 0.0
+    while stack_top >= 0:
+        u = stack[stack_top]
+        u_log_proba = log_proba[stack_top]
+        stack_top -= 1
         if left_child[u] == -1:
-            total_proba -= path_product * general_log(path_product, base)
+            total -= math.exp(u_log_proba) * u_log_proba
         else:
-            num_children = 0
-            v = left_child[u]
-            while v != -1:
-                num_children += 1
-                v = right_sib[v]
-            path_product *= 1 / num_children
-            v = left_child[u]
-            while v != -1:
-                stack.append((v, path_product))
-                v = right_sib[v]
-    return total_proba
+            start = stack_top + 1
+            stack_top = _push_children(u, left_child, right_sib, stack, stack_top)
+            log_proba[start : stack_top + 1] = u_log_proba - math.log(
+                stack_top - start + 1
+            )
+    return total / math.log(base)
 
 
 def b2_index(ds, base=10):
@@ -182,3 +207,327 @@ def b2_index(ds, base=10):
         ds.node_right_sib.data,
         base,
     )
+
+
+_TREE_STATISTICS = (
+    "sackin",
+    "colless",
+    "b1",
+    "b2",
+    "num_leaves",
+    "max_depth",
+    "num_cherries",
+    "total_cophenetic",
+)
+_FLOAT_TREE_STATISTICS = ("colless", "b1", "b2")
+
+
+def _check_tree_statistics(stats, base):
+    if stats is None:
+        stats = _TREE_STATISTICS
+    for name in stats:
+        if name not in _TREE_STATISTICS:
+            raise ValueError(f"Unknown tree statistic '{name}'")
+    if "b2" in stats:
+        math.log(10, base)  # Check that base is valid
+    return stats
+
+
+@jit.numba_njit()
+def _tree_statistics(postorder, left_child, right_sib, parent, base, need_preorder):
+    # Returns the statistics in the order of _TREE_STATISTICS. The top-down
+    # quantities (depth and the B2 path probability) are found by visiting
+    # the postorder in reverse, which puts every node after its parent.
+    num_nodes = left_child.shape[0]
+    ret = np.zeros(len(_TREE_STATISTICS))
+    num_roots = 0
+    v = left_child[-1]
+    while v != -1:
+        num_roots += 1
+        v = right_sib[v]
+
+    depth = np.zeros(num_nodes, dtype=np.int64)
+    log_proba = np.zeros(num_nodes)
+    max_depth = 0
+    b2 = 0.0
+    if need_preorder:
+        for j in range(postorder.shape[0] - 1, -1, -1):
+            u = postorder[j]
+            p = parent[u]
+            if p != -1:
+                depth[u] = depth[p] + 1
+                log_proba[u] = log_proba[p]
+            v = left_child[u]
+            if v == -1:
+                max_depth = max(max_depth, depth[u])
+                b2 -= math.exp(log_proba[u]) * log_proba[u]
+            else:
+                num_children = 0
+                while v != -1:
+                    num_children += 1
+                    v = right_sib[v]
+                # The log of the probability of reaching each child of u.
+                log_proba[u] -= math.log(num_children)
+        b2 /= math.log(base)
+
+    num_leaves = np.zeros(num_nodes, dtype=np.int64)
+    max_path_length = np.zeros(num_nodes, dtype=np.int64)
+    sackin = 0
+    colless = 0.0
+    binary = num_roots == 1
+    b1 = 0.0
+    total_leaves = 0
+    num_cherries = 0
+    total_cophenetic = 0
+    for u in postorder:
+        v = left_child[u]
+        if v == -1:
+            num_leaves[u] = 1
+            total_leaves += 1
+            continue
+        num_children = 0
+        num_leaf_children = 0
+        while v != -1:
+            num_children += 1
+            num_leaves[u] += num_leaves[v]
+            max_path_length[u] = max(max_path_length[u], max_path_length[v] + 1)
+            if left_child[v] == -1:
+                num_leaf_children += 1
+            v = right_sib[v]
+        # Each leaf's depth is the number of internal nodes above it.
+        sackin += num_leaves[u]
+        if num_children == 2:
+            v = left_child[u]
+            colless += abs(num_leaves[right_sib[v]] - num_leaves[v])
+            if num_leaf_children == 2:
+                num_cherries += 1
+        else:
+            binary = False
+        if parent[u] != -1:
+            b1 += 1 / max_path_length[u]
+            total_cophenetic += num_leaves[u] * (num_leaves[u] - 1) // 2
+
+    ret[0] = sackin
+    ret[1] = colless if binary else np.nan
+    ret[2] = b1
+    ret[3] = b2 if num_roots == 1 else np.nan
+    ret[4] = total_leaves
+    ret[5] = max_depth
+    ret[6] = num_cherries
+    ret[7] = total_cophenetic
+    return ret
+
+
+def tree_statistics(ds, stats=None, *, base=10):
+    """
+    Returns the specified shape statistics of the tree, computed together in a
+    single pass over the tree arrays. The available statistics are:
+
+    - ``sackin``: the Sackin index (see :func:`sackin_index`).
+    - ``colless``: the Colless index (see :func:`colless_index`).
+    - ``b1``: the B1 index (see :func:`b1_index`).
+    - ``b2``: the B2 index (see :func:`b2_index`).
+    - ``num_leaves``: the number of leaves.
+    - ``max_depth``: the largest number of branches between a leaf and its root.
+    - ``num_cherries``: the number of nodes whose two children are both leaves.
+    - ``total_cophenetic``: the total cophenetic index, that is the sum over all
+      pairs of leaves of the depth of their MRCA.
+
+    Rather than raising an error, statistics which are not defined for the tree
+    (the Colless index for nonbinary or multiroot trees, and the B2 index for
+    multiroot trees) are NaN.
+
+    .. seealso::
+        See `Mir et al. (2013) <https://doi.org/10.1016/j.mbs.2012.10.005>`_ for
+        details of the total cophenetic index.
+
+    :param xarray.DataSet ds: The tree dataset.
+    :param list stats: The names of the statistics to compute, or None to compute
+        all of them.
+    :param int base: The base of the logarithm used to compute the B2 index.
+    :return : The value of each of the statistics.
+    :rtype : dict
+    """
+    stats = _check_tree_statistics(stats, base)
+    values = _tree_statistics(
+        ds.traversal_postorder.data,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        ds.node_parent.data,
+        base,
+        "b2" in stats or "max_depth" in stats,
+    )
+    ret = {}
+    for name in stats:
+        value = values[_TREE_STATISTICS.index(name)]
+        ret[name] = value if name in _FLOAT_TREE_STATISTICS else int(value)
+    return ret
+
+
+@jit.numba_njit(parallel=True)
+def _forest_colless_index(
+    postorder, left_child, right_sib, node_offset, traversal_offset
+):
+    num_trees = node_offset.shape[0] - 1
+    ret = np.full(num_trees, np.nan)
+    for j in prange(num_trees):
+        nodes = slice(node_offset[j], node_offset[j + 1])
+        if util._get_num_roots(left_child[nodes], right_sib[nodes]) == 1:
+            ret[j] = _colless_index(
+                postorder[traversal_offset[j] : traversal_offset[j + 1]],
+                left_child[nodes],
+                right_sib[nodes],
+            )
+    return ret
+
+
+def forest_colless_index(ds):
+    """
+    Returns the Colless imbalance index for each tree in a forest dataset.
+    The index is NaN for trees where it is not defined (nonbinary and
+    multiroot trees).
+
+    .. seealso::
+        See :func:`colless_index` for details.
+
+    :param xarray.DataSet ds: The forest dataset to compute the Colless indexes of.
+    :return : The Colless index of each tree.
+    :rtype : numpy.ndarray
+    """
+    return _forest_colless_index(
+        ds.traversal_postorder.data,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        ds.tree_node_offset.data,
+        ds.tree_traversal_offset.data,
+    )
+
+
+@jit.numba_njit(parallel=True)
+def _forest_b1_index(
+    postorder, left_child, right_sib, parent, node_offset, traversal_offset
+):
+    num_trees = node_offset.shape[0] - 1
+    ret = np.zeros(num_trees)
+    for j in prange(num_trees):
+        nodes = slice(node_offset[j], node_offset[j + 1])
+        ret[j] = _b1_index(
+            postorder[traversal_offset[j] : traversal_offset[j + 1]],
+            left_child[nodes],
+            right_sib[nodes],
+            parent[nodes],
+        )
+    return ret
+
+
+def forest_b1_index(ds):
+    """
+    Returns the B1 balance index for each tree in a forest dataset.
+
+    .. seealso::
+        See :func:`b1_index` for details.
+
+    :param xarray.DataSet ds: The forest dataset to compute the B1 indexes of.
+    :return : The B1 index of each tree.
+    :rtype : numpy.ndarray
+    """
+    return _forest_b1_index(
+        ds.traversal_postorder.data,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        ds.node_parent.data,
+        ds.tree_node_offset.data,
+        ds.tree_traversal_offset.data,
+    )
+
+
+@jit.numba_njit(parallel=True)
+def _forest_b2_index(left_child, right_sib, node_offset, base):
+    num_trees = node_offset.shape[0] - 1
+    ret = np.full(num_trees, np.nan)
+    for j in prange(num_trees):
+        nodes = slice(node_offset[j], node_offset[j + 1])
+        if util._get_num_roots(left_child[nodes], right_sib[nodes]) == 1:
+            ret[j] = _b2_index(-1, left_child[nodes], right_sib[nodes], base)
+    return ret
+
+
+def forest_b2_index(ds, base=10):
+    """
+    Returns the B2 balance index for each tree in a forest dataset. The index
+    is NaN for trees where it is not defined (multiroot trees).
+
+    .. seealso::
+        See :func:`b2_index` for details.
+
+    :param xarray.DataSet ds: The forest dataset to compute the B2 indexes of.
+    :param int base: The base of the logarithm used to compute the B2 index in the
+        Shannon entropy computation.
+    :return : The B2 index of each tree.
+    :rtype : numpy.ndarray
+    """
+    math.log(10, base)  # Check that base is valid
+    return _forest_b2_index(
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        ds.tree_node_offset.data,
+        base,
+    )
+
+
+@jit.numba_njit(parallel=True)
+def _forest_tree_statistics(
+    postorder,
+    left_child,
+    right_sib,
+    parent,
+    node_offset,
+    traversal_offset,
+    base,
+    need_preorder,
+):
+    num_trees = node_offset.shape[0] - 1
+    ret = np.zeros((len(_TREE_STATISTICS), num_trees))
+    for j in prange(num_trees):
+        nodes = slice(node_offset[j], node_offset[j + 1])
+        ret[:, j] = _tree_statistics(
+            postorder[traversal_offset[j] : traversal_offset[j + 1]],
+            left_child[nodes],
+            right_sib[nodes],
+            parent[nodes],
+            base,
+            need_preorder,
+        )
+    return ret
+
+
+def forest_tree_statistics(ds, stats=None, *, base=10):
+    """
+    Returns the specified shape statistics for each tree in a forest dataset.
+
+    .. seealso::
+        See :func:`tree_statistics` for details.
+
+    :param xarray.DataSet ds: The forest dataset.
+    :param list stats: The names of the statistics to compute, or None to compute
+        all of them.
+    :param int base: The base of the logarithm used to compute the B2 index.
+    :return : The value of each of the statistics for each tree.
+    :rtype : dict
+    """
+    stats = _check_tree_statistics(stats, base)
+    values = _forest_tree_statistics(
+        ds.traversal_postorder.data,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        ds.node_parent.data,
+        ds.tree_node_offset.data,
+        ds.tree_traversal_offset.data,
+        base,
+        "b2" in stats or "max_depth" in stats,
+    )
+    ret = {}
+    for name in stats:
+        value = values[_TREE_STATISTICS.index(name)]
+        ret[name] = value if name in _FLOAT_TREE_STATISTICS else value.astype(np.int64)
+    return ret
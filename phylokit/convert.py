@@ -1,9 +1,19 @@
-import newick  # TEMPORARY - see from_newick below
+import collections
+import concurrent.futures
+import io
+import itertools
+import multiprocessing
+import pathlib
+import re
+
 import numpy as np
 import tskit
 import xarray
+from numba import prange
 
 from . import core
+from . import jit
+from . import util
 
 
 def from_tskit(tree: tskit.Tree) -> xarray.Dataset:
@@ -12,137 +22,1501 @@ def from_tskit(tree: tskit.Tree) -> xarray.Dataset:
     # dimension the same length
     # See https://github.com/tskit-dev/tskit/issues/1322 for work on making this
     # more efficient.
-    time = np.append(ts.tables.nodes.time, np.inf)
+    time = np.append(ts.nodes_time, np.inf)
+    # The tree arrays are views which change as the tree is moved along the
+    # sequence, so we must copy them.
     return core.create_tree_dataset(
-        parent=tree.parent_array,
+        parent=tree.parent_array.copy(),
         time=time,
-        left_child=tree.left_child_array,
-        right_sib=tree.right_sib_array,
+        left_child=tree.left_child_array.copy(),
+        right_sib=tree.right_sib_array.copy(),
         samples=ts.samples(),
     )
 
 
+# The tree arrays maintained while iterating over a tree sequence, following
+# tskit's quintuply linked tree encoding.
+_PARENT = 0
+_LEFT_CHILD = 1
+_RIGHT_CHILD = 2
+_LEFT_SIB = 3
+_RIGHT_SIB = 4
+
+
+@jit.numba_njit()
+def _insert_branch(tree, p, c):
+    u = tree[_RIGHT_CHILD, p]
+    if u == -1:
+        tree[_LEFT_CHILD, p] = c
+        tree[_LEFT_SIB, c] = -1
+    else:
+        tree[_RIGHT_SIB, u] = c
+        tree[_LEFT_SIB, c] = u
+    tree[_RIGHT_SIB, c] = -1
+    tree[_PARENT, c] = p
+    tree[_RIGHT_CHILD, p] = c
+
+
+@jit.numba_njit()
+def _remove_branch(tree, p, c):
+    left_sib = tree[_LEFT_SIB, c]
+    right_sib = tree[_RIGHT_SIB, c]
+    if left_sib == -1:
+        tree[_LEFT_CHILD, p] = right_sib
+    else:
+        tree[_RIGHT_SIB, left_sib] = right_sib
+    if right_sib == -1:
+        tree[_RIGHT_CHILD, p] = left_sib
+    else:
+        tree[_LEFT_SIB, right_sib] = left_sib
+    tree[_PARENT, c] = -1
+    tree[_LEFT_SIB, c] = -1
+    tree[_RIGHT_SIB, c] = -1
+
+
+@jit.numba_njit()
+def _insert_root(tree, u):
+    virtual_root = tree.shape[1] - 1
+    _insert_branch(tree, virtual_root, u)
+    tree[_PARENT, u] = -1
+
+
+@jit.numba_njit()
+def _update_edge(tree, num_samples, p, c, insert):
+    """
+    Inserts or removes the edge from p to c, maintaining the list of roots
+    (the nodes with no parent that subtend at least one sample) as the
+    children of the virtual root in the same order as tskit.
+    """
+    virtual_root = tree.shape[1] - 1
+    delta = num_samples[c] if insert else -num_samples[c]
+    path_end = -1
+    path_end_was_root = False
+    u = p
+    while u != -1:
+        path_end_was_root = num_samples[u] >= 1
+        num_samples[u] += delta
+        path_end = u
+        u = tree[_PARENT, u]
+    if insert:
+        if num_samples[c] >= 1:
+            _remove_branch(tree, virtual_root, c)
+        if num_samples[path_end] >= 1 and not path_end_was_root:
+            _insert_root(tree, path_end)
+        _insert_branch(tree, p, c)
+    else:
+        _remove_branch(tree, p, c)
+        if path_end_was_root and num_samples[path_end] < 1:
+            _remove_branch(tree, virtual_root, path_end)
+        if num_samples[c] >= 1:
+            _insert_root(tree, c)
+
+
+@jit.numba_njit()
+def _init_tree(num_nodes, samples):
+    tree = np.full((5, num_nodes + 1), -1, dtype=np.int32)
+    num_samples = np.zeros(num_nodes + 1, dtype=np.int64)
+    for u in samples:
+        num_samples[u] = 1
+        _insert_root(tree, u)
+    return tree, num_samples
+
+
+@jit.numba_njit()
+def _next_tree(
+    edges_left,
+    edges_right,
+    edges_parent,
+    edges_child,
+    insertion,
+    removal,
+    sequence_length,
+    tree,
+    num_samples,
+    cursor,
+    interval,
+):
+    """
+    Moves the tree to the next interval along the sequence by applying the
+    edge diffs, in the same way as tskit. The positions in the insertion and
+    removal orders are kept in the cursor array and the current tree's
+    interval in the interval array.
+    """
+    left = interval[1]
+    j = cursor[0]
+    k = cursor[1]
+    num_edges = insertion.shape[0]
+    while k < num_edges and edges_right[removal[k]] == left:
+        e = removal[k]
+        _update_edge(tree, num_samples, edges_parent[e], edges_child[e], False)
+        k += 1
+    while j < num_edges and edges_left[insertion[j]] == left:
+        e = insertion[j]
+        _update_edge(tree, num_samples, edges_parent[e], edges_child[e], True)
+        j += 1
+    right = sequence_length
+    if j < num_edges:
+        right = min(right, edges_left[insertion[j]])
+    if k < num_edges:
+        right = min(right, edges_right[removal[k]])
+    cursor[0] = j
+    cursor[1] = k
+    interval[0] = left
+    interval[1] = right
+
+
+@jit.numba_njit()
+def _grow(a, capacity):
+    b = np.empty(capacity, dtype=a.dtype)
+    b[: a.shape[0]] = a
+    return b
+
+
+@jit.numba_njit()
+def _forest_from_edge_diffs(
+    edges_left,
+    edges_right,
+    edges_parent,
+    edges_child,
+    insertion,
+    removal,
+    sequence_length,
+    num_trees,
+    nodes_time,
+    samples,
+):
+    """
+    Returns the concatenated arrays of a forest holding each tree of a tree
+    sequence, in which the nodes of each tree are the nodes reachable from
+    its roots numbered in increasing order of tskit node ID.
+    """
+    num_nodes = nodes_time.shape[0]
+    tree, num_samples = _init_tree(num_nodes, samples)
+    cursor = np.zeros(2, dtype=np.int64)
+    interval = np.zeros(2, dtype=np.float64)
+    local = np.full(num_nodes + 1, -1, dtype=np.int32)
+    nodes = np.empty(num_nodes, dtype=np.int32)
+    stack = np.empty(num_nodes + 1, dtype=np.int32)
+
+    capacity = max(num_nodes + 1, 16)
+    parent = np.empty(capacity, dtype=np.int32)
+    left_child = np.empty(capacity, dtype=np.int32)
+    right_sib = np.empty(capacity, dtype=np.int32)
+    time = np.empty(capacity, dtype=np.float64)
+    node_offset = np.zeros(num_trees + 1, dtype=np.int64)
+    sample_node = np.empty(num_trees * samples.shape[0], dtype=np.int32)
+    for t in range(num_trees):
+        _next_tree(
+            edges_left,
+            edges_right,
+            edges_parent,
+            edges_child,
+            insertion,
+            removal,
+            sequence_length,
+            tree,
+            num_samples,
+            cursor,
+            interval,
+        )
+        # Collect the nodes reachable from the virtual root.
+        n = 0
+        stack[0] = num_nodes
+        stack_top = 0
+        while stack_top >= 0:
+            u = tree[_LEFT_CHILD, stack[stack_top]]
+            stack_top -= 1
+            while u != -1:
+                nodes[n] = u
+                n += 1
+                stack_top += 1
+                stack[stack_top] = u
+                u = tree[_RIGHT_SIB, u]
+        nodes[:n].sort()
+        offset = node_offset[t]
+        if offset + n + 1 > capacity:
+            capacity = max(2 * capacity, offset + n + 1)
+            parent = _grow(parent, capacity)
+            left_child = _grow(left_child, capacity)
+            right_sib = _grow(right_sib, capacity)
+            time = _grow(time, capacity)
+        for j in range(n):
+            local[nodes[j]] = j
+        local[num_nodes] = n
+        for j in range(n):
+            u = nodes[j]
+            v = tree[_PARENT, u]
+            parent[offset + j] = -1 if v == -1 else local[v]
+            v = tree[_LEFT_CHILD, u]
+            left_child[offset + j] = -1 if v == -1 else local[v]
+            v = tree[_RIGHT_SIB, u]
+            right_sib[offset + j] = -1 if v == -1 else local[v]
+            time[offset + j] = nodes_time[u]
+        parent[offset + n] = -1
+        v = tree[_LEFT_CHILD, num_nodes]
+        left_child[offset + n] = -1 if v == -1 else local[v]
+        right_sib[offset + n] = -1
+        time[offset + n] = np.inf
+        for j in range(samples.shape[0]):
+            sample_node[t * samples.shape[0] + j] = local[samples[j]]
+        node_offset[t + 1] = offset + n + 1
+    total = node_offset[num_trees]
+    return (
+        parent[:total],
+        left_child[:total],
+        right_sib[:total],
+        time[:total],
+        sample_node,
+        node_offset,
+    )
+
+
+def _edge_diff_args(ts):
+    # These accessors are views of the tree sequence's own columns, whereas
+    # ts.tables would copy the whole table collection.
+    return (
+        ts.edges_left,
+        ts.edges_right,
+        ts.edges_parent,
+        ts.edges_child,
+        ts.indexes_edge_insertion_order,
+        ts.indexes_edge_removal_order,
+        ts.sequence_length,
+    )
+
+
+def _iterate_tskit_trees(ts, edge_diff_args):
+    time = np.append(ts.nodes_time, np.inf)
+    # The time array is shared between all of the trees.
+    time.flags.writeable = False
+    samples = ts.samples()
+    tree, num_samples = _init_tree(ts.num_nodes, samples)
+    cursor = np.zeros(2, dtype=np.int64)
+    interval = np.zeros(2, dtype=np.float64)
+    for _ in range(ts.num_trees):
+        _next_tree(*edge_diff_args, tree, num_samples, cursor, interval)
+        parent = tree[_PARENT].copy()
+        left_child = tree[_LEFT_CHILD].copy()
+        right_sib = tree[_RIGHT_SIB].copy()
+        yield core.create_tree_dataset(
+            parent=parent,
+            time=time,
+            left_child=left_child,
+            right_sib=right_sib,
+            samples=samples,
+        )
+
+
+def from_tskit_sequence(ts: tskit.TreeSequence, *, forest=False):
+    """
+    Converts all trees in the specified tree sequence in a single pass along
+    the sequence. The trees are built by applying the edge differences
+    between adjacent trees, as tskit does, rather than by seeking to each tree.
+
+    By default, an iterator over tree datasets is returned. These are the same
+    as those returned by :func:`from_tskit` for each tree, except that they
+    share a single (read-only) node time array. If ``forest`` is True, a
+    forest dataset holding all of the trees is returned instead. Here, each
+    tree holds only the nodes reachable from its roots, numbered in increasing
+    order of node ID in the tree sequence, and ``tree_id`` is the tree's index.
+
+    :param tskit.TreeSequence ts: The tree sequence.
+    :param bool forest: If True, return a forest dataset of all trees.
+    :return: An iterator over tree datasets, or a forest dataset.
+    """
+    edge_diff_args = _edge_diff_args(ts)
+    if not forest:
+        return _iterate_tskit_trees(ts, edge_diff_args)
+    samples = ts.samples()
+    parent, left_child, right_sib, time, sample_node, node_offset = (
+        _forest_from_edge_diffs(*edge_diff_args, ts.num_trees, ts.nodes_time, samples)
+    )
+    return core.create_forest_dataset(
+        parent=parent,
+        left_child=left_child,
+        right_sib=right_sib,
+        time=time,
+        samples=sample_node,
+        node_offset=node_offset,
+        sample_offset=np.arange(ts.num_trees + 1) * len(samples),
+        tree_id=np.arange(ts.num_trees),
+    )
+
+
+def _edge_order(parent, child, time, left=None):
+    # The edges must be sorted by time of parent, then parent ID, child ID
+    # and left coordinate for tskit to load them without sorting.
+    keys = (child, parent, time[parent])
+    if left is not None:
+        keys = (left,) + keys
+    return np.lexsort(keys)
+
+
 def to_tskit(ds: xarray.Dataset) -> tskit.Tree:
     tables = tskit.TableCollection(1)
     N = ds.sizes[core.DIM_NODE] - 1
     flags = np.zeros(N, dtype=np.uint32)
     flags[ds.sample_node.to_numpy()] = tskit.NODE_IS_SAMPLE
-    tables.nodes.set_columns(flags=flags, time=ds.node_time[:-1])
-    # TODO do this more efficiently.
-    for u, parent in enumerate(ds.node_parent):
-        if parent != -1:
-            tables.edges.add_row(0, 1, int(parent), u)
-    tables.sort()
+    time = ds.node_time.data[:-1]
+    tables.nodes.set_columns(flags=flags, time=time)
+    parent = ds.node_parent.data[:-1]
+    child = np.where(parent != -1)[0].astype(np.int32)
+    parent = parent[child]
+    order = _edge_order(parent, child, time)
+    tables.edges.set_columns(
+        left=np.zeros(len(child)),
+        right=np.ones(len(child)),
+        parent=parent[order],
+        child=child[order],
+    )
+    # As all edges span the same interval, edges are inserted in table order
+    # and removed in the reverse order, so we don't need tskit to build the
+    # index.
+    insertion = np.arange(len(child), dtype=np.int32)
+    tables.indexes = tskit.TableCollectionIndexes(
+        edge_insertion_order=insertion, edge_removal_order=insertion[::-1].copy()
+    )
     return tables.tree_sequence().first()
 
 
+def forest_to_tskit(ds: xarray.Dataset) -> tskit.TreeSequence:
+    """
+    Returns a tree sequence holding the trees in the specified forest dataset,
+    where tree ``j`` covers the interval ``[j, j + 1)``. The samples are shared
+    between the trees: if ``sample_id`` is present samples are matched by ID,
+    and otherwise by their position in each tree's samples. Sample nodes
+    ``0`` to ``n - 1`` are the samples in the order of the first tree, and are
+    followed by the remaining nodes of each tree in turn.
+
+    :param xarray.DataSet ds: The forest dataset, which must include node times.
+    :return: The tree sequence.
+    :rtype: tskit.TreeSequence
+    """
+    node_offset = ds.tree_node_offset.data
+    sample_offset = ds.tree_sample_offset.data
+    num_trees = len(node_offset) - 1
+    num_samples = np.diff(sample_offset)
+    if num_trees == 0:
+        raise ValueError("Cannot convert a forest with no trees")
+    n = num_samples[0]
+    if np.any(num_samples != n):
+        raise ValueError("All trees must have the same number of samples")
+    node_tree = np.repeat(np.arange(num_trees), np.diff(node_offset))
+    sample_tree = np.repeat(np.arange(num_trees), num_samples)
+    sample_node = ds.sample_node.data + node_offset[sample_tree]
+    if "sample_id" in ds:
+        sample_id = np.asarray(ds.sample_id.data)
+        reference = sample_id[:n]
+        sorter = np.argsort(reference)
+        index = np.searchsorted(reference, sample_id, sorter=sorter)
+        sample_index = sorter[np.minimum(index, n - 1)]
+        if np.any(reference[sample_index] != sample_id):
+            raise ValueError("All trees must have the same sample IDs")
+    else:
+        sample_index = np.arange(len(sample_node)) - sample_offset[sample_tree]
+
+    # Map the nodes of each tree to their IDs in the tree sequence, leaving the
+    # virtual roots as -1.
+    is_virtual_root = np.zeros(node_offset[-1], dtype=bool)
+    is_virtual_root[node_offset[1:] - 1] = True
+    is_other = ~is_virtual_root
+    is_other[sample_node] = False
+    node_map = np.full(node_offset[-1], -1, dtype=np.int32)
+    node_map[sample_node] = sample_index
+    node_map[is_other] = n + np.arange(np.sum(is_other))
+
+    node_time = ds.node_time.data
+    time = np.zeros(n + np.sum(is_other))
+    time[sample_index] = node_time[sample_node]
+    if np.any(time[sample_index] != node_time[sample_node]):
+        raise ValueError("Sample times must be the same in all trees")
+    time[n:] = node_time[is_other]
+    flags = np.zeros(len(time), dtype=np.uint32)
+    flags[:n] = tskit.NODE_IS_SAMPLE
+
+    parent = ds.node_parent.data
+    has_parent = parent != -1
+    child = node_map[has_parent]
+    parent = node_map[parent[has_parent] + node_offset[node_tree[has_parent]]]
+    left = node_tree[has_parent]
+    order = _edge_order(parent, child, time, left)
+
+    parent = parent[order]
+    child = child[order]
+    left = left[order]
+    tables = tskit.TableCollection(num_trees)
+    tables.nodes.set_columns(flags=flags, time=time)
+    tables.edges.set_columns(
+        left=left.astype(np.float64), right=left + 1.0, parent=parent, child=child
+    )
+    # Edges are inserted in order of (left, parent time, parent, child) and
+    # removed in order of right and then the reverse of this.
+    parent_time = time[parent]
+    tables.indexes = tskit.TableCollectionIndexes(
+        edge_insertion_order=np.lexsort((child, parent, parent_time, left)).astype(
+            np.int32
+        ),
+        edge_removal_order=np.lexsort((-child, -parent, -parent_time, left)).astype(
+            np.int32
+        ),
+    )
+    return tables.tree_sequence()
+
+
+_OPEN = ord("(")
+_CLOSE = ord(")")
+_COMMA = ord(",")
+_COLON = ord(":")
+_SEMICOLON = ord(";")
+_QUOTE = ord("'")
+_COMMENT_OPEN = ord("[")
+_COMMENT_CLOSE = ord("]")
+
+# Mantissas with at most 15 significant digits and powers of ten up to 1e22 are
+# exactly representable as doubles, so a single multiplication or division of
+# the two is correctly rounded and matches Python's float() exactly. Anything
+# else is left for float() to parse.
+_MAX_FAST_DIGITS = 15
+_POW10 = np.array([10.0**k for k in range(23)])
+
+
+@jit.numba_njit()
+def _is_space(c):
+    return c == 32 or (c >= 9 and c <= 13)
+
+
+@jit.numba_njit()
+def _is_delimiter(c):
+    return (
+        _is_space(c)
+        or c == _OPEN
+        or c == _CLOSE
+        or c == _COMMA
+        or c == _COLON
+        or c == _SEMICOLON
+        or c == _COMMENT_OPEN
+    )
+
+
+@jit.numba_njit()
+def _skip_comment(buf, j):
+    # j is the position of the opening bracket; returns the position after the
+    # closing bracket.
+    while j < buf.shape[0] and buf[j] != _COMMENT_CLOSE:
+        j += 1
+    if j == buf.shape[0]:
+        raise ValueError("Unterminated comment in newick string")
+    return j + 1
+
+
+@jit.numba_njit()
+def _parse_float(buf, start, stop):
+    # Returns NaN if the value could not be parsed exactly.
+    j = start
+    sign = 1.0
+    if j < stop and (buf[j] == 43 or buf[j] == 45):  # + -
+        if buf[j] == 45:
+            sign = -1.0
+        j += 1
+    mantissa = 0
+    num_digits = 0
+    # Zeros after the leading digit are only added to the mantissa when a
+    # non-zero digit follows, so that trailing zeros don't use up digits.
+    num_zeros = 0
+    exponent = 0
+    seen_digit = False
+    seen_point = False
+    while j < stop:
+        c = int(buf[j])
+        if c >= 48 and c <= 57:
+            seen_digit = True
+            if c == 48:
+                if mantissa > 0:
+                    num_zeros += 1
+            else:
+                num_digits += num_zeros + 1
+                if num_digits > _MAX_FAST_DIGITS:
+                    return np.nan
+                for _ in range(num_zeros):
+                    mantissa *= 10
+                num_zeros = 0
+                mantissa = mantissa * 10 + (c - 48)
+            if seen_point:
+                exponent -= 1
+        elif c == 46 and not seen_point:  # .
+            seen_point = True
+        else:
+            break
+        j += 1
+    if not seen_digit:
+        return np.nan
+    if j < stop and (buf[j] == 101 or buf[j] == 69):  # e E
+        j += 1
+        exp_sign = 1
+        if j < stop and (buf[j] == 43 or buf[j] == 45):
+            if buf[j] == 45:
+                exp_sign = -1
+            j += 1
+        if j == stop:
+            return np.nan
+        exp_value = 0
+        while j < stop and buf[j] >= 48 and buf[j] <= 57:
+            if exp_value < 10000:
+                exp_value = exp_value * 10 + (int(buf[j]) - 48)
+            j += 1
+        exponent += exp_sign * exp_value
+    if j != stop:
+        return np.nan
+    exponent += num_zeros
+    if mantissa == 0:
+        return sign * 0.0
+    if exponent > 22 or exponent < -22:
+        return np.nan
+    if exponent >= 0:
+        return sign * (mantissa * _POW10[exponent])
+    return sign * (mantissa / _POW10[-exponent])
+
+
+@jit.numba_njit()
+def _parse_newick(buf, max_trees):
+    """
+    Single-pass parser for a buffer of newick trees, each terminated by a
+    semicolon. The trees are written into concatenated arrays with CSR-style
+    node offsets, in the same layout as a forest dataset. Within each tree the
+    leaves are numbered 0 to n - 1 in the order they appear, the internal nodes
+    follow in preorder and the virtual root is last.
+    """
+    n = buf.shape[0]
+    # Every tree has one more leaf than it has commas and one internal node per
+    # open bracket, plus the virtual root. Commas and brackets within comments
+    # and quoted labels only make this bound looser.
+    capacity = 2
+    for j in range(n):
+        c = buf[j]
+        if c == _OPEN or c == _COMMA:
+            capacity += 1
+        elif c == _SEMICOLON:
+            capacity += 2
+    parent = np.full(capacity, -1, dtype=np.int32)
+    left_child = np.full(capacity, -1, dtype=np.int32)
+    right_sib = np.full(capacity, -1, dtype=np.int32)
+    branch_length = np.zeros(capacity, dtype=np.float64)
+    label_start = np.full(capacity, -1, dtype=np.int64)
+    label_stop = np.full(capacity, -1, dtype=np.int64)
+    length_start = np.full(capacity, -1, dtype=np.int64)
+    length_stop = np.full(capacity, -1, dtype=np.int64)
+    node_offset = np.zeros(capacity, dtype=np.int64)
+    num_leaves = np.zeros(capacity, dtype=np.int64)
+
+    # Scratch arrays for the tree currently being parsed, using the IDs in
+    # order of node creation.
+    t_parent = np.full(capacity, -1, dtype=np.int32)
+    t_left_child = np.full(capacity, -1, dtype=np.int32)
+    t_right_child = np.full(capacity, -1, dtype=np.int32)
+    t_right_sib = np.full(capacity, -1, dtype=np.int32)
+    t_branch_length = np.zeros(capacity, dtype=np.float64)
+    t_label_start = np.full(capacity, -1, dtype=np.int64)
+    t_label_stop = np.full(capacity, -1, dtype=np.int64)
+    t_length_start = np.full(capacity, -1, dtype=np.int64)
+    t_length_stop = np.full(capacity, -1, dtype=np.int64)
+    new_id = np.zeros(capacity, dtype=np.int32)
+    stack = np.zeros(capacity, dtype=np.int32)
+
+    num_trees = 0
+    num_nodes = 0
+    stack_top = -1
+    current = -1
+    expect_subtree = True
+    j = 0
+    while j <= n and num_trees < max_trees:
+        c = _SEMICOLON if j == n else buf[j]
+        if j == n and num_nodes == 0:
+            break
+        if _is_space(c):
+            j += 1
+            continue
+        if c == _COMMENT_OPEN:
+            j = _skip_comment(buf, j)
+            continue
+        if expect_subtree and c != _SEMICOLON:
+            # Create the next node as the right-most child of the node on the
+            # top of the stack, or as the root.
+            if stack_top == -1 and num_nodes > 0:
+                raise ValueError("Malformed newick string: multiple roots")
+            u = num_nodes
+            num_nodes += 1
+            t_parent[u] = -1
+            t_left_child[u] = -1
+            t_right_child[u] = -1
+            t_right_sib[u] = -1
+            t_branch_length[u] = 0
+            t_label_start[u] = -1
+            t_label_stop[u] = -1
+            t_length_start[u] = -1
+            t_length_stop[u] = -1
+            if stack_top >= 0:
+                p = stack[stack_top]
+                t_parent[u] = p
+                if t_left_child[p] == -1:
+                    t_left_child[p] = u
+                else:
+                    t_right_sib[t_right_child[p]] = u
+                t_right_child[p] = u
+            current = u
+            expect_subtree = False
+            if c == _OPEN:
+                stack_top += 1
+                stack[stack_top] = u
+                expect_subtree = True
+                j += 1
+            continue
+        if c == _OPEN:
+            raise ValueError("Malformed newick string: unexpected '('")
+        elif c == _COMMA:
+            if stack_top == -1:
+                raise ValueError("Malformed newick string: unexpected ','")
+            expect_subtree = True
+            j += 1
+        elif c == _CLOSE:
+            if stack_top == -1:
+                raise ValueError("Malformed newick string: unbalanced ')'")
+            current = stack[stack_top]
+            stack_top -= 1
+            j += 1
+        elif c == _COLON:
+            if t_length_start[current] != -1:
+                raise ValueError("Malformed newick string: repeated branch length")
+            j += 1
+            while j < n and (_is_space(buf[j]) or buf[j] == _COMMENT_OPEN):
+                if buf[j] == _COMMENT_OPEN:
+                    j = _skip_comment(buf, j)
+                else:
+                    j += 1
+            start = j
+            while j < n and not _is_delimiter(buf[j]):
+                j += 1
+            t_branch_length[current] = _parse_float(buf, start, j)
+            t_length_start[current] = start
+            t_length_stop[current] = j
+        elif c == _SEMICOLON:
+            if stack_top != -1:
+                raise ValueError("Malformed newick string: unbalanced '('")
+            j += 1
+            if num_nodes == 0:
+                continue
+            # Renumber so that leaves come first, and copy into the output.
+            offset = node_offset[num_trees]
+            leaves = 0
+            for u in range(num_nodes):
+                if t_left_child[u] == -1:
+                    new_id[u] = leaves
+                    leaves += 1
+            internal = leaves
+            for u in range(num_nodes):
+                if t_left_child[u] != -1:
+                    new_id[u] = internal
+                    internal += 1
+            for u in range(num_nodes):
+                v = offset + new_id[u]
+                parent[v] = -1 if t_parent[u] == -1 else new_id[t_parent[u]]
+                left_child[v] = -1 if t_left_child[u] == -1 else new_id[t_left_child[u]]
+                right_sib[v] = -1 if t_right_sib[u] == -1 else new_id[t_right_sib[u]]
+                branch_length[v] = t_branch_length[u]
+                label_start[v] = t_label_start[u]
+                label_stop[v] = t_label_stop[u]
+                length_start[v] = t_length_start[u]
+                length_stop[v] = t_length_stop[u]
+            # The first node created is the root.
+            left_child[offset + num_nodes] = new_id[0]
+            num_leaves[num_trees] = leaves
+            num_trees += 1
+            node_offset[num_trees] = offset + num_nodes + 1
+            num_nodes = 0
+            current = -1
+            expect_subtree = True
+        else:
+            # A label for the current node.
+            if t_label_start[current] != -1 or t_length_start[current] != -1:
+                raise ValueError("Malformed newick string: unexpected label")
+            start = j
+            if c == _QUOTE:
+                j += 1
+                while True:
+                    if j >= n:
+                        raise ValueError("Unterminated quoted label in newick string")
+                    if buf[j] == _QUOTE:
+                        if j + 1 < n and buf[j + 1] == _QUOTE:
+                            j += 2
+                            continue
+                        j += 1
+                        break
+                    j += 1
+            else:
+                while j < n and not _is_delimiter(buf[j]):
+                    j += 1
+            t_label_start[current] = start
+            t_label_stop[current] = j
+
+    total = node_offset[num_trees]
+    return (
+        parent[:total],
+        left_child[:total],
+        right_sib[:total],
+        branch_length[:total],
+        label_start[:total],
+        label_stop[:total],
+        length_start[:total],
+        length_stop[:total],
+        node_offset[: num_trees + 1],
+        num_leaves[:num_trees],
+    )
+
+
+def _gather_bytes(buf, start, stop):
+    """
+    Returns the specified byte ranges of the buffer as an array of bytes
+    strings. Missing ranges (start == -1) are returned as empty strings.
+    """
+    length = np.where(start == -1, 0, stop - start)
+    width = max(1, int(np.max(length, initial=0)))
+    index = start[:, np.newaxis] + np.arange(width)
+    mask = np.arange(width) < length[:, np.newaxis]
+    chars = np.where(mask, buf[np.clip(index, 0, max(0, len(buf) - 1))], 0)
+    return np.ascontiguousarray(chars, dtype=np.uint8).view(f"S{width}")[:, 0]
+
+
+def _decode_labels(buf, start, stop):
+    """
+    Returns the labels in the specified byte ranges of the buffer as an array
+    of strings. Missing labels (start == -1) are returned as empty strings.
+    """
+    labels = _gather_bytes(buf, start, stop)
+    try:
+        labels = labels.astype("U")
+    except UnicodeDecodeError:
+        labels = np.char.decode(labels, "utf-8")
+    # Quoted labels are rare, so we unquote them individually.
+    for j in np.where(np.char.startswith(labels, "'"))[0]:
+        labels[j] = labels[j][1:-1].replace("''", "'")
+    return labels
+
+
+def _parse_newick_buffer(data, max_trees):
+    """
+    Parse the newick trees in the specified bytes, returning the tree arrays,
+    sample labels and offsets in the layout of a forest dataset.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    (
+        parent,
+        left_child,
+        right_sib,
+        branch_length,
+        label_start,
+        label_stop,
+        length_start,
+        length_stop,
+        node_offset,
+        num_leaves,
+    ) = _parse_newick(buf, max_trees)
+    # Fall back to numpy for any branch lengths that couldn't be parsed exactly.
+    fallback = np.where(np.isnan(branch_length))[0]
+    if len(fallback) > 0:
+        lengths = _gather_bytes(buf, length_start[fallback], length_stop[fallback])
+        branch_length[fallback] = lengths.astype(np.float64)
+    sample_offset = np.zeros(len(num_leaves) + 1, dtype=np.int64)
+    np.cumsum(num_leaves, out=sample_offset[1:])
+    samples = np.arange(sample_offset[-1]) - np.repeat(sample_offset[:-1], num_leaves)
+    samples = samples.astype(np.int32)
+    sample_nodes = samples + np.repeat(node_offset[:-1], num_leaves)
+    sample_id = _decode_labels(buf, label_start[sample_nodes], label_stop[sample_nodes])
+    return (
+        parent,
+        left_child,
+        right_sib,
+        branch_length,
+        samples,
+        sample_id,
+        node_offset,
+        sample_offset,
+    )
+
+
 def from_newick(s: str) -> xarray.Dataset:
-    # Using the newick module for now, but we will
-    # want to have our own performant version of this, either here or via
-    # conversion in tskit.
-    trees = newick.loads(s)
-    # NOTE: not bothering with error checking for now.
-    tree = trees[0]
-    id_map = {}
-    samples = []
-    parent = []
-    left_child = []
-    right_sib = []
-    branch_length = []
-    sample_name = []
+    """
+    Returns a tree dataset for the first tree in the specified newick string.
+    Leaves are taken to be the samples, and are numbered in the order that
+    they appear in the string.
 
+    :param str s: The newick string.
+    :return: The tree dataset.
+    :rtype: xarray.DataSet
+    """
+    data = s.encode() if isinstance(s, str) else bytes(s)
+    (
+        parent,
+        left_child,
+        right_sib,
+        branch_length,
+        samples,
+        sample_id,
+        node_offset,
+        _,
+    ) = _parse_newick_buffer(data, 1)
+    if len(node_offset) == 1:
+        raise ValueError("No trees found in newick string")
     # We need to be able to work with trees that do not have meaningful node times,
     # so we store the branch lengths from the newick. We can compute node times
     # later, if they are needed.
+    return core.create_tree_dataset(
+        parent=parent,
+        left_child=left_child,
+        right_sib=right_sib,
+        branch_length=branch_length,
+        samples=samples,
+        sample_id=sample_id,
+    )
 
-    # NOTE: doing this in postorder for convenience, but this may not be the best
-    # way to do it when writing our own parser, so we shouldn't assume any particular
-    # assignment of IDs here.
-    for u, newick_node in enumerate(tree.walk("postorder")):
-        id_map[newick_node] = u
-        parent.append(-1)
-        left_child.append(-1)
-        right_sib.append(-1)
-        branch_length.append(newick_node.length)
-        left_sib = -1
-        for newick_child in newick_node.descendants:
-            v = id_map[newick_child]
-            parent[v] = u
-            if left_sib == -1:
-                left_child[u] = v
-            else:
-                right_sib[left_sib] = v
-            left_sib = v
-        if len(newick_node.descendants) == 0:
-            # Assume for now that samples are leaf nodes that always have names
-            samples.append(u)
-            sample_name.append("" if newick_node.name is None else newick_node.name)
-    parent.append(-1)
-    branch_length.append(0)
-    left_child.append(u)
-    right_sib.append(-1)
 
-    return core.create_tree_dataset(
-        parent=np.array(parent, dtype=np.int32),
-        left_child=np.array(left_child, dtype=np.int32),
-        right_sib=np.array(right_sib, dtype=np.int32),
-        branch_length=np.array(branch_length),
-        samples=np.array(samples, dtype=np.int32),
-        sample_id=np.array(sample_name),
-    )
-
-
-# Naive efforts to JIT this failed miserably. Probably we'll have to write
-# an iterative version with a pre-allocated output array like the C version
-# used in tskit.
-def _to_newick(node, left_child, right_sib, branch_length, label):
-    child = left_child[node]
-    if child == -1:
-        s = label[node]
+@jit.numba_njit()
+def _find_statement_ends(buf, state):
+    """
+    Returns the positions of the semicolons in buf that terminate a statement,
+    that is, those not within a comment or a quoted label. Whether the scan is
+    within a comment or quote is kept in the state array, so that a file can
+    be scanned a chunk at a time.
+    """
+    ends = np.zeros(buf.shape[0], dtype=np.int64)
+    num_ends = 0
+    in_comment = state[0]
+    in_quote = state[1]
+    for j in range(buf.shape[0]):
+        c = buf[j]
+        if in_comment:
+            if c == _COMMENT_CLOSE:
+                in_comment = False
+        elif c == _QUOTE:
+            # An escaped quote ('') leaves us in the same state.
+            in_quote = not in_quote
+        elif not in_quote:
+            if c == _COMMENT_OPEN:
+                in_comment = True
+            elif c == _SEMICOLON:
+                ends[num_ends] = j
+                num_ends += 1
+    state[0] = in_comment
+    state[1] = in_quote
+    return ends[:num_ends]
+
+
+def _read_statements(file, chunk_size):
+    """
+    Yields the semicolon-terminated statements in the specified binary file
+    (without the terminating semicolon), reading it in chunks of chunk_size
+    bytes. A final statement without a semicolon is also returned.
+    """
+    state = np.zeros(2, dtype=np.bool_)
+    carry = b""
+    while True:
+        chunk = file.read(chunk_size)
+        if len(chunk) == 0:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        ends = _find_statement_ends(np.frombuffer(chunk, dtype=np.uint8), state)
+        data = carry + chunk
+        start = 0
+        for end in ends + len(carry):
+            yield data[start:end]
+            start = end + 1
+        carry = data[start:]
+    if len(carry.strip()) > 0:
+        yield carry
+
+
+_NEXUS_COMMAND = re.compile(rb"\s*(?:\[[^\]]*\]\s*)*(\S*)\s*(.*)", re.DOTALL)
+# The tree name, and any comments, up to the "=" in a tree command.
+_NEXUS_TREE_NAME = re.compile(rb"(?:\[[^\]]*\]|'(?:[^']|'')*'|[^=\['])*=")
+_NEXUS_TOKEN = re.compile(r"'(?:[^']|'')*'|[^\s,]+|,")
+
+
+def _unquote(label):
+    if label.startswith("'"):
+        return label[1:-1].replace("''", "'")
+    return label
+
+
+def _parse_translate(body):
+    """
+    Returns the mapping from tokens to taxon labels in the body of a nexus
+    translate command.
+    """
+    tokens = _NEXUS_TOKEN.findall(body.decode())
+    translate = {}
+    j = 0
+    while j < len(tokens):
+        if j + 1 >= len(tokens) or "," in tokens[j : j + 2]:
+            raise ValueError("Malformed nexus translate command")
+        translate[_unquote(tokens[j])] = _unquote(tokens[j + 1])
+        j += 2
+        if j < len(tokens):
+            if tokens[j] != ",":
+                raise ValueError("Malformed nexus translate command")
+            j += 1
+    return translate
+
+
+def _newick_statements(statements):
+    # Yields (newick, translate) for each tree in a newick file.
+    for statement in statements:
+        if len(statement.strip()) > 0:
+            yield statement, None
+
+
+def _nexus_statements(statements):
+    # Yields (newick, translate) for each tree command in the trees blocks of
+    # a nexus file.
+    in_trees = False
+    translate = None
+    for statement in statements:
+        command, body = _NEXUS_COMMAND.match(statement).groups()
+        command = command.lower()
+        if command == b"#nexus":
+            command, body = _NEXUS_COMMAND.match(body).groups()
+            command = command.lower()
+        if command == b"begin":
+            in_trees = body.strip().lower() == b"trees"
+            translate = None
+        elif command in (b"end", b"endblock"):
+            in_trees = False
+        elif in_trees and command == b"translate":
+            translate = _parse_translate(body)
+        elif in_trees and command in (b"tree", b"utree"):
+            match = _NEXUS_TREE_NAME.match(body)
+            if match is None:
+                raise ValueError("Malformed nexus tree command")
+            yield body[match.end() :], translate
+
+
+def _parse_tree_batch(newicks, translate, tree_id, as_forest):
+    """
+    Parses the specified newick strings, returning a forest dataset of the
+    trees if as_forest is True and a list of tree datasets otherwise.
+    """
+    data = b";".join(newicks) + b";"
+    (
+        parent,
+        left_child,
+        right_sib,
+        branch_length,
+        samples,
+        sample_id,
+        node_offset,
+        sample_offset,
+    ) = _parse_newick_buffer(data, len(newicks))
+    if len(node_offset) - 1 != len(newicks):
+        raise ValueError("Empty tree in newick input")
+    if translate is not None:
+        labels, inverse = np.unique(sample_id, return_inverse=True)
+        labels = np.array([translate.get(label, label) for label in labels])
+        sample_id = labels[inverse]
+    if as_forest:
+        return core.create_forest_dataset(
+            parent=parent,
+            left_child=left_child,
+            right_sib=right_sib,
+            branch_length=branch_length,
+            samples=samples,
+            sample_id=sample_id,
+            node_offset=node_offset,
+            sample_offset=sample_offset,
+            tree_id=np.asarray(tree_id, dtype=np.int64),
+        )
+    trees = []
+    for j in range(len(newicks)):
+        nodes = slice(node_offset[j], node_offset[j + 1])
+        sample_range = slice(sample_offset[j], sample_offset[j + 1])
+        trees.append(
+            core.create_tree_dataset(
+                parent=parent[nodes],
+                left_child=left_child[nodes],
+                right_sib=right_sib[nodes],
+                branch_length=branch_length[nodes],
+                samples=samples[sample_range],
+                sample_id=sample_id[sample_range],
+            )
+        )
+    return trees
+
+
+def _tree_batches(trees, burnin, thin, batch_size):
+    # Groups the selected trees into batches of (newicks, translate, tree_id),
+    # starting a new batch whenever the translate table changes.
+    newicks = []
+    tree_id = []
+    batch_translate = None
+    for j, (newick, translate) in enumerate(trees):
+        if j < burnin or (j - burnin) % thin != 0:
+            continue
+        if len(newicks) > 0 and translate is not batch_translate:
+            yield newicks, batch_translate, tree_id
+            newicks = []
+            tree_id = []
+        batch_translate = translate
+        newicks.append(newick)
+        tree_id.append(j)
+        if len(newicks) == batch_size:
+            yield newicks, batch_translate, tree_id
+            newicks = []
+            tree_id = []
+    if len(newicks) > 0:
+        yield newicks, batch_translate, tree_id
+
+
+# Trees are parsed in groups of this many when yielded individually, to
+# amortise the cost of calling the parser.
+_PARSE_BATCH_SIZE = 256
+
+
+def _read_trees(file, file_format, burnin, thin, batch_size, chunk_size, num_workers):
+    if isinstance(file, (str, pathlib.Path)):
+        with open(file, "rb") as f:
+            yield from _read_trees(
+                f, file_format, burnin, thin, batch_size, chunk_size, num_workers
+            )
+        return
+    statements = _read_statements(file, chunk_size)
+    first = next(statements, None)
+    if first is None:
+        return
+    statements = itertools.chain([first], statements)
+    if file_format is None:
+        file_format = (
+            "nexus" if first.lstrip().lower().startswith(b"#nexus") else "newick"
+        )
+    if file_format == "newick":
+        trees = _newick_statements(statements)
     else:
-        s = "("
-        while child != -1:
-            subtree = _to_newick(
-                node=child,
-                left_child=left_child,
-                right_sib=right_sib,
-                branch_length=branch_length,
-                label=label,
+        trees = _nexus_statements(statements)
+
+    as_forest = batch_size is not None
+    batches = _tree_batches(
+        trees, burnin, thin, batch_size if as_forest else _PARSE_BATCH_SIZE
+    )
+    if num_workers == 0:
+        for batch in batches:
+            result = _parse_tree_batch(*batch, as_forest)
+            yield from ([result] if as_forest else result)
+        return
+
+    # Keep a bounded number of batches in flight so that memory use doesn't
+    # depend on the length of the file. The workers are spawned rather than
+    # forked, as forking after a parallel kernel has started numba's threading
+    # layer (which is not fork-safe) can deadlock the workers and the parent.
+    mp_context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+        num_workers, mp_context=mp_context
+    ) as executor:
+        pending = collections.deque()
+        for batch in itertools.chain(batches, [None]):
+            if batch is not None:
+                pending.append(executor.submit(_parse_tree_batch, *batch, as_forest))
+            while len(pending) > 0 and (
+                batch is None or len(pending) > 2 * num_workers
+            ):
+                result = pending.popleft().result()
+                yield from ([result] if as_forest else result)
+
+
+def read_trees(
+    file,
+    *,
+    file_format=None,
+    burnin=0,
+    thin=1,
+    batch_size=None,
+    chunk_size=2**20,
+    num_workers=0,
+):
+    """
+    Reads the trees in the specified newick or nexus file, yielding them one
+    at a time as tree datasets or, if ``batch_size`` is specified, in forest
+    datasets of ``batch_size`` trees (the last may hold fewer). The file is
+    read in chunks so that memory use does not depend on its length.
+
+    A newick file holds a sequence of semicolon-terminated trees. For a nexus
+    file, the ``tree`` commands within ``trees`` blocks are read and any
+    ``translate`` table is applied to the sample IDs. Trees are numbered in
+    the order they appear in the file, and the ``tree_id`` of each tree in a
+    forest is this index.
+
+    :param file: The path of the file, or a file object to read from.
+    :param str file_format: The file format, either "newick" or "nexus". If not
+        specified, files starting with "#NEXUS" are read as nexus and all others
+        as newick.
+    :param int burnin: The number of trees to skip at the start of the file.
+    :param int thin: Keep every ``thin``-th tree after the burn-in.
+    :param int batch_size: If specified, yield forest datasets of this many trees.
+    :param int chunk_size: The number of bytes to read from the file at a time.
+    :param int num_workers: If greater than zero, parse batches of trees on a pool
+        of this many processes. The processes are started with the "spawn"
+        method, so a script using them must guard its entry point with
+        ``if __name__ == "__main__":``.
+    :return: An iterator over tree or forest datasets.
+    :rtype: iterator
+    """
+    if burnin < 0:
+        raise ValueError("burnin must be non-negative")
+    if thin < 1:
+        raise ValueError("thin must be at least 1")
+    if batch_size is not None and batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    if num_workers < 0:
+        raise ValueError("num_workers must be non-negative")
+    if file_format not in (None, "newick", "nexus"):
+        raise ValueError(f"Unknown tree file format: {file_format}")
+    return _read_trees(
+        file, file_format, burnin, thin, batch_size, chunk_size, num_workers
+    )
+
+
+# Formatting of branch lengths follows Python's "%.*g", which we reproduce in
+# the kernel when the rounding decision is unambiguous in double precision.
+# Values where it isn't (including exact ties, which Python rounds to even on
+# the exact binary value) and precisions beyond what doubles hold exactly are
+# formatted by Python instead.
+_MAX_FAST_PRECISION = 15
+
+
+@jit.numba_njit()
+def _write_digits(value, num_digits, out, pos):
+    for k in range(num_digits - 1, -1, -1):
+        out[pos + k] = 48 + value % 10
+        value //= 10
+    return pos + num_digits
+
+
+@jit.numba_njit()
+def _format_g(x, precision, out):
+    """
+    Writes x formatted as "%.{precision}g" to the start of out, returning the
+    number of bytes written, or -1 if Python should format the value.
+    """
+    if not np.isfinite(x) or precision > _MAX_FAST_PRECISION:
+        return -1
+    pos = 0
+    if x < 0 or (x == 0 and np.signbit(x)):
+        out[pos] = 45  # -
+        pos += 1
+        x = -x
+    if x == 0:
+        out[pos] = 48
+        return pos + 1
+    exponent = int(np.floor(np.log10(x)))
+    digits = -1
+    for _ in range(3):
+        shift = precision - 1 - exponent
+        if shift > 22 or shift < -22:
+            return -1
+        if shift >= 0:
+            scaled = x * _POW10[shift]
+        else:
+            scaled = x / _POW10[-shift]
+        # log10 may be off by one close to powers of ten.
+        if scaled < _POW10[precision - 1]:
+            exponent -= 1
+        elif scaled >= _POW10[precision]:
+            exponent += 1
+        else:
+            base = np.floor(scaled)
+            fraction = scaled - base
+            if abs(fraction - 0.5) <= scaled * 2.0**-50:
+                return -1
+            digits = int(base) + (1 if fraction > 0.5 else 0)
+            break
+    if digits == -1:
+        return -1
+    if digits == int(_POW10[precision]):
+        digits //= 10
+        exponent += 1
+    # Strip trailing zeros, which %g never shows.
+    num_digits = precision
+    while num_digits > 1 and digits % 10 == 0:
+        digits //= 10
+        num_digits -= 1
+    if exponent < -4 or exponent >= precision:
+        lead = digits
+        for _ in range(num_digits - 1):
+            lead //= 10
+        out[pos] = 48 + lead
+        pos += 1
+        if num_digits > 1:
+            out[pos] = 46  # .
+            pos += 1
+            pos = _write_digits(
+                digits - lead * int(_POW10[num_digits - 1]),
+                num_digits - 1,
+                out,
+                pos,
             )
-            subtree += ":" + branch_length[child]
-            s += subtree + ","
-            child = right_sib[child]
-        s = s[:-1] + ")" + label[node]
-    return s
+        out[pos] = 101  # e
+        out[pos + 1] = 45 if exponent < 0 else 43
+        pos += 2
+        exponent = abs(exponent)
+        pos = _write_digits(exponent, 3 if exponent >= 100 else 2, out, pos)
+    elif exponent < 0:
+        out[pos] = 48
+        out[pos + 1] = 46
+        pos += 2
+        for _ in range(-exponent - 1):
+            out[pos] = 48
+            pos += 1
+        pos = _write_digits(digits, num_digits, out, pos)
+    else:
+        # exponent + 1 digits before the decimal point.
+        if num_digits <= exponent + 1:
+            pos = _write_digits(digits, num_digits, out, pos)
+            for _ in range(exponent + 1 - num_digits):
+                out[pos] = 48
+                pos += 1
+        else:
+            fraction_digits = num_digits - exponent - 1
+            scale = int(_POW10[fraction_digits])
+            pos = _write_digits(digits // scale, exponent + 1, out, pos)
+            out[pos] = 46
+            pos += 1
+            pos = _write_digits(digits % scale, fraction_digits, out, pos)
+    return pos
+
+
+@jit.numba_njit(parallel=True)
+def _format_branch_lengths(branch_length, precision):
+    width = precision + 8
+    chars = np.zeros((branch_length.shape[0], width), dtype=np.uint8)
+    length = np.zeros(branch_length.shape[0], dtype=np.int32)
+    for u in prange(branch_length.shape[0]):
+        length[u] = _format_g(branch_length[u], precision, chars[u])
+    return chars, length
+
+
+def _to_char_matrix(strings):
+    """
+    Returns the specified strings encoded as UTF-8 in the rows of a 2D uint8
+    array, along with the length of each.
+    """
+    try:
+        encoded = strings.astype("S")
+    except UnicodeEncodeError:
+        encoded = np.char.encode(strings, "utf-8")
+    width = max(1, encoded.dtype.itemsize)
+    encoded = encoded.astype(f"S{width}")
+    chars = encoded.view(np.uint8).reshape(len(encoded), width)
+    return chars, np.char.str_len(encoded).astype(np.int32)
+
 
+@jit.numba_njit()
+def _format_node_labels(nodes):
+    """
+    Returns the default "n{u}" labels for the specified nodes in the rows of
+    a 2D uint8 array, along with the length of each.
+    """
+    max_node = max(1, np.max(nodes)) if nodes.shape[0] > 0 else 1
+    width = 1 + int(np.log10(max_node)) + 1
+    chars = np.zeros((nodes.shape[0], width), dtype=np.uint8)
+    length = np.zeros(nodes.shape[0], dtype=np.int32)
+    for j in range(nodes.shape[0]):
+        u = nodes[j]
+        num_digits = 1
+        while u >= 10**num_digits:
+            num_digits += 1
+        chars[j, 0] = 110  # n
+        length[j] = _write_digits(u, num_digits, chars[j], 1)
+    return chars, length
 
-def to_newick(ds: xarray.Dataset, *, precision=6) -> str:
-    # TODO define node_branch_length as a variable, following pattern in sgkit
+
+_ENTER = 0
+_EXIT = 1
+_DONE = 2
+
+
+@jit.numba_njit(inline="always")
+def _write_node_suffix(
+    u, parent, label_index, label_chars, label_len, bl_chars, bl_len, out, pos
+):
+    k = label_index[u]
+    if k != -1:
+        for j in range(label_len[k]):
+            out[pos] = label_chars[k, j]
+            pos += 1
+    if parent[u] != -1:
+        out[pos] = _COLON
+        pos += 1
+        for j in range(bl_len[u]):
+            out[pos] = bl_chars[u, j]
+            pos += 1
+    return pos
+
+
+@jit.numba_njit()
+def _write_newick(
+    parent,
+    left_child,
+    right_sib,
+    label_index,
+    label_chars,
+    label_len,
+    bl_chars,
+    bl_len,
+    state,
+    out,
+    pos,
+):
+    """
+    Writes the newick representation of the tree into out starting at pos,
+    returning the new position. The traversal is driven by parent pointers so
+    no stack is needed, and its state (the current node and whether we are
+    entering or leaving it) is kept in the state array, so that the writer can
+    be resumed with a fresh buffer when out is full.
+    """
+    # The longest output written by a single step below.
+    max_step = label_chars.shape[1] + bl_chars.shape[1] + 3
+    u = state[0]
+    phase = state[1]
+    while phase != _DONE and pos + max_step <= out.shape[0]:
+        if phase == _ENTER:
+            v = left_child[u]
+            if v != -1:
+                out[pos] = _OPEN
+                pos += 1
+                u = v
+            else:
+                pos = _write_node_suffix(
+                    u,
+                    parent,
+                    label_index,
+                    label_chars,
+                    label_len,
+                    bl_chars,
+                    bl_len,
+                    out,
+                    pos,
+                )
+                phase = _EXIT
+        else:
+            if parent[u] == -1:
+                out[pos] = _SEMICOLON
+                pos += 1
+                u = right_sib[u]
+                if u == -1:
+                    phase = _DONE
+                else:
+                    # Each root in a multiroot tree is written as its own tree.
+                    out[pos] = 10
+                    pos += 1
+                    phase = _ENTER
+            elif right_sib[u] != -1:
+                out[pos] = _COMMA
+                pos += 1
+                u = right_sib[u]
+                phase = _ENTER
+            else:
+                u = parent[u]
+                out[pos] = _CLOSE
+                pos += 1
+                pos = _write_node_suffix(
+                    u,
+                    parent,
+                    label_index,
+                    label_chars,
+                    label_len,
+                    bl_chars,
+                    bl_len,
+                    out,
+                    pos,
+                )
+    state[0] = u
+    state[1] = phase
+    return pos
+
+
+def _newick_writer_args(ds, precision):
+    parent = ds.node_parent.data
     if "node_branch_length" in ds:
         branch_length = ds.node_branch_length.data
     else:
-        branch_length = ds.node_time[ds.node_parent] - ds.node_time
+        branch_length = util._get_node_branch_length(parent, ds.node_time.data)
+    # %g treats a precision of 0 as 1.
+    precision = max(1, precision)
+    bl_chars, bl_len = _format_branch_lengths(branch_length, precision)
+    fallback = np.where(bl_len == -1)[0]
+    if len(fallback) > 0:
+        formatted = np.array(
+            ["%.*g" % (precision, x) for x in branch_length[fallback]], dtype="S"
+        )
+        width = max(bl_chars.shape[1], formatted.dtype.itemsize)
+        if width > bl_chars.shape[1]:
+            bl_chars = np.pad(bl_chars, ((0, 0), (0, width - bl_chars.shape[1])))
+        fallback_chars, fallback_len = _to_char_matrix(formatted)
+        bl_chars[fallback, : fallback_chars.shape[1]] = fallback_chars
+        bl_len[fallback] = fallback_len
 
-    # Convert branch_length and node labels to an array of strings to simplify
-    # the conversion process. We'll probably need to do this differently if/when
-    # we try to do it in a more efficient way.
-    branch_length = ["{0:.{1}g}".format(x, precision) for x in branch_length.data]
-    node_label = ["" for _ in branch_length]
+    samples = ds.sample_node.data
     if "sample_id" in ds:
-        for u, label in zip(ds.sample_node.data, ds.sample_id.data):
-            node_label[u] = label
+        labels = np.asarray(ds.sample_id.data).astype(str)
+        label_chars, label_len = _to_char_matrix(labels)
     else:
-        for u in ds.sample_node.data:
-            node_label[u] = f"n{u}"
-    node_label = np.array(node_label)
-    branch_length = np.array(branch_length)
-    root = ds.node_left_child.data[-1]
-    # TODO deal with multiroots
-    s = _to_newick(
-        node=root,
-        left_child=ds.node_left_child.data,
-        right_sib=ds.node_right_sib.data,
-        branch_length=branch_length,
-        label=node_label,
+        label_chars, label_len = _format_node_labels(samples)
+    label_index = np.full(parent.shape[0], -1, dtype=np.int32)
+    label_index[samples] = np.arange(len(samples), dtype=np.int32)
+    return (
+        parent,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        label_index,
+        label_chars,
+        label_len,
+        bl_chars,
+        bl_len,
     )
-    return s + ";"
+
+
+def to_newick(ds: xarray.Dataset, *, precision=6, file=None, buffer_size=2**20):
+    """
+    Returns the newick representation of the tree. Sample nodes are labelled
+    with their ``sample_id`` if present and ``n{u}`` otherwise, and branch
+    lengths are formatted as with ``"%.{precision}g"``. Each root of a
+    multiroot tree is written as a separate newick tree on its own line.
+
+    If ``file`` is specified, the output is written to it in chunks of at
+    most ``buffer_size`` bytes instead of being returned, so that the full
+    string is never held in memory.
+
+    :param xarray.DataSet ds: The tree dataset.
+    :param int precision: The number of significant digits in branch lengths.
+    :param file: A text or binary file object to write the output to.
+    :param int buffer_size: The size of the output buffer in bytes.
+    :return: The newick string, or None if ``file`` is specified.
+    :rtype: str
+    """
+    args = _newick_writer_args(ds, precision)
+    _, _, _, _, label_chars, _, bl_chars, _ = args
+    # Leave room for at least one step of the writer.
+    buffer_size = max(buffer_size, label_chars.shape[1] + bl_chars.shape[1] + 3)
+    root = ds.node_left_child.data[-1]
+    state = np.array([root, _ENTER if root != -1 else _DONE], dtype=np.int64)
+    out = np.zeros(buffer_size, dtype=np.uint8)
+    if file is None:
+        pos = 0
+        while True:
+            pos = _write_newick(*args, state, out, pos)
+            if state[1] == _DONE:
+                break
+            out = np.concatenate([out, np.zeros_like(out)])
+        return out[:pos].tobytes().decode()
+
+    text = isinstance(file, io.TextIOBase)
+    while state[1] != _DONE:
+        pos = _write_newick(*args, state, out, 0)
+        chunk = out[:pos].tobytes()
+        file.write(chunk.decode() if text else chunk)
+    return None
@@ -1,13 +1,26 @@
+import numpy as np
 import xarray
 
+from .traversal import _forest_postorder
+from .traversal import _forest_preorder
 from .traversal import _postorder
 from .traversal import _preorder
+from .util import _forest_node_branch_length
 from .util import _get_node_branch_length
 
 DIM_NODE = "nodes"
 DIM_TRAVERSAL = "traversal"
 # Following sgkit example, specifically so that we can join on the samples dimension
 DIM_SAMPLE = "samples"
+DIM_VARIANT = "variants"
+DIM_TREE = "trees"
+# Forest offsets are CSR-style with one more element than the number of trees,
+# so they need a dimension of their own.
+DIM_TREE_OFFSET = "tree_offsets"
+# The entries of the Kendall-Colijn vectors of a collection of trees.
+DIM_KC_ENTRY = "kc_entries"
+# The unique genotype columns (site patterns) of the variants.
+DIM_SITE_PATTERN = "site_patterns"
 
 
 # TODO add some defaults
@@ -59,3 +72,160 @@ def create_tree_dataset(
         data_vars["sample_id"] = ([DIM_SAMPLE], sample_id)
 
     return xarray.Dataset(data_vars)
+
+
+def create_forest_dataset(
+    *,
+    parent,
+    left_child,
+    right_sib,
+    samples,
+    node_offset,
+    sample_offset,
+    time=None,
+    branch_length=None,
+    sample_id=None,
+    preorder=None,
+    postorder=None,
+    traversal_offset=None,
+    tree_id=None,
+):
+    """
+    Create a dataset holding a collection of trees. The per-node, per-sample and
+    traversal arrays of each tree are concatenated, and the range belonging to
+    tree ``j`` is given by ``offset[j]:offset[j + 1]`` in the corresponding
+    CSR-style offset array. Node IDs are local to each tree, so that each slice
+    is a valid tree in the same encoding as :func:`create_tree_dataset`
+    (including the virtual root as the last node of the slice).
+    """
+    node_offset = np.asarray(node_offset, dtype=np.int64)
+    sample_offset = np.asarray(sample_offset, dtype=np.int64)
+    if node_offset.shape != sample_offset.shape:
+        raise ValueError("Node and sample offsets must have the same length")
+    if (preorder is None) != (postorder is None) or (
+        (preorder is not None) != (traversal_offset is not None)
+    ):
+        raise ValueError(
+            "preorder, postorder and traversal_offset must be specified together"
+        )
+    if preorder is None:
+        preorder, traversal_offset = _forest_preorder(
+            parent, left_child, right_sib, node_offset
+        )
+        postorder, _ = _forest_postorder(left_child, right_sib, node_offset)
+    data_vars = {
+        "node_parent": ([DIM_NODE], parent),
+        "node_left_child": ([DIM_NODE], left_child),
+        "node_right_sib": ([DIM_NODE], right_sib),
+        "sample_node": ([DIM_SAMPLE], samples),
+        "traversal_preorder": ([DIM_TRAVERSAL], preorder),
+        "traversal_postorder": ([DIM_TRAVERSAL], postorder),
+        "tree_node_offset": ([DIM_TREE_OFFSET], node_offset),
+        "tree_sample_offset": ([DIM_TREE_OFFSET], sample_offset),
+        "tree_traversal_offset": (
+            [DIM_TREE_OFFSET],
+            np.asarray(traversal_offset, dtype=np.int64),
+        ),
+    }
+    if time is not None:
+        data_vars["node_time"] = ([DIM_NODE], time)
+    if branch_length is not None:
+        data_vars["node_branch_length"] = ([DIM_NODE], branch_length)
+    elif time is not None:
+        data_vars["node_branch_length"] = (
+            [DIM_NODE],
+            _forest_node_branch_length(parent, time, node_offset),
+        )
+    if sample_id is not None:
+        data_vars["sample_id"] = ([DIM_SAMPLE], sample_id)
+    if tree_id is not None:
+        data_vars["tree_id"] = ([DIM_TREE], tree_id)
+
+    return xarray.Dataset(data_vars)
+
+
+def get_num_trees(ds):
+    """
+    Returns the number of trees in the specified forest dataset.
+
+    :param xarray.DataSet ds: The forest dataset.
+    :return : The number of trees.
+    :rtype : int
+    """
+    return ds.sizes[DIM_TREE_OFFSET] - 1
+
+
+def concat_trees(trees, tree_id=None):
+    """
+    Returns a forest dataset containing the specified tree datasets.
+
+    Optional variables (``node_time``, ``node_branch_length`` and ``sample_id``)
+    are kept only if they are present in all of the input trees.
+
+    :param list trees: The tree datasets to concatenate.
+    :param tree_id: Optional identifiers for the trees.
+    :return: A forest dataset.
+    :rtype: xarray.DataSet
+    """
+    trees = list(trees)
+    if len(trees) == 0:
+        raise ValueError("At least one tree is required")
+
+    def offsets(dim):
+        return np.concatenate([[0], np.cumsum([ds.sizes[dim] for ds in trees])])
+
+    def concat(name):
+        if all(name in ds for ds in trees):
+            return np.concatenate([ds[name].data for ds in trees])
+        return None
+
+    return create_forest_dataset(
+        parent=concat("node_parent"),
+        left_child=concat("node_left_child"),
+        right_sib=concat("node_right_sib"),
+        samples=concat("sample_node"),
+        node_offset=offsets(DIM_NODE),
+        sample_offset=offsets(DIM_SAMPLE),
+        time=concat("node_time"),
+        branch_length=concat("node_branch_length"),
+        sample_id=concat("sample_id"),
+        preorder=concat("traversal_preorder"),
+        postorder=concat("traversal_postorder"),
+        traversal_offset=offsets(DIM_TRAVERSAL),
+        tree_id=tree_id,
+    )
+
+
+def get_tree(ds, index):
+    """
+    Returns the tree at the specified index in a forest dataset as a
+    single-tree dataset.
+
+    :param xarray.DataSet ds: The forest dataset.
+    :param int index: The index of the tree.
+    :return: The tree dataset.
+    :rtype: xarray.DataSet
+    """
+    num_trees = get_num_trees(ds)
+    if index < -num_trees or index >= num_trees:
+        raise IndexError(f"Tree {index} is not in the forest")
+    index = index % num_trees
+
+    def span(name):
+        offset = ds[name].data
+        return slice(int(offset[index]), int(offset[index + 1]))
+
+    forest_vars = [
+        "tree_node_offset",
+        "tree_sample_offset",
+        "tree_traversal_offset",
+    ]
+    if "tree_id" in ds:
+        forest_vars.append("tree_id")
+    return ds.drop_vars(forest_vars).isel(
+        {
+            DIM_NODE: span("tree_node_offset"),
+            DIM_SAMPLE: span("tree_sample_offset"),
+            DIM_TRAVERSAL: span("tree_traversal_offset"),
+        }
+    )
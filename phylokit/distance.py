@@ -1,6 +1,12 @@
 # Tree distance metrics.
+import itertools
+
 import numpy as np
+import xarray
+from numba import prange
 
+from . import core
+from . import dataset
 from . import jit
 from . import util
 
@@ -23,16 +29,170 @@ def _mrca(parent, time, u, v):
     return u
 
 
-def _sv_mrca(ds, u, v):
-    # TODO - Schieber, B. and U. Vishkin (1988).
-    # "On Finding Lowest Common Ancestors: Simplification and Parallelization."
-    # SIAM Journal on Computing 17(6): 1253-1262.
-    pass
+@jit.numba_njit()
+def _highest_bit(x):
+    # The position of the highest set bit of x > 0, by binary search.
+    h = 0
+    if x >= 1 << 32:
+        x >>= 32
+        h += 32
+    if x >= 1 << 16:
+        x >>= 16
+        h += 16
+    if x >= 1 << 8:
+        x >>= 8
+        h += 8
+    if x >= 1 << 4:
+        x >>= 4
+        h += 4
+    if x >= 1 << 2:
+        x >>= 2
+        h += 2
+    if x >= 1 << 1:
+        h += 1
+    return h
+
+
+@jit.numba_njit()
+def _lowest_bit(x):
+    return _highest_bit(x & -x)
+
+
+@jit.numba_njit()
+def _sv_index(preorder, postorder, parent):
+    """
+    Returns the Schieber-Vishkin arrays for the tree with the specified
+    traversals: the preorder rank, inlabel (beta) and ascendant (alpha) of each
+    node and, for each inlabel k, the parent of the head of the path of nodes
+    labelled k (tau[k - 1]). The virtual root is taken to be the root of the
+    tree, so that nodes with no common ancestor have the virtual root as MRCA.
+    Nodes not in the tree have a rank and inlabel of 0.
+    """
+    num_nodes = parent.shape[0]
+    virtual_root = num_nodes - 1
+    rank = np.zeros(num_nodes, dtype=np.int64)
+    beta = np.zeros(num_nodes, dtype=np.int64)
+    alpha = np.zeros(num_nodes, dtype=np.int64)
+    tau = np.full(num_nodes, -1, dtype=np.int32)
+    size = np.zeros(num_nodes, dtype=np.int64)
+
+    rank[virtual_root] = 1
+    for j in range(preorder.shape[0]):
+        rank[preorder[j]] = j + 2
+    for u in postorder:
+        size[u] += 1
+        p = parent[u]
+        if p == -1:
+            p = virtual_root
+        size[p] += size[u]
+    size[virtual_root] += 1
+
+    # The inlabel of a node is the number within the preorder ranks of its
+    # subtree with the most trailing zeros.
+    for j in range(-1, preorder.shape[0]):
+        u = virtual_root if j == -1 else preorder[j]
+        last = rank[u] + size[u] - 1
+        h = _highest_bit((rank[u] - 1) ^ last)
+        beta[u] = (last >> h) << h
+        p = -1 if u == virtual_root else parent[u]
+        if p == -1 and u != virtual_root:
+            p = virtual_root
+        if p == -1:
+            alpha[u] = beta[u] & -beta[u]
+            tau[beta[u] - 1] = -1
+        else:
+            alpha[u] = alpha[p] | (beta[u] & -beta[u])
+            if beta[u] != beta[p]:
+                # u is the head of its path, as its parent has a different label.
+                tau[beta[u] - 1] = p
+    return rank, beta, alpha, tau
+
+
+@jit.numba_njit()
+def _sv_climb(tau, alpha, beta, x, j):
+    # Returns the lowest ancestor of x on the path whose inlabel has j trailing
+    # zeros.
+    if _lowest_bit(beta[x]) == j:
+        return x
+    k = _highest_bit(alpha[x] & ((1 << j) - 1))
+    label = (((beta[x] >> (k + 1)) << 1) | 1) << k
+    return tau[label - 1]
+
+
+@jit.numba_njit()
+def _sv_mrca(tau, alpha, beta, rank, u, v):
+    """
+    Returns the MRCA of u and v in constant time using the Schieber-Vishkin
+    arrays, or -1 if they have no common ancestor.
+
+    Schieber, B. and U. Vishkin (1988).
+    "On Finding Lowest Common Ancestors: Simplification and Parallelization."
+    SIAM Journal on Computing 17(6): 1253-1262.
+    """
+    if u == v:
+        return u
+    # Using the same integer type throughout is much faster for int32 IDs.
+    u = np.int64(u)
+    v = np.int64(v)
+    bu = beta[u]
+    bv = beta[v]
+    if bu == 0 or bv == 0:
+        return -1
+    virtual_root = beta.shape[0] - 1
+    if bu == bv:
+        z = u if rank[u] < rank[v] else v
+    else:
+        # The height of the MRCA of the inlabels in the complete binary tree
+        # is the highest of the differing bit and the heights of the labels.
+        i = max(_highest_bit(bu ^ bv), _lowest_bit(bu), _lowest_bit(bv))
+        j = _lowest_bit(alpha[u] & alpha[v] & -(1 << i))
+        x = _sv_climb(tau, alpha, beta, u, j)
+        y = _sv_climb(tau, alpha, beta, v, j)
+        z = x if rank[x] < rank[y] else y
+    return -1 if z == virtual_root else z
+
+
+def append_mrca_index(ds):
+    """
+    Append the Schieber-Vishkin index to the dataset, after which :func:`mrca`
+    queries take constant time. The index must be recomputed if the tree is
+    changed.
+
+    :param xarray.DataSet ds: The tree dataset.
+    :return: The dataset with the index appended.
+    :rtype: xarray.DataSet
+    """
+    rank, beta, alpha, tau = _sv_index(
+        ds.traversal_preorder.data,
+        ds.traversal_postorder.data,
+        ds.node_parent.data,
+    )
+    ds["sv_rank"] = (core.DIM_NODE, rank)
+    ds["sv_beta"] = (core.DIM_NODE, beta)
+    ds["sv_alpha"] = (core.DIM_NODE, alpha)
+    ds["sv_tau"] = (core.DIM_NODE, tau)
+    return ds
+
+
+def _mrca_index_args(ds):
+    # The index arrays passed to jitted functions, which are empty if the
+    # dataset has no index.
+    if "sv_tau" in ds:
+        return (
+            ds.sv_tau.data,
+            ds.sv_alpha.data,
+            ds.sv_beta.data,
+            ds.sv_rank.data,
+        )
+    empty = np.zeros(0, dtype=np.int64)
+    return (np.zeros(0, dtype=np.int32), empty, empty, empty)
 
 
 def mrca(ds, u, v):
     """
-    Returns the most recent common ancestor of the specified nodes.
+    Returns the most recent common ancestor of the specified nodes. If the
+    dataset has an index added by :func:`append_mrca_index` this takes
+    constant time, and otherwise time proportional to the depth of the nodes.
 
     :param xarray.DataArray ds: The tree to compare.
     :param int u: The first node ID.
@@ -47,37 +207,162 @@ def mrca(ds, u, v):
     if u == virtual_root or v == virtual_root:
         return virtual_root
     if "sv_tau" in ds:
-        return _sv_mrca(ds, u, v)
+        return _sv_mrca(*_mrca_index_args(ds), u, v)
     else:
         return _mrca(ds.node_parent.data, ds.node_time.data, u, v)
 
 
+@jit.numba_njit(parallel=True)
+def _mrca_batch(parent, time, tau, alpha, beta, rank, us, vs):
+    # The index arrays are empty if the tree has no index.
+    virtual_root = parent.shape[0] - 1
+    has_index = tau.shape[0] > 0
+    ret = np.empty(us.shape[0], dtype=np.int32)
+    for j in prange(us.shape[0]):
+        u = us[j]
+        v = vs[j]
+        if u == virtual_root or v == virtual_root:
+            ret[j] = virtual_root
+        elif has_index:
+            ret[j] = _sv_mrca(tau, alpha, beta, rank, u, v)
+        else:
+            ret[j] = _mrca(parent, time, u, v)
+    return ret
+
+
+def mrca_batch(ds, us, vs):
+    """
+    Returns the most recent common ancestors of the specified arrays of node
+    pairs, as given by :func:`mrca` for each pair. The queries are answered in
+    parallel, using the index added by :func:`append_mrca_index` if present.
+
+    :param xarray.DataArray ds: The tree dataset.
+    :param numpy.ndarray us: The first node ID of each pair.
+    :param numpy.ndarray vs: The second node ID of each pair.
+    :return: The most recent common ancestor of each pair.
+    :rtype: numpy.ndarray
+    """
+    us = np.asarray(us)
+    vs = np.asarray(vs)
+    if us.shape != vs.shape:
+        raise ValueError("us and vs must have the same shape")
+    num_nodes = ds.node_parent.data.shape[0] - 1
+    for nodes in [us, vs]:
+        out_of_bounds = (nodes < 0) | (nodes > num_nodes)
+        if np.any(out_of_bounds):
+            u = nodes.flat[np.argmax(out_of_bounds)]
+            raise ValueError(f"Node {u} is not in the tree")
+    ret = _mrca_batch(
+        ds.node_parent.data,
+        ds.node_time.data,
+        *_mrca_index_args(ds),
+        us.ravel().astype(np.int64),
+        vs.ravel().astype(np.int64),
+    )
+    return ret.reshape(us.shape)
+
+
+@jit.numba_njit()
+def _node_depth(preorder, parent):
+    # The number of edges between each node and its root.
+    depth = np.zeros(parent.shape[0], dtype=np.int32)
+    for u in preorder:
+        if parent[u] != -1:
+            depth[u] = depth[parent[u]] + 1
+    return depth
+
+
 @jit.numba_njit()
-def _kc_distance(samples, ds1, ds2):
-    # ds1 and ds2 are tuples of the form (parent_array, time_array, branch_length, root)
+def _kc_vectors(samples, postorder, left_child, right_sib, depth, time, branch_length):
+    # The MRCA of each pair of samples is the node at which their sample lists
+    # are first merged, so we find all pairs in one postorder pass, keeping a
+    # linked list of the sample indexes below each node as in tskit.
     n = samples.shape[0]
     N = (n * (n - 1)) // 2
-    m = [np.zeros(N + n), np.zeros(N + n)]
-    M = [np.zeros(N + n), np.zeros(N + n)]
-    for tree_index, tree in enumerate([ds1, ds2]):
-        for sample in range(n):
-            m[tree_index][N + sample] = 1
-            M[tree_index][N + sample] = tree[2][sample]
-
-        for n1 in range(n):
-            for n2 in range(n1 + 1, n):
-                mrca_id = _mrca(tree[0], tree[1], samples[n1], samples[n2])
-                depth = 0
-                p = tree[0][mrca_id]
-                while p != -1:
-                    depth += 1
-                    p = tree[0][p]
-                pair_index = n1 * (n1 - 2 * n + 1) // -2 + n2 - n1 - 1
-                m[tree_index][pair_index] = depth
-                M[tree_index][pair_index] = tree[1][tree[3]] - tree[1][mrca_id]
+    m = np.zeros(N + n)
+    M = np.zeros(N + n)
+    root_time = time[left_child[-1]]
+    sample_index = np.full(left_child.shape[0], -1, dtype=np.int64)
+    for j in range(n):
+        sample_index[samples[j]] = j
+        m[N + j] = 1
+        M[N + j] = branch_length[samples[j]]
+
+    head = np.full(left_child.shape[0], -1, dtype=np.int64)
+    tail = np.full(left_child.shape[0], -1, dtype=np.int64)
+    next_sample = np.full(n, -1, dtype=np.int64)
+    for u in postorder:
+        first = sample_index[u]
+        last = first
+        v = left_child[u]
+        while v != -1:
+            if head[v] != -1:
+                if first != -1:
+                    # Every pair with one sample below v and the other below
+                    # an earlier child of u (or u itself) has u as its MRCA.
+                    a = head[v]
+                    while True:
+                        b = first
+                        while True:
+                            i = min(a, b)
+                            j = max(a, b)
+                            pair_index = i * (2 * n - i - 1) // 2 + j - i - 1
+                            m[pair_index] = depth[u]
+                            M[pair_index] = root_time - time[u]
+                            if b == last:
+                                break
+                            b = next_sample[b]
+                        if a == tail[v]:
+                            break
+                        a = next_sample[a]
+                    next_sample[last] = head[v]
+                else:
+                    first = head[v]
+                last = tail[v]
+            v = right_sib[v]
+        head[u] = first
+        tail[u] = last
     return m, M
 
 
+def _kc_tree_vectors(ds):
+    if util.get_num_roots(ds) != 1:
+        raise ValueError("Trees must have a single root")
+    if util.is_unary(ds):
+        raise ValueError("Unary nodes are not supported")
+    return _kc_vectors(
+        ds.sample_node.data,
+        ds.traversal_postorder.data,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        _node_depth(ds.traversal_preorder.data, ds.node_parent.data),
+        ds.node_time.data,
+        ds.node_branch_length.data,
+    )
+
+
+def kc_vector(ds, lambda_=0.0):
+    """
+    Returns the Kendall-Colijn vector of the specified tree, so that the
+    Kendall-Colijn distance between two trees with the same samples is the
+    Euclidean distance between their vectors. The first n(n - 1) / 2 entries
+    correspond to the pairs of samples, in the order ``(0, 1), (0, 2), ...,
+    (n - 2, n - 1)``, and the last n entries to the samples themselves.
+    The vector is built in a single postorder pass over the tree, taking
+    O(n^2) time for n samples.
+
+    .. seealso::
+        See :func:`kc_distance` for details.
+
+    :param xarray.DataArray ds: The tree dataset.
+    :param float lambda_: The weight of topology in the vector.
+    :return : The Kendall-Colijn vector of the tree.
+    :rtype : numpy.ndarray
+    """
+    m, M = _kc_tree_vectors(ds)
+    return (1 - lambda_) * m + lambda_ * M
+
+
 def kc_distance(ds1, ds2, lambda_=0.0):
     """
     Returns the Kendall-Colijn distance between the specified pair of trees.
@@ -96,61 +381,66 @@ def kc_distance(ds1, ds2, lambda_=0.0):
     :return : The Kendall-Colijn distance between the trees.
     :rtype : float
     """
-    samples = ds1.sample_node.data
-    if not np.array_equal(samples, ds2.sample_node.data):
+    if not np.array_equal(ds1.sample_node.data, ds2.sample_node.data):
         raise ValueError("Trees must have the same samples")
-    if util.get_num_roots(ds1) != 1 or util.get_num_roots(ds2) != 1:
-        raise ValueError("Trees must have a single root")
-    for tree in [ds1, ds2]:
-        if util.is_unary(tree):
-            raise ValueError("Unary nodes are not supported")
-
-    m, M = _kc_distance(
-        samples,
-        (
-            ds1.node_parent.data,
-            ds1.node_time.data[:-1],
-            ds1.node_branch_length.data,
-            ds1.node_left_child.data[-1],
-        ),
-        (
-            ds2.node_parent.data,
-            ds2.node_time.data[:-1],
-            ds2.node_branch_length.data,
-            ds2.node_left_child.data[-1],
-        ),
-    )
+    return np.linalg.norm(kc_vector(ds1, lambda_) - kc_vector(ds2, lambda_))
+
 
-    return np.linalg.norm((1 - lambda_) * (m[0] - m[1]) + lambda_ * (M[0] - M[1]))
+def _node_hashes(num_nodes):
+    # The SplitMix64 finaliser applied to the node IDs, giving well mixed
+    # 64-bit hashes that are the same for a given node ID in every tree.
+    x = np.arange(num_nodes, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
 
 
-def get_node_partition(postorder, left_child, right_sib):
+@jit.numba_njit()
+def _split_hashes(postorder, left_child, right_sib, leaf_hash):
     """
-    This is a naive implementation of encoding a node's partition
-    using python's set operations to calculate the unweighted robinson
-    foulds distance (symmetric distance)
-    NOTE: This pure python implementation is faster than the jitted implementation,
-    the speed of traversing the tree is faster in jitted version, but it took to
-    much time calculating bitwise_or, therefore we use the naive implementation for
-    now.
-    NOTE: A potential optimization is using bit shifting rather than bitwise_or
+    Returns a 64-bit hash of the set of leaves below each node in the
+    postorder, where the hash of a set is the XOR of the hashes of its leaves.
+    Two different sets of leaves have the same hash with probability 2^-64.
+    The empty set (for nodes not in the tree) has hash 0.
     """
-    tree_sets = [set()] * (len(left_child) - 1)
+    num_nodes = left_child.shape[0] - 1
+    node_hash = np.zeros(num_nodes, dtype=np.uint64)
     for u in postorder:
         v = left_child[u]
         if v == -1:
-            tree_sets[u] = {u}
+            node_hash[u] = leaf_hash[u]
         else:
+            h = node_hash[v]
+            v = right_sib[v]
             while v != -1:
-                tree_sets[u] = tree_sets[u] | tree_sets[v]
+                h ^= node_hash[v]
                 v = right_sib[v]
+            node_hash[u] = h
+    ret = node_hash[postorder]
+    if postorder.shape[0] < num_nodes:
+        # Nodes that aren't in the tree have the empty set of leaves.
+        ret = np.append(ret, np.zeros(1, dtype=np.uint64))
+    return ret
+
 
-    return tree_sets
+def _unique_splits(ds):
+    left_child = ds.node_left_child.data
+    return np.unique(
+        _split_hashes(
+            ds.traversal_postorder.data,
+            left_child,
+            ds.node_right_sib.data,
+            _node_hashes(left_child.shape[0] - 1),
+        )
+    )
 
 
 def rf_distance(ds1, ds2):
     """
     Returns the Robinson-Foulds distance between the specified pair of trees.
+    Each tree is represented by the sets of leaves below its nodes, which are
+    compared using randomised 64-bit hashes of the sets, so that the distance
+    is computed in O(n log n) time and O(n) memory.
 
     .. seealso::
         See `Robinson & Foulds (1981)
@@ -164,18 +454,497 @@ def rf_distance(ds1, ds2):
     if util.get_num_roots(ds1) != 1 or util.get_num_roots(ds2) != 1:
         raise ValueError("Trees must have a single root")
 
-    b1 = get_node_partition(
-        ds1.traversal_postorder.data,
-        ds1.node_left_child.data,
-        ds1.node_right_sib.data,
+    s1 = _unique_splits(ds1)
+    s2 = _unique_splits(ds2)
+    num_shared = len(np.intersect1d(s1, s2, assume_unique=True))
+    return len(s1) + len(s2) - 2 * num_shared
+
+
+@jit.numba_njit(parallel=True)
+def _forest_unique_splits(
+    postorder, left_child, right_sib, node_offset, traversal_offset, leaf_hash
+):
+    # Tree j's sorted unique split hashes are stored in the buffer starting at
+    # traversal_offset[j] + j, leaving room for the empty split.
+    num_trees = node_offset.shape[0] - 1
+    buffer = np.zeros(postorder.shape[0] + num_trees, dtype=np.uint64)
+    count = np.zeros(num_trees, dtype=np.int64)
+    num_roots = np.zeros(num_trees, dtype=np.int64)
+    for j in prange(num_trees):
+        start = node_offset[j]
+        stop = node_offset[j + 1]
+        num_roots[j] = util._get_num_roots(
+            left_child[start:stop], right_sib[start:stop]
+        )
+        splits = np.sort(
+            _split_hashes(
+                postorder[traversal_offset[j] : traversal_offset[j + 1]],
+                left_child[start:stop],
+                right_sib[start:stop],
+                leaf_hash,
+            )
+        )
+        offset = traversal_offset[j] + j
+        k = 0
+        for i in range(splits.shape[0]):
+            if i == 0 or splits[i] != splits[i - 1]:
+                buffer[offset + k] = splits[i]
+                k += 1
+        count[j] = k
+    return buffer, count, num_roots
+
+
+def _split_table(ds):
+    """
+    Returns the shared split table for the trees in the specified forest,
+    as the CSR-style arrays (tree_split_offset, tree_splits) listing the
+    split IDs in each tree, and (split_tree_offset, split_trees) listing the
+    trees containing each split in increasing order. Splits which are in
+    all of the trees do not affect the distances and are left out.
+    """
+    node_offset = ds.tree_node_offset.data
+    traversal_offset = ds.tree_traversal_offset.data
+    num_trees = node_offset.shape[0] - 1
+    buffer, count, num_roots = _forest_unique_splits(
+        ds.traversal_postorder.data,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        node_offset,
+        traversal_offset,
+        _node_hashes(np.max(np.diff(node_offset), initial=1) - 1),
+    )
+    if np.any(num_roots != 1):
+        raise ValueError("Trees must have a single root")
+    # Gather the first count[j] entries of each tree's range in the buffer.
+    start = traversal_offset[:-1] + np.arange(num_trees) - np.cumsum(count) + count
+    hashes = buffer[np.repeat(start, count) + np.arange(np.sum(count))]
+    tree = np.repeat(np.arange(num_trees), count)
+    _, split, split_count = np.unique(hashes, return_inverse=True, return_counts=True)
+    split = split.reshape(-1)
+    shared = split_count < num_trees
+    keep = shared[split]
+    # Renumber the splits that are not in all of the trees consecutively.
+    split = (np.cumsum(shared) - 1)[split[keep]]
+    tree = tree[keep]
+    num_splits = np.sum(shared)
+
+    tree_split_offset = np.zeros(num_trees + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tree, minlength=num_trees), out=tree_split_offset[1:])
+    split_tree_offset = np.zeros(num_splits + 1, dtype=np.int64)
+    np.cumsum(np.bincount(split, minlength=num_splits), out=split_tree_offset[1:])
+    # A stable sort keeps the trees in increasing order within each split.
+    split_trees = tree[np.argsort(split, kind="stable")]
+    return tree_split_offset, split, split_tree_offset, split_trees
+
+
+@jit.numba_njit(parallel=True)
+def _rf_distance_matrix(
+    row_start,
+    row_stop,
+    col_start,
+    col_stop,
+    tree_split_offset,
+    tree_splits,
+    split_tree_offset,
+    split_trees,
+):
+    # Each row of the block is computed independently by counting the
+    # splits that tree i shares with each of the trees in the column range.
+    ret = np.zeros((row_stop - row_start, col_stop - col_start), dtype=np.int32)
+    num_splits = np.diff(tree_split_offset)
+    for i in prange(row_stop - row_start):
+        row = ret[i]
+        tree = row_start + i
+        for k in range(tree_split_offset[tree], tree_split_offset[tree + 1]):
+            trees = split_trees[
+                split_tree_offset[tree_splits[k]] : split_tree_offset[
+                    tree_splits[k] + 1
+                ]
+            ]
+            start = np.searchsorted(trees, col_start)
+            stop = np.searchsorted(trees, col_stop)
+            for j in trees[start:stop]:
+                row[j - col_start] += 1
+        for j in range(col_stop - col_start):
+            row[j] = num_splits[tree] + num_splits[col_start + j] - 2 * row[j]
+    return ret
+
+
+def rf_distance_matrix(trees, *, chunks=None):
+    """
+    Returns the matrix of Robinson-Foulds distances between all pairs of the
+    specified trees. The splits of each tree are hashed once into a table
+    shared by all of the trees, and the number of splits shared by each pair
+    of trees is counted in parallel from the list of trees containing each
+    split, as in HashRF. The distances are the same as :func:`rf_distance`.
+
+    For large collections of trees the matrix can be computed as a dask array,
+    in blocks of the specified size, which can then be computed in parallel
+    or written to zarr with :func:`dask.array.to_zarr`.
+
+    .. seealso::
+        See `Sul & Williams (2008)
+        <https://doi.org/10.1007/978-3-540-79450-9_28>`_ for more details.
+
+    :param trees: A forest dataset, or an iterable of tree datasets.
+    :param int chunks: If specified, return a dask array divided into
+        blocks of this size rather than a numpy array.
+    :return : The distance between each pair of trees.
+    :rtype : numpy.ndarray or dask.array.Array
+    """
+    if chunks is not None and chunks < 1:
+        raise ValueError("Chunk size must be positive")
+    if not isinstance(trees, xarray.Dataset):
+        trees = core.concat_trees(trees)
+    elif "tree_node_offset" not in trees:
+        trees = core.concat_trees([trees])
+    table = _split_table(trees)
+    num_trees = core.get_num_trees(trees)
+    if chunks is None:
+        return _rf_distance_matrix(0, num_trees, 0, num_trees, *table)
+
+    import dask.array as da
+
+    sizes = tuple(min(chunks, num_trees - j) for j in range(0, num_trees, chunks))
+
+    def block(block_info=None):
+        (row_start, row_stop), (col_start, col_stop) = block_info[None][
+            "array-location"
+        ]
+        return _rf_distance_matrix(row_start, row_stop, col_start, col_stop, *table)
+
+    return da.map_blocks(
+        block,
+        dtype=np.int32,
+        chunks=(sizes, sizes),
+        meta=np.empty((0, 0), dtype=np.int32),
+    )
+
+
+@jit.numba_njit(parallel=True)
+def _forest_kc_vectors(
+    samples,
+    postorder,
+    preorder,
+    parent,
+    left_child,
+    right_sib,
+    time,
+    branch_length,
+    node_offset,
+    sample_offset,
+    traversal_offset,
+):
+    num_trees = node_offset.shape[0] - 1
+    n = samples.shape[0] // max(num_trees, 1)
+    m = np.zeros((num_trees, n * (n - 1) // 2 + n), dtype=np.int32)
+    M = np.zeros((num_trees, n * (n - 1) // 2 + n))
+    status = np.zeros(num_trees, dtype=np.int32)
+    for j in prange(num_trees):
+        nodes = slice(node_offset[j], node_offset[j + 1])
+        traversal = slice(traversal_offset[j], traversal_offset[j + 1])
+        tree_samples = samples[sample_offset[j] : sample_offset[j + 1]]
+        if not np.array_equal(tree_samples, samples[:n]):
+            status[j] = 1
+        elif util._get_num_roots(left_child[nodes], right_sib[nodes]) != 1:
+            status[j] = 2
+        elif util._is_unary(postorder[traversal], left_child[nodes], right_sib[nodes]):
+            status[j] = 3
+        else:
+            tree_m, tree_M = _kc_vectors(
+                tree_samples,
+                postorder[traversal],
+                left_child[nodes],
+                right_sib[nodes],
+                _node_depth(preorder[traversal], parent[nodes]),
+                time[nodes],
+                branch_length[nodes],
+            )
+            m[j] = tree_m
+            M[j] = tree_M
+    return m, M, status
+
+
+def _kc_vectors_dataset(forest):
+    m, M, status = _forest_kc_vectors(
+        forest.sample_node.data,
+        forest.traversal_postorder.data,
+        forest.traversal_preorder.data,
+        forest.node_parent.data,
+        forest.node_left_child.data,
+        forest.node_right_sib.data,
+        forest.node_time.data,
+        forest.node_branch_length.data,
+        forest.tree_node_offset.data,
+        forest.tree_sample_offset.data,
+        forest.tree_traversal_offset.data,
     )
-    b2 = get_node_partition(
-        ds2.traversal_postorder.data,
-        ds2.node_left_child.data,
-        ds2.node_right_sib.data,
+    if np.any(status == 1):
+        raise ValueError("Trees must have the same samples")
+    if np.any(status == 2):
+        raise ValueError("Trees must have a single root")
+    if np.any(status == 3):
+        raise ValueError("Unary nodes are not supported")
+    dims = [core.DIM_TREE, core.DIM_KC_ENTRY]
+    return xarray.Dataset(
+        {
+            "tree_kc_topology": (dims, m),
+            "tree_kc_branch_length": (dims, M),
+        }
+    )
+
+
+def _forest_batches(trees, batch_size):
+    # Splits the trees into forests of at most batch_size trees.
+    if isinstance(trees, xarray.Dataset):
+        if "tree_node_offset" not in trees:
+            trees = core.concat_trees([trees])
+        num_trees = core.get_num_trees(trees)
+        if num_trees <= batch_size:
+            yield trees
+            return
+        forest = trees
+        trees = (core.get_tree(forest, j) for j in range(num_trees))
+    trees = iter(trees)
+    while True:
+        batch = list(itertools.islice(trees, batch_size))
+        if len(batch) == 0:
+            return
+        yield core.concat_trees(batch)
+
+
+def kc_vectors(trees, *, store=None, batch_size=1024):
+    """
+    Returns the Kendall-Colijn vectors of the specified trees as a dataset,
+    with the topology (``m``) and branch length (``M``) parts stored
+    separately in the ``tree_kc_topology`` and ``tree_kc_branch_length``
+    variables, so that the vectors for any value of lambda_ can be formed
+    from them without traversing the trees again. Vectors are computed in
+    parallel for batches of trees at a time.
+
+    If a zarr store is specified, each batch of vectors is appended to the
+    store as it is computed, and the returned dataset is read lazily from
+    the store, so that the vectors do not need to fit in memory.
+
+    .. seealso::
+        See :func:`kc_vector` for details.
+
+    :param trees: A forest dataset, or an iterable of tree datasets.
+    :param store: An optional zarr store to write the vectors to.
+    :param int batch_size: The number of trees to process at a time.
+    :return : The Kendall-Colijn vectors of the trees.
+    :rtype : xarray.DataSet
+    """
+    if batch_size < 1:
+        raise ValueError("Batch size must be positive")
+    samples = None
+    result = []
+    for forest in _forest_batches(trees, batch_size):
+        sample_node = forest.sample_node.data
+        num_samples = sample_node.shape[0] // core.get_num_trees(forest)
+        if samples is None:
+            samples = sample_node[:num_samples]
+        elif not np.array_equal(samples, sample_node[:num_samples]):
+            raise ValueError("Trees must have the same samples")
+        vectors = _kc_vectors_dataset(forest)
+        if store is None:
+            result.append(vectors)
+        elif len(result) == 0:
+            dataset.save_dataset(vectors, store, mode="w")
+            result.append(None)
+        else:
+            dataset.save_dataset(vectors, store, append_dim=core.DIM_TREE)
+    if len(result) == 0:
+        raise ValueError("At least one tree is required")
+    if store is None:
+        return xarray.concat(result, dim=core.DIM_TREE)
+    return dataset.open_dataset(store)
+
+
+# Squared distances smaller than this fraction of the sum of the squared
+# norms of the two vectors are recomputed from the vector differences.
+_KC_CANCELLATION = 1e-4
+
+
+def kc_distance_matrix(trees, lambda_=0.0, *, block_size=4096):
+    """
+    Returns the matrix of Kendall-Colijn distances between all pairs of the
+    specified trees. The vector of each tree is computed once, and the
+    distances are found from the Gram matrix of the vectors, computed in
+    blocks of ``block_size`` trees using multithreaded matrix products.
+    Distances between trees that are close enough for this to lose
+    precision are computed directly from the differences of the vectors.
+
+    The trees can also be given as the dataset returned by
+    :func:`kc_vectors`, so that the vectors (which may be stored in a zarr
+    store) are reused when computing the matrix for different values of
+    lambda_.
+
+    .. seealso::
+        See :func:`kc_distance` for details.
+
+    :param trees: A forest dataset, an iterable of tree datasets, or a
+        dataset of Kendall-Colijn vectors.
+    :param float lambda_: The weight of topology in the distance calculation.
+    :param int block_size: The number of trees in each block of the matrix.
+    :return : The distance between each pair of trees.
+    :rtype : numpy.ndarray
+    """
+    if block_size < 1:
+        raise ValueError("Block size must be positive")
+    if not (isinstance(trees, xarray.Dataset) and "tree_kc_topology" in trees):
+        trees = kc_vectors(trees)
+    m = trees.tree_kc_topology.data
+    M = trees.tree_kc_branch_length.data
+    num_trees = m.shape[0]
+
+    def vectors(start):
+        stop = min(start + block_size, num_trees)
+        return (1 - lambda_) * np.asarray(m[start:stop]) + lambda_ * np.asarray(
+            M[start:stop]
+        )
+
+    norm = np.zeros(num_trees)
+    for start in range(0, num_trees, block_size):
+        v = vectors(start)
+        norm[start : start + v.shape[0]] = np.einsum("ij,ij->i", v, v)
+
+    squared = np.zeros((num_trees, num_trees))
+    for start1 in range(0, num_trees, block_size):
+        vectors1 = vectors(start1)
+        rows = slice(start1, start1 + vectors1.shape[0])
+        for start2 in range(start1, num_trees, block_size):
+            vectors2 = vectors1 if start2 == start1 else vectors(start2)
+            cols = slice(start2, start2 + vectors2.shape[0])
+            norm_sum = norm[rows, np.newaxis] + norm[np.newaxis, cols]
+            block = norm_sum - 2 * (vectors1 @ vectors2.T)
+            # The Gram matrix form cancels catastrophically when two trees
+            # are close, so these distances are recomputed directly from
+            # the differences of their vectors.
+            close_i, close_j = np.nonzero(block < _KC_CANCELLATION * norm_sum)
+            for k in range(0, close_i.shape[0], block_size):
+                i = close_i[k : k + block_size]
+                j = close_j[k : k + block_size]
+                diff = vectors1[i] - vectors2[j]
+                block[i, j] = np.einsum("ij,ij->i", diff, diff)
+            squared[rows, cols] = block
+            squared[cols, rows] = block.T
+    np.fill_diagonal(squared, 0)
+    return np.sqrt(np.maximum(squared, 0, out=squared), out=squared)
+
+
+@jit.numba_njit()
+def _root_distance(preorder, parent, branch_length):
+    # The sum of the branch lengths between each node and its root.
+    ret = np.zeros(parent.shape[0])
+    for u in preorder:
+        if parent[u] != -1:
+            ret[u] = ret[parent[u]] + branch_length[u]
+    return ret
+
+
+@jit.numba_njit()
+def _patristic_row(a, samples, preorder, parent, root_distance, on_path, meet, out):
+    # The distance from a to each sample s is found from the root distance of
+    # the node at which the path from s to the root meets the path from a,
+    # which is propagated down from the path in one preorder pass. Samples
+    # in other trees meet the path at -inf, giving an infinite distance.
+    u = a
+    while u != -1:
+        on_path[u] = a
+        u = parent[u]
+    for u in preorder:
+        if on_path[u] == a:
+            meet[u] = root_distance[u]
+        elif parent[u] == -1:
+            meet[u] = -np.inf
+        else:
+            meet[u] = meet[parent[u]]
+    for j in range(samples.shape[0]):
+        s = samples[j]
+        out[j] = root_distance[a] + root_distance[s] - 2 * meet[s]
+
+
+_PATRISTIC_ROWS_PER_TASK = 64
+
+
+@jit.numba_njit(parallel=True)
+def _patristic_distances(
+    row_start, row_stop, samples, preorder, parent, branch_length, condensed
+):
+    n = samples.shape[0]
+    root_distance = _root_distance(preorder, parent, branch_length)
+    num_rows = row_stop - row_start
+    if condensed:
+        ret = np.zeros((1, n * (n - 1) // 2))
+    else:
+        ret = np.zeros((num_rows, n))
+    num_tasks = (num_rows + _PATRISTIC_ROWS_PER_TASK - 1) // _PATRISTIC_ROWS_PER_TASK
+    for k in prange(num_tasks):
+        on_path = np.full(parent.shape[0], -1, dtype=np.int64)
+        meet = np.full(parent.shape[0], -np.inf)
+        row = np.zeros(n)
+        start = row_start + k * _PATRISTIC_ROWS_PER_TASK
+        stop = min(start + _PATRISTIC_ROWS_PER_TASK, row_stop)
+        for i in range(start, stop):
+            _patristic_row(
+                samples[i], samples, preorder, parent, root_distance, on_path, meet, row
+            )
+            if condensed:
+                offset = i * (2 * n - i - 1) // 2
+                ret[0, offset : offset + n - i - 1] = row[i + 1 :]
+            else:
+                ret[i - row_start] = row
+    return ret
+
+
+def patristic_distances(ds, *, condensed=False, chunks=None):
+    """
+    Returns the matrix of patristic distances between the samples of the
+    specified tree, that is, the sum of the branch lengths on the path
+    between each pair of samples. Each row of the matrix is computed in
+    O(N) time for a tree with N nodes, and the rows are computed in parallel.
+    Samples in different trees of a multiroot tree are an infinite distance
+    apart.
+
+    For trees which are too large for the dense matrix to fit in memory, the
+    matrix can be computed as a dask array, in blocks of the specified
+    number of rows.
+
+    :param xarray.DataSet ds: The tree dataset.
+    :param bool condensed: If True, return the upper triangle of the matrix
+        as a condensed vector in the order ``(0, 1), (0, 2), ..., (n - 2, n - 1)``,
+        as in :func:`scipy.spatial.distance.pdist`.
+    :param int chunks: If specified, return a dask array divided into blocks
+        of this many rows rather than a numpy array.
+    :return : The patristic distance between each pair of samples.
+    :rtype : numpy.ndarray or dask.array.Array
+    """
+    if condensed and chunks is not None:
+        raise ValueError("Condensed output cannot be chunked")
+    if chunks is not None and chunks < 1:
+        raise ValueError("Chunk size must be positive")
+    args = (
+        ds.sample_node.data,
+        ds.traversal_preorder.data,
+        ds.node_parent.data,
+        ds.node_branch_length.data,
     )
+    n = args[0].shape[0]
+    if chunks is None:
+        ret = _patristic_distances(0, n, *args, condensed)
+        return ret[0] if condensed else ret
 
-    s1 = {frozenset(x) for x in b1}
-    s2 = {frozenset(x) for x in b2}
+    import dask.array as da
 
-    return len(s1.symmetric_difference(s2))
+    def block(block_info=None):
+        row_start, row_stop = block_info[None]["array-location"][0]
+        return _patristic_distances(row_start, row_stop, *args, False)
+
+    sizes = tuple(min(chunks, n - j) for j in range(0, n, chunks))
+    return da.map_blocks(
+        block,
+        dtype=np.float64,
+        chunks=(sizes, (n,)),
+        meta=np.empty((0, 0)),
+    )
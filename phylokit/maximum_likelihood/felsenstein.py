@@ -140,30 +140,161 @@ def naive_likelihood_felsenstein(
 
 
 @jit.numba_njit()
-def _calculate_likelihood(
-    child,
-    node_branch_length,
-    rate,
-    pi,
-    likelihood,
+def _update_transition_matrix(P, u, t, rate, pi):
+    # Fills P[u] with the probabilities given by _transition_probability
+    # for a branch of length t, evaluating the exponential once.
+    e = np.exp(-rate * t)
+    for i in range(4):
+        for j in range(4):
+            P[u, i, j] = (np.float64(1.0) - e) * pi[i, j]
+        P[u, i, i] += e
+
+
+@jit.numba_njit(parallel=True)
+def _transition_matrices(node_branch_length, rate, pi):
+    num_nodes = node_branch_length.shape[0]
+    P = np.zeros((num_nodes, 4, 4), dtype=np.float64)
+    for u in prange(num_nodes):
+        _update_transition_matrix(P, u, node_branch_length[u], rate, pi)
+    return P
+
+
+def _check_pi(pi):
+    if pi is None:
+        return np.full((4, 4), 0.25, dtype=np.float64)
+    pi = np.asarray(pi, dtype=np.float64)
+    if pi.shape != (4, 4):
+        raise ValueError("The transition probability matrix must have shape (4, 4)")
+    return pi
+
+
+def _check_model(pi, model):
+    if model is not None and pi is not None:
+        raise ValueError("Only one of pi and model can be specified")
+
+
+def _root_frequencies(model):
+    if model is None:
+        return np.full(4, 0.25, dtype=np.float64)
+    return model.frequencies
+
+
+def _check_rate_categories(rate_categories):
+    if rate_categories is None:
+        return np.ones(1, dtype=np.float64), np.ones(1, dtype=np.float64)
+    category_rates, category_weights = rate_categories
+    category_rates = np.asarray(category_rates, dtype=np.float64)
+    category_weights = np.asarray(category_weights, dtype=np.float64)
+    if category_rates.ndim != 1 or category_rates.shape != category_weights.shape:
+        raise ValueError("There must be one weight for each rate category")
+    return category_rates, category_weights
+
+
+def _get_transition_matrices(ds, rate, pi, model, category_rates):
+    # The matrices of all branches in all rate categories are computed in
+    # one call, as those of branches scaled by the category rates.
+    _check_model(pi, model)
+    num_nodes = ds.nodes.shape[0]
+    num_categories = category_rates.shape[0]
+    branch_length = np.outer(ds.node_branch_length.data, category_rates).ravel()
+    if model is not None:
+        P = model.transition_matrices(rate * branch_length)
+    else:
+        pi = _check_pi(pi)
+        P = _transition_matrices(branch_length, rate, pi)
+    return P.reshape((num_nodes, num_categories, 4, 4))
+
+
+def transition_matrices(ds, rate, pi=None, model=None, rate_categories=None):
+    """
+    Returns the transition probability matrix of the branch above each
+    node in the tree, as an array of shape (nodes, 4, 4) where entry
+    ``[u, i, j]`` is the probability of going from state i at the parent
+    of ``u`` to state j at ``u``. The result can be passed to
+    :func:`likelihood_felsenstein` and updated one branch at a time with
+    :func:`update_transition_matrix`. If ``rate_categories`` is given the
+    result has shape (nodes, categories, 4, 4), with one matrix per rate
+    category for each branch.
+
+    :param ds: phylokit.DataSet, tree data
+    :param rate: float, mutation rate
+    :param pi: np.array, transtion probability matrix with
+    shape (4, 4),
+    default is [0.25, 0.25, 0.25, 0.25]
+    :param model: SubstitutionModel, substitution model used instead of
+    pi, with branch lengths scaled by rate, default is None
+    :param rate_categories: tuple, the rates and weights of the site rate
+    categories (see :func:`gamma_rate_categories`), default is None
+    :return: np.array, transition matrices with shape (nodes, 4, 4)
+    """
+    category_rates, _ = _check_rate_categories(rate_categories)
+    P = _get_transition_matrices(ds, rate, pi, model, category_rates)
+    if rate_categories is None:
+        return P[:, 0]
+    return P
+
+
+def update_transition_matrix(
+    P, u, branch_length, rate, pi=None, model=None, rate_categories=None
 ):
-    probs = np.zeros(4, dtype=np.float64)
-    for start_state in range(4):
-        for end_state in range(4):
-            probs[start_state] += likelihood[
-                child, end_state
-            ] * _transition_probability(
-                start_state,
-                end_state,
-                node_branch_length[child],
-                rate,
-                pi,
-            )
-    return probs
+    """
+    Recomputes, in place, the transition matrix of the branch above node
+    ``u`` in the array returned by :func:`transition_matrices` after its
+    length has changed to ``branch_length``.
+
+    :param P: np.array, transition matrices with shape (nodes, 4, 4),
+    or (nodes, categories, 4, 4) with rate categories
+    :param u: int, node ID
+    :param branch_length: float, new length of the branch above u
+    :param rate: float, mutation rate
+    :param pi: np.array, transtion probability matrix with
+    shape (4, 4),
+    default is [0.25, 0.25, 0.25, 0.25]
+    :param model: SubstitutionModel, substitution model used instead of
+    pi, default is None
+    :param rate_categories: tuple, the rates and weights of the site rate
+    categories (see :func:`gamma_rate_categories`), default is None
+    """
+    _check_model(pi, model)
+    if u < 0 or u >= P.shape[0]:
+        raise ValueError(f"Node {u} is not in the tree")
+    category_rates, _ = _check_rate_categories(rate_categories)
+    if P.shape[1:] != (4, 4) and P.shape[1:] != (category_rates.shape[0], 4, 4):
+        raise ValueError("The transition matrices do not match the rate categories")
+    Pu = P[u].reshape((category_rates.shape[0], 4, 4))
+    branch_length = rate * branch_length * category_rates
+    if model is not None:
+        Pu[:] = model.transition_matrices(branch_length)
+    else:
+        pi = _check_pi(pi)
+        for k in range(category_rates.shape[0]):
+            _update_transition_matrix(Pu, k, branch_length[k], 1.0, pi)
+
+
+@jit.numba_njit()
+def _calculate_likelihood(node, left_child, right_sib, P, likelihood):
+    # The partial likelihood of node in each rate category is the product
+    # over its children of the matrix-vector products
+    # P[child, k] @ likelihood[child, k].
+    likelihood[node] = 1.0
+    num_categories = likelihood.shape[1]
+    child = left_child[node]
+    while child != -1:
+        for k in range(num_categories):
+            for start_state in range(4):
+                prob = 0.0
+                for end_state in range(4):
+                    prob += (
+                        P[child, k, start_state, end_state]
+                        * likelihood[child, k, end_state]
+                    )
+                likelihood[node, k, start_state] *= prob
+        child = right_sib[child]
 
 
 @jit.numba_njit(parallel=True)
-def _likelihood_felsenstein(
+def _log_likelihood_felsenstein(
+    node_parent,
     node_left_child,
     node_right_sib,
     call_genotype,
@@ -171,88 +302,193 @@ def _likelihood_felsenstein(
     traversal_postorder,
     sample_nodes,
     variant_allele,
-    node_branch_length,
-    rate,
-    pi,
+    P,
+    root_frequencies,
+    category_weights,
 ):
+    # The partial likelihoods of each internal node, in all rate categories,
+    # are divided by their maximum, and the log of this scale factor is
+    # added to the site's log-likelihood, so that they cannot underflow
+    # however deep the tree. The categories are combined at the root.
     ret = np.zeros(call_genotype.shape[0], dtype=np.float64)
+    num_categories = category_weights.shape[0]
 
-    sample_mask = np.zeros(num_nodes, dtype=np.bool_)
-    sample_mask[sample_nodes] = True
+    # Samples keep their observed partial likelihoods, so the nodes below
+    # an internal sample are skipped, and their scale factors not counted.
+    skip = np.zeros(num_nodes, dtype=np.bool_)
+    skip[sample_nodes] = True
+    for node in traversal_postorder[::-1]:
+        if node_parent[node] != -1 and skip[node_parent[node]]:
+            skip[node] = True
 
     for i in prange(call_genotype.shape[0]):
-        likelihood = np.zeros((num_nodes, 4), dtype=np.float64)
+        likelihood = np.zeros((num_nodes, num_categories, 4), dtype=np.float64)
         for j, sample_node in enumerate(sample_nodes):
             if call_genotype[i, j] == -1:
                 likelihood[sample_node] = 0.25
             else:
-                likelihood[sample_node, variant_allele[i, call_genotype[i, j, 0]]] = 1.0
+                state = variant_allele[i, call_genotype[i, j, 0]]
+                likelihood[sample_node, :, state] = 1.0
+        log_scale = 0.0
         for node in traversal_postorder:
-            if sample_mask[node]:
-                continue
-            else:
-                u = node_left_child[node]
-                probs = _calculate_likelihood(
-                    u,
-                    node_branch_length,
-                    rate,
-                    pi,
-                    likelihood,
+            if not skip[node]:
+                _calculate_likelihood(
+                    node, node_left_child, node_right_sib, P, likelihood
                 )
-                v = node_right_sib[u]
-                while v != -1:
-                    probs *= _calculate_likelihood(
-                        v,
-                        node_branch_length,
-                        rate,
-                        pi,
-                        likelihood,
-                    )
-                    v = node_right_sib[v]
+                scale = np.max(likelihood[node])
+                if scale > 0:
+                    likelihood[node] /= scale
+                    log_scale += np.log(scale)
+
+        root = traversal_postorder[-1]
+        root_likelihood = 0.0
+        for k in range(num_categories):
+            root_likelihood += category_weights[k] * np.sum(
+                likelihood[root, k] * root_frequencies
+            )
+        ret[i] = np.log(root_likelihood) + log_scale
+
+    return ret
 
-                likelihood[node] = probs
 
-        ret[i] = np.sum(likelihood[traversal_postorder[-1]] * 0.25)
+def _site_log_likelihoods(ds, rate, pi, P, model, rate_categories):
+    GENOTYPE_ARRAY = np.array([b"A", b"C", b"G", b"T"], dtype="S")
 
-    return np.prod(ret)
+    _check_model(pi, model)
+    category_rates, category_weights = _check_rate_categories(rate_categories)
+    num_nodes = ds.nodes.shape[0]
+    num_categories = category_rates.shape[0]
+    if P is None:
+        P = _get_transition_matrices(ds, rate, pi, model, category_rates)
+    elif num_categories == 1 and P.shape == (num_nodes, 4, 4):
+        P = P.reshape((num_nodes, 1, 4, 4))
+    elif P.shape != (num_nodes, num_categories, 4, 4):
+        raise ValueError(
+            "The transition matrices must have shape (nodes, 4, 4), or "
+            "(nodes, categories, 4, 4) with rate categories"
+        )
+
+    call_genotype = ds.call_genotype.data
+    variant_allele = ds.variant_allele.data
+    if "variant_site_pattern" in ds:
+        # Each unique site pattern is evaluated once, and its likelihood
+        # counted once for every site with that pattern.
+        pattern_variant = ds.site_pattern_variant.data
+        call_genotype = call_genotype[pattern_variant]
+        variant_allele = variant_allele[pattern_variant]
+
+    return _log_likelihood_felsenstein(
+        ds.node_parent.data,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        call_genotype,
+        num_nodes,
+        ds.traversal_postorder.data,
+        ds.sample_node.data,
+        util.base_mapping(variant_allele, GENOTYPE_ARRAY),
+        P,
+        _root_frequencies(model),
+        category_weights,
+    )
+
+
+def log_likelihood_felsenstein(
+    ds,
+    rate,
+    pi=None,
+    transition_matrices=None,
+    per_site=False,
+    model=None,
+    rate_categories=None,
+):
+    """
+    Calculate the log-likelihood of a given tree with `Felsenstein`
+    pruning algorithm. The partial likelihoods are rescaled at every
+    node, so the result does not underflow for long alignments or deep
+    trees. If the dataset has site patterns (see
+    :func:`append_site_patterns`), each unique pattern is evaluated once.
+
+    :param ds: phylokit.DataSet, tree data
+    :param rate: float, mutation rate
+    :param pi: np.array, transtion probability matrix with
+    shape (4, 4),
+    default is [0.25, 0.25, 0.25, 0.25]
+    :param transition_matrices: np.array, precomputed transition matrices
+    with shape (nodes, 4, 4), or (nodes, categories, 4, 4) with rate
+    categories, default is None
+    :param per_site: bool, also return the log-likelihood of each variant,
+    default is False
+    :param model: SubstitutionModel, substitution model used instead of
+    pi, with branch lengths scaled by rate, default is None
+    :param rate_categories: tuple, the rates and weights of the site rate
+    categories (see :func:`gamma_rate_categories`), default is None
+    :return: float, log-likelihood, or a tuple of the log-likelihood and
+    an np.array of per-variant log-likelihoods if per_site is True
+    """
+    # The transition_matrices keyword shadows the module's function of the
+    # same name, so it is only used to name the table passed in.
+    P = transition_matrices
+    ret = _site_log_likelihoods(ds, rate, pi, P, model, rate_categories)
+
+    if "variant_site_pattern" in ds:
+        total = np.sum(ret * ds.site_pattern_weight.data)
+        if per_site:
+            return total, ret[ds.variant_site_pattern.data]
+        return total
+    total = np.sum(ret)
+    if per_site:
+        return total, ret
+    return total
 
 
 def likelihood_felsenstein(
     ds,
     rate,
     pi=None,
+    transition_matrices=None,
+    model=None,
+    rate_categories=None,
 ):
     """
     Calculate the likelihood of a given tree with `Felsenstein`
     pruning algorithm. This implementation is a parallelized
     version of the `naive_likelihood_felsenstein` function.
+    If the dataset has site patterns (see :func:`append_site_patterns`),
+    each unique pattern is evaluated once. The likelihood underflows to
+    zero for long alignments; use :func:`log_likelihood_felsenstein`
+    for these.
+
+    The transition matrix of each branch is computed once and shared by
+    all sites. Optimisers that change a few branches can pass their own
+    table (see :func:`transition_matrices`), in which case ``rate`` and
+    ``pi`` are not used. General reversible models such as HKY and GTR
+    are given with ``model`` (see :class:`SubstitutionModel`), whose
+    frequencies are also used at the root. Rate heterogeneity across
+    sites is given with ``rate_categories`` (see
+    :func:`gamma_rate_categories`); all categories are evaluated in the
+    same pass over the tree.
 
     :param ds: phylokit.DataSet, tree data
     :param rate: float, mutation rate
     :param pi: np.array, transtion probability matrix with
     shape (4, 4),
     default is [0.25, 0.25, 0.25, 0.25]
+    :param transition_matrices: np.array, precomputed transition matrices
+    with shape (nodes, 4, 4), or (nodes, categories, 4, 4) with rate
+    categories, default is None
+    :param model: SubstitutionModel, substitution model used instead of
+    pi, with branch lengths scaled by rate, default is None
+    :param rate_categories: tuple, the rates and weights of the site rate
+    categories, default is None
     :return: float, likelihood
     """
-
-    GENOTYPE_ARRAY = np.array([b"A", b"C", b"G", b"T"], dtype="S")
-
-    if pi is None:
-        pi = np.full((4, 4), 0.25, dtype=np.float64)
-    elif pi.shape != (4, 4):
-        raise ValueError("The transition probability matrix must have shape (4, 4)")
-
-    ret = _likelihood_felsenstein(
-        ds.node_left_child.data,
-        ds.node_right_sib.data,
-        ds.call_genotype.data,
-        ds.nodes.shape[0],
-        ds.traversal_postorder.data,
-        ds.sample_node.data,
-        util.base_mapping(ds.variant_allele.data, GENOTYPE_ARRAY),
-        ds.node_branch_length.data,
-        rate,
-        pi,
+    return np.exp(
+        log_likelihood_felsenstein(
+            ds,
+            rate,
+            pi,
+            transition_matrices=transition_matrices,
+            model=model,
+            rate_categories=rate_categories,
+        )
     )
-
-    return ret
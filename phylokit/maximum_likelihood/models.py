@@ -0,0 +1,173 @@
+import numpy as np
+from numba import prange
+
+from .. import jit
+
+# The exchangeability rates of the general time-reversible model are given
+# in this order of state pairs, with states ordered A, C, G, T.
+_RATE_PAIRS = ((0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3))
+
+
+@jit.numba_njit(parallel=True)
+def _eigen_transition_matrices(left, eigenvalues, right, branch_length):
+    # P(t) = left @ diag(exp(eigenvalues * t)) @ right
+    num_branches = branch_length.shape[0]
+    num_states = eigenvalues.shape[0]
+    P = np.zeros((num_branches, num_states, num_states), dtype=np.float64)
+    for u in prange(num_branches):
+        e = np.exp(eigenvalues * branch_length[u])
+        for i in range(num_states):
+            for k in range(num_states):
+                x = left[i, k] * e[k]
+                for j in range(num_states):
+                    P[u, i, j] += x * right[k, j]
+        # Rounding can leave entries that should be zero slightly negative.
+        for i in range(num_states):
+            for j in range(num_states):
+                if P[u, i, j] < 0:
+                    P[u, i, j] = 0
+    return P
+
+
+class SubstitutionModel:
+    """
+    A time-reversible nucleotide substitution model, with states ordered
+    A, C, G, T. The rate matrix is normalised to one expected substitution
+    per unit of time at equilibrium, and is eigendecomposed once, when the
+    model is created, so that the transition matrices of any number of
+    branches are computed in a single vectorised call.
+
+    :param rates: np.array, the six exchangeability rates in the order
+    AC, AG, AT, CG, CT, GT
+    :param frequencies: np.array, the four equilibrium state frequencies
+    """
+
+    def __init__(self, rates, frequencies):
+        rates = np.asarray(rates, dtype=np.float64)
+        frequencies = np.asarray(frequencies, dtype=np.float64)
+        if rates.shape != (6,) or np.any(rates <= 0):
+            raise ValueError("There must be six positive exchangeability rates")
+        if frequencies.shape != (4,) or np.any(frequencies <= 0):
+            raise ValueError("There must be four positive state frequencies")
+        if not np.isclose(np.sum(frequencies), 1):
+            raise ValueError("The state frequencies must sum to one")
+
+        S = np.zeros((4, 4), dtype=np.float64)
+        for rate, (i, j) in zip(rates, _RATE_PAIRS):
+            S[i, j] = rate
+            S[j, i] = rate
+        Q = S * frequencies
+        np.fill_diagonal(Q, -np.sum(Q, axis=1))
+        Q /= -np.sum(frequencies * np.diag(Q))
+
+        # Q is similar to the symmetric matrix D^1/2 Q D^-1/2, with D the
+        # diagonal matrix of frequencies, whose eigenvectors are orthogonal.
+        d = np.sqrt(frequencies)
+        eigenvalues, U = np.linalg.eigh(d[:, np.newaxis] * Q / d)
+
+        self.rates = rates
+        self.frequencies = frequencies
+        self.rate_matrix = Q
+        self.eigenvalues = eigenvalues
+        self._left = U / d[:, np.newaxis]
+        self._right = U.T * d
+
+    def transition_matrices(self, branch_length):
+        """
+        Returns the transition probability matrices for an array of
+        branch lengths, as an array of shape (branches, 4, 4).
+
+        :param branch_length: np.array, branch lengths
+        :return: np.array, transition matrices
+        """
+        branch_length = np.asarray(branch_length, dtype=np.float64)
+        return _eigen_transition_matrices(
+            self._left, self.eigenvalues, self._right, branch_length
+        )
+
+    def __repr__(self):
+        return (
+            f"SubstitutionModel(rates={self.rates.tolist()}, "
+            f"frequencies={self.frequencies.tolist()})"
+        )
+
+
+def jc69_model():
+    """
+    Returns the Jukes-Cantor substitution model, with equal rates and
+    frequencies.
+
+    :return: SubstitutionModel
+    """
+    return SubstitutionModel(np.ones(6), np.full(4, 0.25))
+
+
+def hky_model(kappa, frequencies):
+    """
+    Returns the HKY substitution model, in which transitions (A <-> G and
+    C <-> T) occur ``kappa`` times faster than transversions.
+
+    :param kappa: float, transition/transversion rate ratio
+    :param frequencies: np.array, the four equilibrium state frequencies
+    :return: SubstitutionModel
+    """
+    return SubstitutionModel([1, kappa, 1, 1, kappa, 1], frequencies)
+
+
+def gtr_model(rates, frequencies):
+    """
+    Returns the general time-reversible substitution model.
+
+    :param rates: np.array, the six exchangeability rates in the order
+    AC, AG, AT, CG, CT, GT
+    :param frequencies: np.array, the four equilibrium state frequencies
+    :return: SubstitutionModel
+    """
+    return SubstitutionModel(rates, frequencies)
+
+
+def gamma_rate_categories(alpha=None, num_categories=4, proportion_invariant=0):
+    """
+    Returns the rates and weights of the site rate categories of the
+    discrete gamma model of rate heterogeneity (Yang 1994), in which the
+    rate of each of ``num_categories`` equally likely categories is the
+    mean of a quantile of the gamma distribution with shape ``alpha`` and
+    mean one. If ``proportion_invariant`` is nonzero an invariant
+    category with rate zero is added, and the other rates are scaled so
+    that the mean rate is still one. The result is passed as the
+    ``rate_categories`` of :func:`likelihood_felsenstein`.
+
+    :param alpha: float, shape of the gamma distribution, or None for
+    no gamma rate heterogeneity, default is None
+    :param num_categories: int, number of gamma rate categories,
+    default is 4
+    :param proportion_invariant: float, proportion of invariant sites,
+    default is 0
+    :return: tuple, the rates and weights of the categories
+    """
+    if not 0 <= proportion_invariant < 1:
+        raise ValueError("The proportion of invariant sites must be in [0, 1)")
+    if alpha is None:
+        rates = np.ones(1, dtype=np.float64)
+    else:
+        if alpha <= 0:
+            raise ValueError("The gamma shape parameter must be positive")
+        if num_categories < 1:
+            raise ValueError("There must be at least one rate category")
+        import scipy.special
+        import scipy.stats
+
+        # The mean of the gamma distribution below x is the probability
+        # below x of the gamma distribution with shape alpha + 1.
+        quantiles = np.arange(1, num_categories) / num_categories
+        bounds = scipy.stats.gamma.ppf(quantiles, alpha, scale=1 / alpha)
+        cdf = scipy.special.gammainc(alpha + 1, bounds * alpha)
+        cdf = np.concatenate(([0], cdf, [1]))
+        rates = np.diff(cdf) * num_categories
+    weights = np.full(rates.shape[0], 1 / rates.shape[0], dtype=np.float64)
+    if proportion_invariant > 0:
+        rates = np.concatenate(([0], rates / (1 - proportion_invariant)))
+        weights = np.concatenate(
+            ([proportion_invariant], weights * (1 - proportion_invariant))
+        )
+    return rates, weights
@@ -0,0 +1,339 @@
+import numpy as np
+from numba import prange
+
+from . import felsenstein
+from .. import core
+from .. import jit
+from .. import util
+from .felsenstein import _calculate_likelihood
+
+
+@jit.numba_njit(parallel=True)
+def _update_partials(nodes, left_child, right_sib, P, partials, log_scale):
+    # Recomputes the partial likelihoods of the nodes, which must be given
+    # children first, for every site. log_scale[u, i] is the sum of the log
+    # scale factors of the subtree below u at site i.
+    num_sites = partials.shape[1]
+    for i in prange(num_sites):
+        site_partials = partials[:, i]
+        for node in nodes:
+            _calculate_likelihood(node, left_child, right_sib, P, site_partials)
+            s = 0.0
+            child = left_child[node]
+            while child != -1:
+                s += log_scale[child, i]
+                child = right_sib[child]
+            scale = np.max(site_partials[node])
+            if scale > 0:
+                site_partials[node] /= scale
+                s += np.log(scale)
+            log_scale[node, i] = s
+
+
+@jit.numba_njit(parallel=True)
+def _root_log_likelihoods(
+    root, partials, log_scale, root_frequencies, category_weights
+):
+    num_sites = partials.shape[1]
+    ret = np.zeros(num_sites, dtype=np.float64)
+    for i in prange(num_sites):
+        root_likelihood = 0.0
+        for k in range(category_weights.shape[0]):
+            root_likelihood += category_weights[k] * np.sum(
+                partials[root, i, k] * root_frequencies
+            )
+        ret[i] = np.log(root_likelihood) + log_scale[root, i]
+    return ret
+
+
+@jit.numba_njit()
+def _dirty_postorder(dirty_nodes, parent):
+    # The dirty nodes are closed under taking parents, so visiting them
+    # deepest first visits every child before its parent.
+    depth = np.zeros(dirty_nodes.shape[0], dtype=np.int32)
+    for j, u in enumerate(dirty_nodes):
+        v = parent[u]
+        while v != -1:
+            depth[j] += 1
+            v = parent[v]
+    return dirty_nodes[np.argsort(-depth, kind="mergesort")]
+
+
+class LikelihoodState:
+    """
+    The partial likelihoods of every node of a tree, kept between
+    evaluations so that local edits to the tree are re-evaluated
+    incrementally. Changing the length of a branch, or moving a subtree
+    with :meth:`spr`, marks the nodes on the paths from the edit to the
+    root as dirty, and only these are recomputed by the next call to
+    :meth:`log_likelihood`, in O(depth) rather than O(n) work per site.
+    The tree must have a single root; the state works on its own copy of
+    the tree arrays, which :meth:`to_dataset` returns as a new tree.
+
+    :param ds: phylokit.DataSet, tree data
+    :param rate: float, mutation rate
+    :param pi: np.array, transtion probability matrix with
+    shape (4, 4),
+    default is [0.25, 0.25, 0.25, 0.25]
+    :param model: SubstitutionModel, substitution model used instead of
+    pi, with branch lengths scaled by rate, default is None
+    :param rate_categories: tuple, the rates and weights of the site rate
+    categories (see :func:`gamma_rate_categories`), default is None
+    """
+
+    def __init__(self, ds, rate, pi=None, model=None, rate_categories=None):
+        GENOTYPE_ARRAY = np.array([b"A", b"C", b"G", b"T"], dtype="S")
+
+        if util.get_num_roots(ds) != 1:
+            raise ValueError("The likelihood state requires a tree with one root")
+        category_rates, category_weights = felsenstein._check_rate_categories(
+            rate_categories
+        )
+        self.rate = rate
+        self.pi = pi
+        self.model = model
+        self.rate_categories = rate_categories
+        self.transition_matrices = felsenstein._get_transition_matrices(
+            ds, rate, pi, model, category_rates
+        )
+        self._root_frequencies = felsenstein._root_frequencies(model)
+        self._category_weights = category_weights
+
+        self.parent = ds.node_parent.data.astype(np.int32)
+        self.left_child = ds.node_left_child.data.astype(np.int32)
+        self.right_sib = ds.node_right_sib.data.astype(np.int32)
+        self.branch_length = ds.node_branch_length.data.astype(np.float64)
+        self.samples = ds.sample_node.data.astype(np.int32)
+
+        call_genotype = ds.call_genotype.data
+        variant_allele = ds.variant_allele.data
+        self._site_pattern = None
+        self._site_weight = None
+        if "variant_site_pattern" in ds:
+            pattern_variant = ds.site_pattern_variant.data
+            call_genotype = call_genotype[pattern_variant]
+            variant_allele = variant_allele[pattern_variant]
+            self._site_pattern = ds.variant_site_pattern.data
+            self._site_weight = ds.site_pattern_weight.data
+        allele_state = util.base_mapping(variant_allele, GENOTYPE_ARRAY)
+
+        num_nodes = ds.nodes.shape[0]
+        num_sites = call_genotype.shape[0]
+        num_categories = category_rates.shape[0]
+        self.partials = np.zeros(
+            (num_nodes, num_sites, num_categories, 4), dtype=np.float64
+        )
+        self.log_scale = np.zeros((num_nodes, num_sites), dtype=np.float64)
+        genotypes = call_genotype[:, :, 0]
+        for j, u in enumerate(self.samples):
+            missing = genotypes[:, j] == -1
+            self.partials[u, missing] = 0.25
+            sites = np.flatnonzero(~missing)
+            states = allele_state[sites, genotypes[sites, j]]
+            self.partials[u, sites, :, states] = 1.0
+
+        sample_mask = np.zeros(num_nodes, dtype=np.bool_)
+        sample_mask[self.samples] = True
+        self._is_sample = sample_mask
+        self._dirty = np.zeros(num_nodes, dtype=np.bool_)
+        self._dirty_nodes = []
+        postorder = ds.traversal_postorder.data
+        _update_partials(
+            postorder[~sample_mask[postorder]],
+            self.left_child,
+            self.right_sib,
+            self.transition_matrices,
+            self.partials,
+            self.log_scale,
+        )
+
+    @property
+    def root(self):
+        return self.left_child[-1]
+
+    @property
+    def num_dirty_nodes(self):
+        """
+        The number of nodes that will be recomputed by the next call to
+        :meth:`log_likelihood`.
+        """
+        return len(self._dirty_nodes)
+
+    def _check_node(self, u):
+        if u < 0 or u >= self.parent.shape[0] - 1:
+            raise ValueError(f"Node {u} is not in the tree")
+
+    def _mark_path(self, u):
+        # Samples keep their observed partial likelihoods, so an edit below
+        # a sample does not change anything above it.
+        while u != -1 and not self._is_sample[u]:
+            if not self._dirty[u]:
+                self._dirty[u] = True
+                self._dirty_nodes.append(u)
+            u = self.parent[u]
+
+    def _update_branch(self, u):
+        felsenstein.update_transition_matrix(
+            self.transition_matrices,
+            u,
+            self.branch_length[u],
+            self.rate,
+            self.pi,
+            model=self.model,
+            rate_categories=self.rate_categories,
+        )
+
+    def _remove_child(self, p, c):
+        u = self.left_child[p]
+        if u == c:
+            self.left_child[p] = self.right_sib[c]
+        else:
+            while self.right_sib[u] != c:
+                u = self.right_sib[u]
+            self.right_sib[u] = self.right_sib[c]
+        self.right_sib[c] = -1
+        self.parent[c] = -1
+
+    def _insert_child(self, p, c):
+        self.right_sib[c] = self.left_child[p]
+        self.left_child[p] = c
+        if p != self.parent.shape[0] - 1:
+            self.parent[c] = p
+
+    def set_branch_length(self, u, branch_length):
+        """
+        Sets the length of the branch above node ``u``, and marks the
+        path from its parent to the root as dirty.
+
+        :param u: int, node ID
+        :param branch_length: float, new length of the branch above u
+        """
+        self._check_node(u)
+        self.branch_length[u] = branch_length
+        self._update_branch(u)
+        self._mark_path(self.parent[u])
+
+    def spr(self, u, v):
+        """
+        Performs a subtree prune and regraft move, cutting the subtree
+        rooted at ``u`` (with its parent node) out of the tree and
+        regrafting it onto the middle of the branch above ``v``. The
+        sibling of ``u`` takes the place of the parent of ``u``, with the
+        two branches joined. If ``v`` is the root, the parent of ``u``
+        becomes the new root, joined to ``v`` by a zero-length branch.
+        The parent of ``u`` must have exactly two children.
+
+        :param u: int, root of the subtree to move
+        :param v: int, node whose branch the subtree is regrafted onto
+        """
+        self._check_node(u)
+        self._check_node(v)
+        p = self.parent[u]
+        if p == -1:
+            raise ValueError("Cannot prune the root")
+        s = self.left_child[p]
+        if s == u:
+            s = self.right_sib[u]
+        if self.right_sib[self.left_child[p]] == -1 or (
+            self.right_sib[self.right_sib[self.left_child[p]]] != -1
+        ):
+            raise ValueError("The parent of the pruned node must be binary")
+        w = v
+        while w != -1 and w != u:
+            w = self.parent[w]
+        if w == u or v == p:
+            raise ValueError("Cannot regraft within the pruned subtree")
+        virtual_root = self.parent.shape[0] - 1
+
+        # Prune p, joining the branches of s and p.
+        g = self.parent[p]
+        self._remove_child(p, s)
+        if g == -1:
+            self._remove_child(virtual_root, p)
+            self._insert_child(virtual_root, s)
+            self.branch_length[s] = 0
+        else:
+            self._remove_child(g, p)
+            self._insert_child(g, s)
+            self.branch_length[s] += self.branch_length[p]
+
+        # Regraft p onto the middle of the branch above v.
+        w = self.parent[v]
+        if w == -1:
+            self._remove_child(virtual_root, v)
+            self._insert_child(virtual_root, p)
+            self.branch_length[p] = 0
+            self.branch_length[v] = 0
+        else:
+            self._remove_child(w, v)
+            self._insert_child(w, p)
+            self.branch_length[p] = self.branch_length[v] / 2
+            self.branch_length[v] -= self.branch_length[p]
+        self._insert_child(p, v)
+
+        for x in (s, p, v):
+            self._update_branch(x)
+        if g != -1:
+            self._mark_path(g)
+        self._mark_path(p)
+
+    def update(self):
+        """
+        Recomputes the partial likelihoods of the dirty nodes.
+        """
+        if len(self._dirty_nodes) == 0:
+            return
+        dirty_nodes = np.array(self._dirty_nodes, dtype=np.int32)
+        _update_partials(
+            _dirty_postorder(dirty_nodes, self.parent),
+            self.left_child,
+            self.right_sib,
+            self.transition_matrices,
+            self.partials,
+            self.log_scale,
+        )
+        self._dirty[dirty_nodes] = False
+        self._dirty_nodes = []
+
+    def log_likelihood(self, per_site=False):
+        """
+        Returns the log-likelihood of the tree, after recomputing the
+        dirty nodes, as :func:`log_likelihood_felsenstein`.
+
+        :param per_site: bool, also return the log-likelihood of each variant,
+        default is False
+        :return: float, log-likelihood, or a tuple of the log-likelihood and
+        an np.array of per-variant log-likelihoods if per_site is True
+        """
+        self.update()
+        ret = _root_log_likelihoods(
+            self.root,
+            self.partials,
+            self.log_scale,
+            self._root_frequencies,
+            self._category_weights,
+        )
+        if self._site_pattern is not None:
+            total = np.sum(ret * self._site_weight)
+            if per_site:
+                return total, ret[self._site_pattern]
+            return total
+        total = np.sum(ret)
+        if per_site:
+            return total, ret
+        return total
+
+    def to_dataset(self):
+        """
+        Returns the current tree as a new tree dataset, without the
+        genotype data.
+
+        :return: phylokit.DataSet, tree data
+        """
+        return core.create_tree_dataset(
+            parent=self.parent.copy(),
+            left_child=self.left_child.copy(),
+            right_sib=self.right_sib.copy(),
+            samples=self.samples.copy(),
+            branch_length=self.branch_length.copy(),
+        )
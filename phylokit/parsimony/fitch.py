@@ -0,0 +1,182 @@
+import numpy as np
+from numba import prange
+
+from .. import jit
+
+# The number of sites packed into each word of the state sets.
+WORD_SIZE = 64
+# Each bit plane of the per-site score counters holds one binary digit of the
+# scores of the sites in a word, which is enough for any tree with fewer
+# than 2^32 nodes.
+_NUM_SCORE_PLANES = 32
+
+
+@jit.numba_njit(inline="always")
+def _add_to_counter(planes, mask):
+    # Adds one to the bit-sliced counter of each site whose bit is set in mask.
+    carry = mask
+    p = 0
+    while carry != 0:
+        t = planes[p] & carry
+        planes[p] ^= carry
+        carry = t
+        p += 1
+
+
+@jit.numba_njit()
+def _polytomy_sets(u, state_set, left_child, right_sib, allele_count, extra_score):
+    # Falls back to counting alleles site by site for nodes with more than
+    # two children, as in Hartigan's algorithm.
+    num_alleles = state_set.shape[1]
+    for i in range(WORD_SIZE):
+        bit = np.uint64(1) << np.uint64(i)
+        allele_count[:] = 0
+        num_children = 0
+        v = left_child[u]
+        while v != -1:
+            for k in range(num_alleles):
+                if state_set[v, k] & bit:
+                    allele_count[k] += 1
+            num_children += 1
+            v = right_sib[v]
+        max_allele_count = 0
+        for k in range(num_alleles):
+            if allele_count[k] > max_allele_count:
+                max_allele_count = allele_count[k]
+        for k in range(num_alleles):
+            if allele_count[k] == max_allele_count:
+                state_set[u, k] |= bit
+        extra_score[i] += num_children - max_allele_count
+
+
+@jit.numba_njit()
+def _fitch_word(
+    genotypes,
+    start,
+    stop,
+    postorder,
+    left_child,
+    right_sib,
+    samples,
+    state_set,
+    intersection,
+    allele_count,
+    planes,
+    extra_score,
+    score,
+):
+    # Scores the sites start to stop - 1 (at most one word of them), with
+    # bit i of state_set[u, k] set if allele k is in the state set of node u
+    # at site start + i. The last row of state_set belongs to the virtual root.
+    num_alleles = state_set.shape[1]
+    state_set[:] = 0
+    planes[:] = 0
+    extra_score[:] = 0
+    for i in range(stop - start):
+        bit = np.uint64(1) << np.uint64(i)
+        for j in range(samples.shape[0]):
+            state_set[samples[j], genotypes[start + i, j]] |= bit
+
+    for n in range(postorder.shape[0] + 1):
+        u = postorder[n] if n < postorder.shape[0] else -1
+        a = left_child[u]
+        if a == -1:
+            continue
+        b = right_sib[a]
+        if b == -1:
+            state_set[u] = state_set[a]
+        elif right_sib[b] == -1:
+            # The Fitch step: the state set is the intersection of the
+            # children's sets if it is not empty, and their union otherwise,
+            # at a cost of one.
+            nonempty = np.uint64(0)
+            for k in range(num_alleles):
+                intersection[k] = state_set[a, k] & state_set[b, k]
+                nonempty |= intersection[k]
+            empty = ~nonempty
+            for k in range(num_alleles):
+                state_set[u, k] = intersection[k] | (
+                    empty & (state_set[a, k] | state_set[b, k])
+                )
+            _add_to_counter(planes, empty)
+        else:
+            _polytomy_sets(
+                u, state_set, left_child, right_sib, allele_count, extra_score
+            )
+
+    for i in range(stop - start):
+        value = extra_score[i]
+        for p in range(_NUM_SCORE_PLANES):
+            if (planes[p] >> np.uint64(i)) & np.uint64(1):
+                value += 1 << p
+        score[start + i] = value
+
+
+@jit.numba_njit(parallel=True)
+def _fitch_parsimony(genotypes, postorder, left_child, right_sib, samples):
+    num_sites = genotypes.shape[0]
+    num_nodes = left_child.shape[0]
+    num_alleles = 1
+    if genotypes.size > 0:
+        num_alleles = np.max(genotypes) + 1
+    score = np.zeros(num_sites, dtype=np.int32)
+    num_words = (num_sites + WORD_SIZE - 1) // WORD_SIZE
+    for w in prange(num_words):
+        state_set = np.zeros((num_nodes, num_alleles), dtype=np.uint64)
+        intersection = np.zeros(num_alleles, dtype=np.uint64)
+        allele_count = np.zeros(num_alleles, dtype=np.int32)
+        planes = np.zeros(_NUM_SCORE_PLANES, dtype=np.uint64)
+        extra_score = np.zeros(WORD_SIZE, dtype=np.int32)
+        start = w * WORD_SIZE
+        _fitch_word(
+            genotypes,
+            start,
+            min(start + WORD_SIZE, num_sites),
+            postorder,
+            left_child,
+            right_sib,
+            samples,
+            state_set,
+            intersection,
+            allele_count,
+            planes,
+            extra_score,
+            score,
+        )
+    return score
+
+
+def fitch_parsimony_score(postorder, left_child, right_sib, samples, genotypes):
+    """
+    Calculate the parsimony score for each site using a bit-parallel version
+    of Fitch's algorithm. The state set of each node is stored as one bitmask
+    per allele, packed across 64 sites per machine word, so that the Fitch
+    step at a binary node updates 64 sites with a few bitwise operations and
+    the per-site scores are kept in bit-sliced counters. Nodes with more
+    than two children are scored site by site as in Hartigan's algorithm,
+    so the scores are the same as those of :func:`hartigan_parsimony_score`.
+    Only the state sets of a single word of sites are held in memory at once.
+
+    The leading dimensions of ``genotypes`` are treated as sites, so that
+    this function can be applied to blocks of an xarray dataset as well as
+    to a 2D array of sites by samples.
+
+    :param postorder: (dim: m) The postorder traversal of the tree.
+    :param left_child: (dim: n) The left child of each node.
+    :param right_sib: (dim: n) The right sibling of each node.
+    :param samples: (dim: s) The samples in the tree, which must be leaves.
+    :param genotypes: (dim: ..., s) The genotype of each sample at each site.
+    :return: The parsimony score for each site.
+    :rtype: numpy.ndarray
+    """
+    if np.any(left_child[samples] != -1):
+        raise ValueError("Samples must be leaves")
+    genotypes = np.asarray(genotypes)
+    score = _fitch_parsimony(
+        genotypes.reshape(-1, genotypes.shape[-1]),
+        postorder,
+        left_child,
+        right_sib,
+        samples,
+    )
+    return score.reshape(genotypes.shape[:-1])
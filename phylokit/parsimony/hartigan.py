@@ -3,6 +3,10 @@ import numpy as np
 import sgkit
 import xarray as xr
 from numba import int32
+from numba import prange
+
+from . import fitch
+from .. import jit
 
 
 @numba.njit()
@@ -110,6 +114,145 @@ def numba_hartigan_parsimony_vectorised(
     )
 
 
+@jit.numba_njit()
+def _hartigan_site(
+    genotypes,
+    preorder,
+    postorder,
+    parent,
+    left_child,
+    right_sib,
+    samples,
+    optimal_set,
+    allele_count,
+    state,
+):
+    # Computes the score for one site, using the traversal arrays rather than
+    # recursion and the caller's scratch buffers. The last row of optimal_set
+    # and the last element of state belong to the virtual root.
+    num_alleles = optimal_set.shape[1]
+    optimal_set[:] = 0
+    for j in range(samples.shape[0]):
+        optimal_set[samples[j], genotypes[j]] = 1
+    for u in postorder:
+        v = left_child[u]
+        if v != -1:
+            allele_count[:] = 0
+            while v != -1:
+                for k in range(num_alleles):
+                    allele_count[k] += optimal_set[v, k]
+                v = right_sib[v]
+            max_allele_count = 0
+            for k in range(num_alleles):
+                if allele_count[k] > max_allele_count:
+                    max_allele_count = allele_count[k]
+            for k in range(num_alleles):
+                if allele_count[k] == max_allele_count:
+                    optimal_set[u, k] = 1
+    # The optimal set of the virtual root is computed from the roots in the
+    # same way, and its state is the first allele in that set.
+    allele_count[:] = 0
+    v = left_child[-1]
+    while v != -1:
+        for k in range(num_alleles):
+            allele_count[k] += optimal_set[v, k]
+        v = right_sib[v]
+    max_allele_count = 0
+    for k in range(num_alleles):
+        if allele_count[k] > max_allele_count:
+            max_allele_count = allele_count[k]
+    state[-1] = 0
+    for k in range(num_alleles):
+        if allele_count[k] == max_allele_count:
+            state[-1] = k
+            break
+
+    score = 0
+    for u in preorder:
+        s = state[parent[u]]
+        if optimal_set[u, s] == 0:
+            s = 0
+            for k in range(num_alleles):
+                if optimal_set[u, k] > optimal_set[u, s]:
+                    s = k
+            score += 1
+        state[u] = s
+    return score
+
+
+_HARTIGAN_SITES_PER_TASK = 256
+
+
+@jit.numba_njit(parallel=True)
+def _hartigan_parsimony(
+    genotypes, preorder, postorder, parent, left_child, right_sib, samples
+):
+    num_sites = genotypes.shape[0]
+    num_nodes = left_child.shape[0]
+    num_alleles = 1
+    if genotypes.size > 0:
+        num_alleles = np.max(genotypes) + 1
+    score = np.zeros(num_sites, dtype=np.int32)
+    num_tasks = (num_sites + _HARTIGAN_SITES_PER_TASK - 1) // _HARTIGAN_SITES_PER_TASK
+    for k in prange(num_tasks):
+        optimal_set = np.zeros((num_nodes, num_alleles), dtype=np.int8)
+        allele_count = np.zeros(num_alleles, dtype=np.int32)
+        state = np.zeros(num_nodes, dtype=np.int32)
+        start = k * _HARTIGAN_SITES_PER_TASK
+        stop = min(start + _HARTIGAN_SITES_PER_TASK, num_sites)
+        for j in range(start, stop):
+            score[j] = _hartigan_site(
+                genotypes[j],
+                preorder,
+                postorder,
+                parent,
+                left_child,
+                right_sib,
+                samples,
+                optimal_set,
+                allele_count,
+                state,
+            )
+    return score
+
+
+def hartigan_parsimony_score(
+    preorder, postorder, parent, left_child, right_sib, samples, genotypes
+):
+    """
+    Calculate the parsimony score for each site, using iterative passes over
+    the precomputed traversals of the tree. The node state sets are held in
+    scratch buffers which are reused from site to site, so that no memory is
+    allocated per node or per site. The scores are the same as those of
+    :func:`numba_hartigan_parsimony_vectorised`.
+
+    The leading dimensions of ``genotypes`` are treated as sites, so that
+    this function can be applied to blocks of an xarray dataset as well as
+    to a 2D array of sites by samples.
+
+    :param preorder: (dim: m) The preorder traversal of the tree.
+    :param postorder: (dim: m) The postorder traversal of the tree.
+    :param parent: (dim: n) The parent of each node.
+    :param left_child: (dim: n) The left child of each node.
+    :param right_sib: (dim: n) The right sibling of each node.
+    :param samples: (dim: s) The samples in the tree.
+    :param genotypes: (dim: ..., s) The genotype of each sample at each site.
+    :return: The parsimony score for each site.
+    :rtype: numpy.ndarray
+    """
+    genotypes = np.asarray(genotypes)
+    score = _hartigan_parsimony(
+        genotypes.reshape(-1, genotypes.shape[-1]),
+        preorder,
+        postorder,
+        parent,
+        left_child,
+        right_sib,
+        samples,
+    )
+    return score.reshape(genotypes.shape[:-1])
+
+
 def ts_to_dataset(ts, chunks=None, samples=None):
     """
     Convert the specified tskit tree sequence into an sgkit dataset.
@@ -146,30 +289,59 @@ def ts_to_dataset(ts, chunks=None, samples=None):
     return ds
 
 
-def get_hartigan_parsimony_score(ds):
+def get_hartigan_parsimony_score(ds, backend="hartigan"):
     """
     Calculate the parsimony score for each site in the dataset.
 
+    The ``hartigan`` backend scores each site in turn with
+    :func:`hartigan_parsimony_score`. The ``fitch`` backend uses
+    :func:`.fitch.fitch_parsimony_score`, which packs 64 sites into each
+    machine word and is much faster, but requires all samples to be leaves.
+    Both backends give the same scores.
+
+    If the dataset has site patterns (see :func:`append_site_patterns`), each
+    unique pattern is scored once and the scores are expanded to all sites.
+
     :param ds: The dataset to calculate the parsimony score for.
+    :param backend: The algorithm to use, either "hartigan" or "fitch".
     :return: The parsimony score for each site in the dataset.
     :rtype: xarray.DataArray
     """
-    return xr.apply_ufunc(
-        numba_hartigan_parsimony_vectorised,
-        ds.node_left_child,
-        ds.node_right_sib,
-        ds.sample_node,
-        ds.call_genotype,
-        input_core_dims=[
-            ["nodes"],
-            ["nodes"],
-            ["samples"],
-            ["samples"],
-        ],
+    if backend == "hartigan":
+        func = hartigan_parsimony_score
+        args = [
+            (ds.traversal_preorder, ["traversal"]),
+            (ds.traversal_postorder, ["traversal"]),
+            (ds.node_parent, ["nodes"]),
+        ]
+    elif backend == "fitch":
+        func = fitch.fitch_parsimony_score
+        args = [(ds.traversal_postorder, ["traversal"])]
+    else:
+        raise ValueError(f"Unknown parsimony backend '{backend}'")
+    args += [
+        (ds.node_left_child, ["nodes"]),
+        (ds.node_right_sib, ["nodes"]),
+        (ds.sample_node, ["samples"]),
+    ]
+    has_patterns = "variant_site_pattern" in ds
+    if has_patterns:
+        args.append(
+            (ds.call_genotype.isel(variants=ds.site_pattern_variant), ["samples"])
+        )
+    else:
+        args.append((ds.call_genotype, ["samples"]))
+    score = xr.apply_ufunc(
+        func,
+        *[array for array, _ in args],
+        input_core_dims=[dims for _, dims in args],
         dask="parallelized",
         output_dtypes=[np.int32],
         dask_gufunc_kwargs={"allow_rechunk": True},
     )
+    if has_patterns:
+        score = score.isel(site_patterns=ds.variant_site_pattern)
+    return score
 
 
 def append_parsimony_score(ds):
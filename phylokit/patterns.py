@@ -0,0 +1,144 @@
+import numpy as np
+from numba import prange
+
+from . import core
+from . import jit
+
+# Each site is hashed with two polynomial hashes, of its even and of its odd
+# columns, modulo the Mersenne prime 2^31 - 1. The arithmetic cannot overflow
+# int64 and the reduction needs no division. The two hashes are independent,
+# so they are computed in parallel, and are packed into one 62-bit value.
+_HASH_PRIME = 2147483647
+_HASH_BASES = (1000003, 999983)
+
+
+@jit.numba_njit(inline="always")
+def _hash_step(h, base, value):
+    x = h * base + value
+    x = (x & _HASH_PRIME) + (x >> 31)
+    x = (x & _HASH_PRIME) + (x >> 31)
+    return x - _HASH_PRIME if x >= _HASH_PRIME else x
+
+
+@jit.numba_njit(parallel=True)
+def _site_hashes(genotypes, allele_id):
+    num_sites = genotypes.shape[0]
+    hashes = np.zeros(num_sites, dtype=np.int64)
+    b1, b2 = _HASH_BASES
+    for i in prange(num_sites):
+        h1 = allele_id[i] % _HASH_PRIME
+        h2 = h1
+        num_columns = genotypes.shape[1]
+        # Missing data (-1) must hash differently from allele 0.
+        for j in range(0, num_columns - 1, 2):
+            h1 = _hash_step(h1, b1, np.int64(genotypes[i, j]) + 2)
+            h2 = _hash_step(h2, b2, np.int64(genotypes[i, j + 1]) + 2)
+        if num_columns % 2 == 1:
+            h1 = _hash_step(h1, b1, np.int64(genotypes[i, num_columns - 1]) + 2)
+        hashes[i] = (h1 << 31) | h2
+    return hashes
+
+
+@jit.numba_njit()
+def _same_site(genotypes, allele_id, i, j):
+    if allele_id[i] != allele_id[j]:
+        return False
+    for k in range(genotypes.shape[1]):
+        if genotypes[i, k] != genotypes[j, k]:
+            return False
+    return True
+
+
+@jit.numba_njit()
+def _site_patterns(genotypes, allele_id, hashes):
+    # Sites with equal hashes are adjacent in the sorted order, and are
+    # compared in full against the patterns already found for that hash
+    # value, so hash collisions cannot merge different columns.
+    num_sites = genotypes.shape[0]
+    order = np.argsort(hashes, kind="mergesort")
+    site_pattern = np.zeros(num_sites, dtype=np.int32)
+    pattern_site = np.zeros(num_sites, dtype=np.int32)
+    num_patterns = 0
+    run_start = 0
+    for k in range(num_sites):
+        i = order[k]
+        if k == 0 or hashes[i] != hashes[order[k - 1]]:
+            run_start = num_patterns
+        pattern = -1
+        for p in range(run_start, num_patterns):
+            if _same_site(genotypes, allele_id, i, pattern_site[p]):
+                pattern = p
+                break
+        if pattern == -1:
+            pattern = num_patterns
+            pattern_site[pattern] = i
+            num_patterns += 1
+        site_pattern[i] = pattern
+    # The sort is stable, so each pattern's representative is its first
+    # site. Number the patterns in the order of their first sites.
+    pattern_site = pattern_site[:num_patterns]
+    pattern_order = np.argsort(pattern_site, kind="mergesort")
+    new_id = np.zeros(num_patterns, dtype=np.int32)
+    for p in range(num_patterns):
+        new_id[pattern_order[p]] = p
+    for i in range(num_sites):
+        site_pattern[i] = new_id[site_pattern[i]]
+    return site_pattern, pattern_site[pattern_order]
+
+
+def site_patterns(genotypes, alleles=None):
+    """
+    Returns the unique site patterns of the specified genotypes. Two sites
+    have the same pattern if they have the same genotypes for all samples
+    and, if ``alleles`` is given, the same alleles. Patterns are numbered
+    in the order of the first site with that pattern.
+
+    :param numpy.ndarray genotypes: The genotypes, with sites as the first
+        dimension.
+    :param numpy.ndarray alleles: The alleles of each site, or None.
+    :return : The pattern of each site, the first site with each pattern
+        and the number of sites with each pattern.
+    :rtype : tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    genotypes = np.asarray(genotypes)
+    genotypes = genotypes.reshape(genotypes.shape[0], np.prod(genotypes.shape[1:]))
+    if alleles is None:
+        allele_id = np.zeros(genotypes.shape[0], dtype=np.int64)
+    else:
+        alleles = np.asarray(alleles)
+        _, allele_id = np.unique(
+            alleles.reshape(alleles.shape[0], np.prod(alleles.shape[1:])),
+            axis=0,
+            return_inverse=True,
+        )
+        allele_id = allele_id.reshape(-1).astype(np.int64)
+    site_pattern, pattern_site = _site_patterns(
+        genotypes, allele_id, _site_hashes(genotypes, allele_id)
+    )
+    weight = np.bincount(site_pattern, minlength=pattern_site.shape[0])
+    return site_pattern, pattern_site, weight.astype(np.int32)
+
+
+def append_site_patterns(ds):
+    """
+    Append the unique site patterns of the ``call_genotype`` (and
+    ``variant_allele``, if present) variables to the dataset. Identical
+    columns only need to be scored once, and :func:`get_hartigan_parsimony_score`
+    and :func:`likelihood_felsenstein` score each pattern once, weighting or
+    expanding the results to all sites, if the patterns are present in the
+    dataset. The patterns must be recomputed if the genotypes are changed.
+
+    The variables added are ``variant_site_pattern``, the pattern of each
+    variant, ``site_pattern_variant``, the first variant with each pattern,
+    and ``site_pattern_weight``, the number of variants with each pattern.
+
+    :param xarray.DataSet ds: The dataset.
+    :return : The dataset with the site patterns appended.
+    :rtype : xarray.DataSet
+    """
+    alleles = ds.variant_allele.values if "variant_allele" in ds else None
+    site_pattern, pattern_site, weight = site_patterns(ds.call_genotype.values, alleles)
+    ds["variant_site_pattern"] = (core.DIM_VARIANT, site_pattern)
+    ds["site_pattern_variant"] = (core.DIM_SITE_PATTERN, pattern_site)
+    ds["site_pattern_weight"] = (core.DIM_SITE_PATTERN, weight)
+    return ds
@@ -0,0 +1,196 @@
+# Random tree generators.
+import numpy as np
+from numba import prange
+
+from . import core
+from . import jit
+from .traversal import _postorder
+
+_MODELS = {"yule": 0, "kingman": 1, "uniform": 2}
+
+
+def _stream_seeds(random_seed, num_trees):
+    # The SplitMix64 sequence starting from the seed gives the initial state
+    # of the random number stream of each tree, so that tree j is the same
+    # whatever the number of threads or trees generated.
+    seed = np.random.SeedSequence(random_seed).generate_state(1, dtype=np.uint64)[0]
+    x = seed + np.arange(1, num_trees + 1, dtype=np.uint64) * np.uint64(
+        0x9E3779B97F4A7C15
+    )
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    # The xorshift state must not be zero.
+    x[x == 0] = 1
+    return x
+
+
+@jit.numba_njit(inline="always")
+def _next_uniform(state):
+    # A xorshift64 stream, stored in the single element array state. Returns
+    # a uniform value in [0, 1) from the top 53 bits.
+    x = state[0]
+    x ^= x << np.uint64(13)
+    x ^= x >> np.uint64(7)
+    x ^= x << np.uint64(17)
+    state[0] = x
+    return (x >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@jit.numba_njit(inline="always")
+def _next_index(state, k):
+    return min(int(_next_uniform(state) * k), k - 1)
+
+
+@jit.numba_njit()
+def _sim_coalescent(n, model, state, parent, left_child, right_sib, time):
+    # Merges random pairs of lineages back in time. The topology is that of
+    # both the Yule and Kingman models, which differ only in the rate of
+    # merging k lineages (k for Yule, k(k - 1) / 2 for Kingman).
+    lineages = np.arange(n, dtype=np.int32)
+    t = 0.0
+    for k in range(n, 1, -1):
+        rate = k if model == 0 else k * (k - 1) / 2
+        t -= np.log(1.0 - _next_uniform(state)) / rate
+        i = _next_index(state, k)
+        j = _next_index(state, k - 1)
+        if j >= i:
+            j += 1
+        u = 2 * n - k
+        parent[lineages[i]] = u
+        parent[lineages[j]] = u
+        left_child[u] = lineages[i]
+        right_sib[lineages[i]] = lineages[j]
+        time[u] = t
+        lineages[min(i, j)] = u
+        lineages[max(i, j)] = lineages[k - 1]
+
+
+@jit.numba_njit()
+def _sim_uniform(n, state, parent, left_child, right_sib, time):
+    # Adds leaf i by splitting the branch above a uniformly chosen node of the
+    # tree on leaves 0, ..., i - 1, which gives a uniformly distributed rooted
+    # binary topology. Internal nodes are numbered in the order they are
+    # added, so node times are the heights (in branches) of the nodes.
+    root = 0
+    for i in range(1, n):
+        u = n + i - 1
+        # The tree has i leaves and the i - 1 internal nodes added so far.
+        c = _next_index(state, 2 * i - 1)
+        if c >= i:
+            c += n - i
+        p = parent[c]
+        if p == -1:
+            root = u
+        elif left_child[p] == c:
+            left_child[p] = u
+            right_sib[u] = right_sib[c]
+        else:
+            right_sib[left_child[p]] = u
+        parent[u] = p
+        parent[c] = u
+        parent[i] = u
+        left_child[u] = c
+        right_sib[c] = i
+        right_sib[i] = -1
+    left_child[-1] = root
+    for u in _postorder(left_child, right_sib, -1):
+        v = left_child[u]
+        while v != -1:
+            time[u] = max(time[u], time[v] + 1)
+            v = right_sib[v]
+
+
+@jit.numba_njit()
+def _sim_tree(n, model, seed, parent, left_child, right_sib, time):
+    state = np.full(1, seed, dtype=np.uint64)
+    parent[:] = -1
+    left_child[:] = -1
+    right_sib[:] = -1
+    time[:-1] = 0
+    time[-1] = np.inf
+    if model == 2:
+        _sim_uniform(n, state, parent, left_child, right_sib, time)
+    else:
+        _sim_coalescent(n, model, state, parent, left_child, right_sib, time)
+        left_child[-1] = 2 * n - 2
+
+
+@jit.numba_njit(parallel=True)
+def _sim_forest(n, model, seeds):
+    num_trees = seeds.shape[0]
+    num_nodes = 2 * n
+    parent = np.empty(num_trees * num_nodes, dtype=np.int32)
+    left_child = np.empty(num_trees * num_nodes, dtype=np.int32)
+    right_sib = np.empty(num_trees * num_nodes, dtype=np.int32)
+    time = np.empty(num_trees * num_nodes)
+    for j in prange(num_trees):
+        nodes = slice(j * num_nodes, (j + 1) * num_nodes)
+        _sim_tree(
+            n,
+            model,
+            seeds[j],
+            parent[nodes],
+            left_child[nodes],
+            right_sib[nodes],
+            time[nodes],
+        )
+    return parent, left_child, right_sib, time
+
+
+def sim_trees(num_leaves, num_trees=None, *, model="yule", random_seed=None):
+    """
+    Returns random binary trees with the specified number of leaves, generated
+    directly into the tree arrays. The leaves are the sample nodes ``0``
+    to ``num_leaves - 1``. The models are:
+
+    - ``yule``: the Yule (pure birth) model with a birth rate of 1, where
+      the time while there are k lineages is exponential with rate k.
+    - ``kingman``: the Kingman coalescent, where the time while there are k
+      lineages is exponential with rate k(k - 1) / 2.
+    - ``uniform``: the uniform (PDA) distribution on rooted binary
+      topologies, with node times given by the node heights in branches.
+
+    If ``num_trees`` is specified a forest dataset of that many independent
+    trees is returned, generated in parallel. Each tree draws from its own
+    random number stream, derived from the random seed and the tree's index,
+    so the trees are reproducible regardless of the number of threads, and
+    the first k trees are the same whatever the number of trees.
+
+    :param int num_leaves: The number of leaves in each tree.
+    :param int num_trees: The number of trees, or None to return a single tree.
+    :param str model: The random tree model.
+    :param int random_seed: The seed for the random number streams.
+    :return : A tree dataset, or a forest dataset if num_trees is specified.
+    :rtype : xarray.DataSet
+    """
+    if model not in _MODELS:
+        raise ValueError(f"Unknown model '{model}'")
+    if num_leaves < 1:
+        raise ValueError("At least one leaf is required")
+    if num_trees is not None and num_trees < 1:
+        raise ValueError("At least one tree is required")
+    parent, left_child, right_sib, time = _sim_forest(
+        num_leaves,
+        _MODELS[model],
+        _stream_seeds(random_seed, 1 if num_trees is None else num_trees),
+    )
+    samples = np.arange(num_leaves, dtype=np.int32)
+    if num_trees is None:
+        return core.create_tree_dataset(
+            parent=parent,
+            left_child=left_child,
+            right_sib=right_sib,
+            time=time,
+            samples=samples,
+        )
+    return core.create_forest_dataset(
+        parent=parent,
+        left_child=left_child,
+        right_sib=right_sib,
+        time=time,
+        samples=np.tile(samples, num_trees),
+        node_offset=np.arange(num_trees + 1) * 2 * num_leaves,
+        sample_offset=np.arange(num_trees + 1) * num_leaves,
+        tree_id=np.arange(num_trees),
+    )
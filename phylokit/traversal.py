@@ -1,8 +1,30 @@
 import numpy as np
+from numba import prange
 
 from . import jit
 
 
+@jit.numba_njit(inline="always")
+def _push_children(u, left_child, right_sib, stack, stack_top):
+    """
+    Pushes the children of u onto the preallocated array stack, returning the
+    new index of the top of the stack. The stack must have space for all nodes
+    in the tree, and stack_top is -1 for an empty stack. Pushing the children
+    of the virtual root pushes all of the roots. Kernels carrying a payload
+    (such as the depth) down the tree keep it in a parallel array indexed by
+    stack slot, so that the payload of stack[i] is payload[i]. After pushing
+    the children of u they set the payload of the new slots,
+    old_top + 1 to new_top, and read the payload of the top slot when
+    popping it.
+    """
+    v = left_child[u]
+    while v != -1:
+        stack_top += 1
+        stack[stack_top] = v
+        v = right_sib[v]
+    return stack_top
+
+
 @jit.numba_njit()
 def _postorder(left_child, right_sib, root):
     # Another implementation with python stack operations such as `pop`
@@ -118,3 +140,83 @@ def preorder(ds, root=None):
         ds.node_right_sib.data,
         root,
     )
+
+
+@jit.numba_njit()
+def _compact_forest_traversal(buffer, node_offset, count):
+    # Tree j's traversal is stored in buffer at node_offset[j] - j, which is
+    # large enough for all of its nodes apart from the virtual root.
+    num_trees = node_offset.shape[0] - 1
+    offset = np.zeros(num_trees + 1, dtype=np.int64)
+    for j in range(num_trees):
+        offset[j + 1] = offset[j] + count[j]
+    ret = np.zeros(offset[-1], dtype=np.int32)
+    for j in range(num_trees):
+        start = node_offset[j] - j
+        ret[offset[j] : offset[j + 1]] = buffer[start : start + count[j]]
+    return ret, offset
+
+
+@jit.numba_njit(parallel=True)
+def _forest_postorder(left_child, right_sib, node_offset):
+    num_trees = node_offset.shape[0] - 1
+    buffer = np.zeros(left_child.shape[0] - num_trees, dtype=np.int32)
+    count = np.zeros(num_trees, dtype=np.int64)
+    for j in prange(num_trees):
+        start = node_offset[j]
+        stop = node_offset[j + 1]
+        order = _postorder(left_child[start:stop], right_sib[start:stop], -1)
+        buffer[start - j : start - j + order.shape[0]] = order
+        count[j] = order.shape[0]
+    return _compact_forest_traversal(buffer, node_offset, count)
+
+
+def forest_postorder(ds):
+    """
+    Returns the postorder traversals of all trees in a forest dataset,
+    computed in a single pass over the concatenated arrays.
+
+    :param xarray.DataSet ds: The forest dataset.
+    :return : The concatenated postorder traversals and the CSR-style offsets
+        of each tree's traversal within them.
+    :rtype : tuple(numpy.ndarray, numpy.ndarray)
+    """
+    return _forest_postorder(
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        ds.tree_node_offset.data,
+    )
+
+
+@jit.numba_njit(parallel=True)
+def _forest_preorder(parent, left_child, right_sib, node_offset):
+    num_trees = node_offset.shape[0] - 1
+    buffer = np.zeros(left_child.shape[0] - num_trees, dtype=np.int32)
+    count = np.zeros(num_trees, dtype=np.int64)
+    for j in prange(num_trees):
+        start = node_offset[j]
+        stop = node_offset[j + 1]
+        order = _preorder(
+            parent[start:stop], left_child[start:stop], right_sib[start:stop], -1
+        )
+        buffer[start - j : start - j + order.shape[0]] = order
+        count[j] = order.shape[0]
+    return _compact_forest_traversal(buffer, node_offset, count)
+
+
+def forest_preorder(ds):
+    """
+    Returns the preorder traversals of all trees in a forest dataset,
+    computed in a single pass over the concatenated arrays.
+
+    :param xarray.DataSet ds: The forest dataset.
+    :return : The concatenated preorder traversals and the CSR-style offsets
+        of each tree's traversal within them.
+    :rtype : tuple(numpy.ndarray, numpy.ndarray)
+    """
+    return _forest_preorder(
+        ds.node_parent.data,
+        ds.node_left_child.data,
+        ds.node_right_sib.data,
+        ds.tree_node_offset.data,
+    )
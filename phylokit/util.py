@@ -14,6 +14,7 @@ def _is_unary(postorder, left_child, right_sib):
             v = right_sib[v]
         if num_children == 1:
             return True
+    return False
 
 
 def is_unary(ds):
@@ -97,6 +98,16 @@ def _get_node_branch_length(parent, time):
     return ret
 
 
+@jit.numba_njit(parallel=True)
+def _forest_node_branch_length(parent, time, node_offset):
+    ret = np.zeros_like(parent, dtype=np.float64)
+    for j in prange(node_offset.shape[0] - 1):
+        start = node_offset[j]
+        stop = node_offset[j + 1]
+        ret[start:stop] = _get_node_branch_length(parent[start:stop], time[start:stop])
+    return ret
+
+
 def get_node_branch_length(ds):
     """
     Returns the branch length of each node in the tree.
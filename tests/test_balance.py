@@ -1,6 +1,12 @@
 # Tests for the tree balance/imbalance metrics
+import itertools
+import math
+
+import msprime
+import numpy as np
 import pytest
 import tskit
+from numpy.testing import assert_array_equal
 
 import phylokit as pk
 
@@ -272,3 +278,206 @@ class TestAllRootsN5:
     def test_b2(self):
         with pytest.raises(ValueError):
             pk.b2_index(self.tree())
+
+
+class TestForest:
+    def trees(self):
+        return [
+            TestBalancedBinaryOdd().tree(),
+            TestBalancedTernary().tree(),
+            TestStarN10().tree(),
+            TestCombN5().tree(),
+            TestMultiRootBinary().tree(),
+            TestEmpty().tree(),
+            TestAllRootsN5().tree(),
+        ]
+
+    def test_sackin(self):
+        trees = self.trees()
+        forest = pk.core.concat_trees(trees)
+        assert_array_equal(
+            pk.forest_sackin_index(forest), [pk.sackin_index(tree) for tree in trees]
+        )
+
+    def per_tree(self, func, trees):
+        ret = []
+        for tree in trees:
+            try:
+                ret.append(func(tree))
+            except ValueError:
+                ret.append(np.nan)
+        return ret
+
+    def test_colless(self):
+        trees = self.trees()
+        forest = pk.core.concat_trees(trees)
+        result = pk.forest_colless_index(forest)
+        assert_array_equal(result, self.per_tree(pk.colless_index, trees))
+        assert_array_equal(np.isnan(result), [False, True, True, False] + [True] * 3)
+
+    def test_b1(self):
+        trees = self.trees()
+        forest = pk.core.concat_trees(trees)
+        np.testing.assert_allclose(
+            pk.forest_b1_index(forest), self.per_tree(pk.b1_index, trees)
+        )
+
+    @pytest.mark.parametrize("base", [2, 10])
+    def test_b2(self, base):
+        trees = self.trees()
+        forest = pk.core.concat_trees(trees)
+        np.testing.assert_allclose(
+            pk.forest_b2_index(forest, base=base),
+            self.per_tree(lambda tree: pk.b2_index(tree, base=base), trees),
+        )
+
+    def test_b2_bad_base(self):
+        forest = pk.core.concat_trees(self.trees())
+        with pytest.raises(ValueError):
+            pk.forest_b2_index(forest, base=-1)
+
+    def test_tree_statistics(self):
+        trees = self.trees()
+        forest = pk.core.concat_trees(trees)
+        result = pk.forest_tree_statistics(forest)
+        for j, tree in enumerate(trees):
+            for name, value in pk.tree_statistics(tree).items():
+                assert_array_equal(result[name][j], value)
+        assert result["num_leaves"].dtype == np.int64
+        result = pk.forest_tree_statistics(forest, ["b1"])
+        assert list(result) == ["b1"]
+
+    def test_tree_sequence(self):
+        ts = msprime.sim_ancestry(
+            10, ploidy=1, sequence_length=100, recombination_rate=0.05, random_seed=1
+        )
+        forest = pk.from_tskit_sequence(ts, forest=True)
+        trees = [pk.from_tskit(tree) for tree in ts.trees()]
+        for forest_func, func in [
+            (pk.forest_sackin_index, pk.sackin_index),
+            (pk.forest_colless_index, pk.colless_index),
+            (pk.forest_b1_index, pk.b1_index),
+            (pk.forest_b2_index, pk.b2_index),
+        ]:
+            np.testing.assert_allclose(forest_func(forest), [func(t) for t in trees])
+
+
+class TestCaterpillar:
+    # Deep enough that the probability of reaching the deepest leaves
+    # underflows unless it is kept in log space.
+    n = 10**5
+
+    def tree(self):
+        return pk.from_tskit(tskit.Tree.generate_comb(self.n))
+
+    def test_sackin(self):
+        assert pk.sackin_index(self.tree()) == self.n * (self.n + 1) // 2 - 1
+
+    def test_b2(self):
+        # Converges to 2 bits as n grows.
+        assert pk.b2_index(self.tree()) == pytest.approx(2 * math.log10(2))
+        assert pk.b2_index(self.tree(), base=2) == pytest.approx(2)
+
+    def test_tree_statistics(self):
+        stats = pk.tree_statistics(self.tree(), ["sackin", "b2", "max_depth"])
+        assert stats["sackin"] == self.n * (self.n + 1) // 2 - 1
+        assert stats["b2"] == pytest.approx(2 * math.log10(2))
+        assert stats["max_depth"] == self.n - 1
+
+
+class TestB2MultiRoot:
+    def test_sum_over_roots(self):
+        # Roots 11 and 15 of TestMultiRootBinary have B2 indexes of 2 and 2.25
+        # bits, and the kernel returns their sum.
+        ds = TestMultiRootBinary().tree()
+        result = pk.balance._b2_index(
+            -1, ds.node_left_child.data, ds.node_right_sib.data, 2
+        )
+        assert result == pytest.approx(4.25)
+
+    def test_subtrees(self):
+        ds = TestMultiRootBinary().tree()
+        left_child = ds.node_left_child.data
+        right_sib = ds.node_right_sib.data
+        # Passing a node in place of the virtual root treats its children
+        # (12 and 14, with B2 indexes of 1 and 1.5 bits) as the roots.
+        assert pk.balance._b2_index(15, left_child, right_sib, 2) == pytest.approx(2.5)
+        assert pk.balance._sackin_index(15, left_child, right_sib) == 7
+
+
+class TestB1Nonbinary:
+    # Children of different heights, where the B1 index depends on the
+    # tallest of all the children rather than of the first two.
+    def tsk_tree(self):
+        return tskit.Tree.generate_balanced(20, arity=4)
+
+    def test_b1(self):
+        tree = self.tsk_tree()
+        assert pk.b1_index(pk.from_tskit(tree)) == pytest.approx(tree.b1_index())
+
+
+class TestTreeStatistics:
+    def tsk_trees():
+        yield TestBalancedBinaryOdd().tsk_tree()
+        yield TestBalancedBinaryEven().tsk_tree()
+        yield TestBalancedTernary().tsk_tree()
+        yield TestStarN10().tsk_tree()
+        yield TestCombN5().tsk_tree()
+        yield TestMultiRootBinary().tsk_tree()
+        yield TestEmpty().tsk_tree()
+        yield TestTreeInNullState().tsk_tree()
+        yield TestAllRootsN5().tsk_tree()
+        yield TestB1Nonbinary().tsk_tree()
+        for seed in range(1, 4):
+            yield msprime.sim_ancestry(20, ploidy=1, random_seed=seed).first()
+
+    @pytest.mark.parametrize("tsk_tree", tsk_trees())
+    def test_balance_indexes(self, tsk_tree):
+        ds = pk.from_tskit(tsk_tree)
+        stats = pk.tree_statistics(ds)
+        for name, func in [
+            ("sackin", pk.sackin_index),
+            ("colless", pk.colless_index),
+            ("b1", pk.b1_index),
+            ("b2", pk.b2_index),
+        ]:
+            try:
+                expected = func(ds)
+            except ValueError:
+                assert np.isnan(stats[name])
+            else:
+                assert stats[name] == pytest.approx(expected)
+
+    @pytest.mark.parametrize("tsk_tree", tsk_trees())
+    def test_other_statistics(self, tsk_tree):
+        stats = pk.tree_statistics(pk.from_tskit(tsk_tree))
+        leaves = [u for u in tsk_tree.nodes() if tsk_tree.is_leaf(u)]
+        assert stats["num_leaves"] == len(leaves)
+        assert stats["max_depth"] == max([tsk_tree.depth(u) for u in leaves] + [0])
+        assert stats["num_cherries"] == sum(
+            tsk_tree.num_children(u) == 2
+            and all(tsk_tree.is_leaf(v) for v in tsk_tree.children(u))
+            for u in tsk_tree.nodes()
+        )
+        total_cophenetic = 0
+        for u, v in itertools.combinations(leaves, 2):
+            mrca = tsk_tree.mrca(u, v)
+            if mrca != tskit.NULL:
+                total_cophenetic += tsk_tree.depth(mrca)
+        assert stats["total_cophenetic"] == total_cophenetic
+
+    def test_subset(self):
+        ds = TestCombN5().tree()
+        stats = pk.tree_statistics(ds, ["num_cherries", "b2"], base=2)
+        assert list(stats) == ["num_cherries", "b2"]
+        assert stats["num_cherries"] == 1
+        assert stats["b2"] == pytest.approx(pk.b2_index(ds, base=2))
+        assert pk.tree_statistics(ds, []) == {}
+
+    def test_unknown_statistic(self):
+        with pytest.raises(ValueError, match="Unknown tree statistic 'xyz'"):
+            pk.tree_statistics(TestCombN5().tree(), ["sackin", "xyz"])
+
+    def test_bad_base(self):
+        with pytest.raises(ValueError):
+            pk.tree_statistics(TestCombN5().tree(), ["b2"], base=0)
@@ -1,3 +1,9 @@
+import io
+import os
+import re
+import subprocess
+import sys
+
 import msprime
 import numpy as np
 import pytest
@@ -5,6 +11,7 @@ import tskit
 from numpy.testing import assert_array_equal
 
 import phylokit as pk
+from phylokit import core
 
 
 def assert_tsk_pk_trees_equal(tsk_tree, pk_ds):
@@ -50,9 +57,179 @@ class TestFromTskit:
         assert_array_equal(ds.sample_node, [1, 2])
 
 
-# TODO
+class TestFromTskitSequence:
+    def tree_sequences(self):
+        ts = msprime.sim_ancestry(
+            10,
+            sequence_length=1e6,
+            recombination_rate=1e-8,
+            population_size=1e4,
+            random_seed=2,
+        )
+        yield ts
+        yield ts.decapitate(1e4)
+        yield ts.delete_intervals([[1e5, 2e5]])
+        yield msprime.sim_ancestry(
+            5,
+            sequence_length=100,
+            recombination_rate=0.01,
+            record_full_arg=True,
+            random_seed=3,
+        )
+        yield tskit.Tree.generate_balanced(5).tree_sequence
+
+    def test_from_tskit_copies_arrays(self):
+        ts = next(self.tree_sequences())
+        datasets = [pk.from_tskit(tree) for tree in ts.trees()]
+        for tree, ds in zip(ts.trees(), datasets):
+            assert_tsk_pk_trees_equal(tree, ds)
+
+    def test_trees(self):
+        for ts in self.tree_sequences():
+            datasets = list(pk.from_tskit_sequence(ts))
+            assert len(datasets) == ts.num_trees
+            for tree, ds in zip(ts.trees(), datasets):
+                assert_tsk_pk_trees_equal(tree, ds)
+                assert_array_equal(tree.preorder(), ds.traversal_preorder)
+                expected = pk.from_tskit(tree)
+                assert_array_equal(expected.node_branch_length, ds.node_branch_length)
+
+    def test_shared_time_read_only(self):
+        ts = next(self.tree_sequences())
+        datasets = list(pk.from_tskit_sequence(ts))
+        for ds in datasets:
+            assert not ds.node_time.data.flags.writeable
+            with pytest.raises(ValueError):
+                ds.node_time.data[0] = 1
+
+    def test_forest(self):
+        for ts in self.tree_sequences():
+            ds = pk.from_tskit_sequence(ts, forest=True)
+            assert core.get_num_trees(ds) == ts.num_trees
+            assert_array_equal(ds.tree_id, np.arange(ts.num_trees))
+            for j, tree in enumerate(ts.trees()):
+                pk_tree = core.get_tree(ds, j)
+                # Nodes are numbered in order of ID, so the samples come first.
+                assert_array_equal(pk_tree.sample_node, np.arange(ts.num_samples))
+                nodes = np.sort(tree.preorder())
+                assert pk_tree.sizes["nodes"] == len(nodes) + 1
+                assert_array_equal(pk_tree.node_time[:-1], ts.nodes_time[nodes])
+                local = np.full(ts.num_nodes + 1, -1)
+                local[nodes] = np.arange(len(nodes))
+                parent = tree.parent_array[nodes]
+                assert_array_equal(
+                    pk_tree.node_parent[:-1], np.where(parent == -1, -1, local[parent])
+                )
+                left_child = pk_tree.node_left_child.data
+                right_sib = pk_tree.node_right_sib.data
+                roots = []
+                u = left_child[-1]
+                while u != -1:
+                    roots.append(u)
+                    u = right_sib[u]
+                assert roots == [local[u] for u in tree.roots]
+
+
+def assert_indexes_built(ts):
+    tables = ts.dump_tables()
+    tables.build_index()
+    assert_array_equal(
+        ts.tables.indexes.edge_insertion_order, tables.indexes.edge_insertion_order
+    )
+    assert_array_equal(
+        ts.tables.indexes.edge_removal_order, tables.indexes.edge_removal_order
+    )
+
+
 class TestToTskit:
-    pass
+    @pytest.mark.parametrize("n", [2, 10, 100])
+    def test_msprime(self, n):
+        tree = msprime.sim_ancestry(n, ploidy=1, random_seed=2).first()
+        tree2 = pk.to_tskit(pk.from_tskit(tree))
+        t1 = tree.tree_sequence.tables
+        t2 = tree2.tree_sequence.tables
+        assert t1.edges == t2.edges
+        assert_array_equal(t1.nodes.time, t2.nodes.time)
+        assert_array_equal(t1.nodes.flags, t2.nodes.flags)
+        assert_indexes_built(tree2.tree_sequence)
+
+    def test_permuted(self):
+        tree = tskit.Tree.generate_balanced(10, arity=3)
+        ds = pk.from_tskit(tree)
+        n = ds.sizes["nodes"] - 1
+        ordering = np.append(np.random.default_rng(1).permutation(n), n)
+        permuted = pk.permute_tree(ds, ordering)
+        permuted["node_time"] = ds.node_time[ordering]
+        ds = permuted
+        tree2 = pk.to_tskit(ds)
+        assert_array_equal(tree2.parent_array, ds.node_parent)
+        assert_array_equal(tree2.tree_sequence.nodes_time, ds.node_time[:-1])
+        assert_indexes_built(tree2.tree_sequence)
+
+
+class TestForestToTskit:
+    def trees(self):
+        ts = msprime.sim_ancestry(
+            10,
+            sequence_length=1e6,
+            recombination_rate=1e-8,
+            population_size=1e4,
+            ploidy=1,
+            random_seed=2,
+        )
+        return [ts.at_index(j) for j in range(20)]
+
+    def test_msprime(self):
+        trees = self.trees()
+        ds = core.concat_trees([pk.from_tskit(tree) for tree in trees])
+        ts = pk.forest_to_tskit(ds)
+        assert ts.num_trees == len(trees)
+        assert ts.num_samples == 10
+        assert ts.sequence_length == len(trees)
+        for tree, tree2 in zip(trees, ts.trees()):
+            assert tree.rank() == tree2.rank()
+            assert tree.total_branch_length == pytest.approx(tree2.total_branch_length)
+        assert_indexes_built(ts)
+
+    def test_single_tree(self):
+        tree = tskit.Tree.generate_balanced(10, arity=3)
+        ds = core.concat_trees([pk.from_tskit(tree)])
+        ts = pk.forest_to_tskit(ds)
+        assert ts.first().rank() == tree.rank()
+        assert_indexes_built(ts)
+
+    def test_sample_id(self):
+        trees = []
+        for s in ["((a:1,b:1):1,c:2);", "((c:1,a:1):1,b:2);"]:
+            ds = pk.from_newick(s)
+            ds["node_time"] = ("nodes", [0, 0, 0, 2, 1, np.inf])
+            trees.append(ds)
+        ts = pk.forest_to_tskit(core.concat_trees(trees))
+        assert ts.num_samples == 3
+        assert [
+            tree.as_newick(node_labels={0: "a", 1: "b", 2: "c"}) for tree in ts.trees()
+        ] == [
+            "(c:2,(a:1,b:1):1);",
+            "(b:2,(a:1,c:1):1);",
+        ]
+        assert_indexes_built(ts)
+
+    def test_mismatched_samples(self):
+        trees = [
+            pk.from_tskit(tskit.Tree.generate_comb(3)),
+            pk.from_tskit(tskit.Tree.generate_comb(4)),
+        ]
+        with pytest.raises(ValueError, match="number of samples"):
+            pk.forest_to_tskit(core.concat_trees(trees))
+
+    def test_mismatched_sample_id(self):
+        trees = []
+        for s in ["(a:1,b:1);", "(a:1,c:1);"]:
+            ds = pk.from_newick(s)
+            ds["node_time"] = ("nodes", [0, 0, 1, np.inf])
+            trees.append(ds)
+        with pytest.raises(ValueError, match="sample IDs"):
+            pk.forest_to_tskit(core.concat_trees(trees))
 
 
 # Defining this function here for now, but it should be implemented and jitted.
@@ -98,6 +275,250 @@ class TestFromNewick:
         tsk_tree = tskit.Tree.generate_comb(n)
         self.validate_tsk_tree(tsk_tree)
 
+    @pytest.mark.parametrize("n", [3, 10, 100])
+    def test_msprime(self, n):
+        tsk_tree = msprime.sim_ancestry(n, ploidy=1, random_seed=3).first()
+        ds = pk.from_newick(tsk_tree.as_newick(precision=14))
+        for tsk_u in tsk_tree.samples():
+            pk_u = int(np.where(ds.sample_id.data == f"n{tsk_u}")[0][0])
+            path_pk = pk_path_to_root(ds, pk_u)
+            path_tsk = tsk_path_to_root(tsk_tree, tsk_u)
+            assert path_pk.shape == path_tsk.shape
+            tsk_branch_length = [tsk_tree.branch_length(v) for v in path_tsk]
+            np.testing.assert_allclose(
+                ds.node_branch_length[path_pk], tsk_branch_length, atol=1e-13
+            )
+
+    def test_leaves_are_samples(self):
+        ds = pk.from_newick("((a:1,b:1)x:1,(c:1,(d:1,e:1):1):1);")
+        assert_array_equal(ds.sample_node, np.arange(5))
+        assert_array_equal(ds.sample_id, ["a", "b", "c", "d", "e"])
+        assert_array_equal(ds.node_left_child[:5], -1)
+        assert ds.node_left_child[-1] == 5
+
+    def test_quoted_labels(self):
+        ds = pk.from_newick("('a b':1,'it''s (x)':2,'':3);")
+        assert_array_equal(ds.sample_id, ["a b", "it's (x)", ""])
+        assert_array_equal(ds.node_branch_length[:3], [1, 2, 3])
+
+    def test_comments(self):
+        ds = pk.from_newick("[&R] ((a[&x=1]:1,b:[c,d]2)[comment]:3, c:4);")
+        assert_array_equal(ds.sample_id, ["a", "b", "c"])
+        assert_array_equal(ds.node_branch_length[:5], [1, 2, 4, 0, 3])
+
+    def test_internal_labels(self):
+        ds = pk.from_newick("((a:1,b:1)ab:1,c:2)root;")
+        assert_array_equal(ds.sample_id, ["a", "b", "c"])
+        assert ds.sizes["nodes"] == 6
+
+    def test_whitespace(self):
+        ds = pk.from_newick(" ( a : 1 ,\n\t b : 2 ) ; ")
+        assert_array_equal(ds.sample_id, ["a", "b"])
+        assert_array_equal(ds.node_branch_length[:2], [1, 2])
+
+    def test_missing_semicolon(self):
+        ds = pk.from_newick("(a:1,b:2)")
+        assert_array_equal(ds.sample_id, ["a", "b"])
+
+    def test_first_tree_only(self):
+        ds = pk.from_newick("(a:1,b:2);((c:1,d:1):1,e:2);")
+        assert_array_equal(ds.sample_id, ["a", "b"])
+
+    def test_single_leaf(self):
+        ds = pk.from_newick("a;")
+        assert_array_equal(ds.node_parent, [-1, -1])
+        assert_array_equal(ds.node_left_child, [-1, 0])
+
+    @pytest.mark.parametrize(
+        "x", [0.1, 1 / 3, 1e-300, 1.7976931348623157e308, 123456789.123456789, -2.5]
+    )
+    @pytest.mark.parametrize("fmt", ["{!r}", "{:.6g}", "{:.3e}", "{:.20f}"])
+    def test_branch_length_exact(self, x, fmt):
+        s = fmt.format(x)
+        ds = pk.from_newick(f"(a:{s},b:1);")
+        assert ds.node_branch_length[0] == float(s)
+
+    @pytest.mark.parametrize(
+        "s",
+        [
+            "",
+            "  ;",
+            "(a,b;",
+            "(a,b));",
+            "a,b;",
+            "(a,b)c d;",
+            "(a:1 b,c);",
+            "(a,b)[c;",
+            "('a,b);",
+            "(a:x,b);",
+            "(a:1:2,b);",
+            "(a::2,b);",
+            "(a:1,b:2:3)c;",
+            "(a,b):1:2;",
+        ],
+    )
+    def test_malformed(self, s):
+        with pytest.raises(ValueError):
+            pk.from_newick(s)
+
+
+NEXUS_TREES = """#NEXUS
+[A comment; with a semicolon]
+Begin taxa;
+    Dimensions ntax=3;
+    Taxlabels 'a b' c 'd;''e';
+End;
+Begin trees;
+    Translate
+        1 'a b',
+        2 c,
+        3 'd;''e'
+    ;
+    tree STATE_0 [&lnP=-1.5,posterior=-2] = [&R] ((1:1,2:1):1,3:2);
+    tree STATE_10 = [&R] ((1:1,3:1):1,2:2);
+    tree STATE_20 = [&R] ((2:1,3:1):1,1:2);
+End;
+"""
+
+
+class TestReadTrees:
+    def newick_trees(self, num_trees=50):
+        ts = msprime.sim_ancestry(
+            10,
+            sequence_length=1e6,
+            recombination_rate=1e-8,
+            population_size=1e4,
+            ploidy=1,
+            random_seed=2,
+        )
+        assert ts.num_trees >= num_trees
+        return [tree.as_newick() for tree in ts.trees()][:num_trees]
+
+    def assert_trees_equal(self, ds, s):
+        expected = pk.from_newick(s)
+        assert pk.to_newick(ds) == pk.to_newick(expected)
+        assert_array_equal(ds.sample_id, expected.sample_id)
+
+    @pytest.mark.parametrize("chunk_size", [1, 100, 2**20])
+    def test_newick(self, chunk_size):
+        trees = self.newick_trees()
+        f = io.StringIO("\n".join(trees))
+        result = list(pk.read_trees(f, chunk_size=chunk_size))
+        assert len(result) == len(trees)
+        for ds, s in zip(result, trees):
+            self.assert_trees_equal(ds, s)
+
+    def test_path(self, tmp_path):
+        trees = self.newick_trees()
+        path = tmp_path / "trees.nwk"
+        path.write_text("\n".join(trees) + "\n")
+        result = list(pk.read_trees(path))
+        assert len(result) == len(trees)
+        assert len(list(pk.read_trees(str(path)))) == len(trees)
+
+    @pytest.mark.parametrize("batch_size", [1, 7, 50, 100])
+    @pytest.mark.parametrize("burnin", [0, 5])
+    @pytest.mark.parametrize("thin", [1, 3])
+    def test_batches(self, batch_size, burnin, thin):
+        trees = self.newick_trees()
+        f = io.BytesIO(";".join(trees).encode())
+        tree_id = np.arange(burnin, len(trees), thin)
+        forests = list(
+            pk.read_trees(
+                f, batch_size=batch_size, burnin=burnin, thin=thin, chunk_size=1000
+            )
+        )
+        assert [core.get_num_trees(ds) for ds in forests[:-1]] == [batch_size] * (
+            len(forests) - 1
+        )
+        assert_array_equal(np.concatenate([ds.tree_id for ds in forests]), tree_id)
+        for ds in forests:
+            for j, k in enumerate(ds.tree_id.values):
+                self.assert_trees_equal(core.get_tree(ds, j), trees[k])
+
+    def test_thin(self):
+        trees = self.newick_trees()
+        f = io.StringIO("\n".join(trees))
+        result = list(pk.read_trees(f, burnin=10, thin=4))
+        assert len(result) == 10
+        for ds, s in zip(result, trees[10::4]):
+            self.assert_trees_equal(ds, s)
+
+    def test_num_workers(self):
+        trees = self.newick_trees()
+        f = io.StringIO("\n".join(trees))
+        forests = list(pk.read_trees(f, batch_size=4, num_workers=2))
+        assert_array_equal(
+            np.concatenate([ds.tree_id for ds in forests]), np.arange(len(trees))
+        )
+        for ds in forests:
+            for j, k in enumerate(ds.tree_id.values):
+                self.assert_trees_equal(core.get_tree(ds, j), trees[k])
+
+    def test_num_workers_after_parallel_kernel(self):
+        # Forking after a parallel kernel has started numba's threading layer
+        # could hang the workers or the interpreter at exit, so run this in a
+        # fresh process with a timeout.
+        script = "\n".join(
+            [
+                "import io",
+                "import phylokit as pk",
+                "s = '((a:1,b:2):1,(c:1,d:1):2);' * 8",
+                "assert len(list(pk.read_trees(io.StringIO(s), batch_size=3))) == 3",
+                "forests = pk.read_trees(io.StringIO(s), batch_size=2, num_workers=2)",
+                "assert len(list(forests)) == 4",
+            ]
+        )
+        env = dict(os.environ)
+        path = os.path.dirname(os.path.dirname(os.path.abspath(pk.__file__)))
+        env["PYTHONPATH"] = os.pathsep.join([path, env.get("PYTHONPATH", "")])
+        result = subprocess.run(
+            [sys.executable, "-c", script], env=env, timeout=600, capture_output=True
+        )
+        assert result.returncode == 0, result.stderr.decode()
+
+    @pytest.mark.parametrize("chunk_size", [1, 10, 2**20])
+    def test_nexus(self, chunk_size):
+        f = io.StringIO(NEXUS_TREES)
+        result = list(pk.read_trees(f, chunk_size=chunk_size))
+        assert [pk.to_newick(ds) for ds in result] == [
+            "((a b:1,c:1):1,d;'e:2);",
+            "((a b:1,d;'e:1):1,c:2);",
+            "((c:1,d;'e:1):1,a b:2);",
+        ]
+
+    def test_nexus_batches(self):
+        f = io.StringIO(NEXUS_TREES)
+        (ds,) = list(pk.read_trees(f, batch_size=5, burnin=1))
+        assert_array_equal(ds.tree_id, [1, 2])
+        assert list(ds.sample_id.values) == ["a b", "d;'e", "c", "c", "d;'e", "a b"]
+
+    def test_nexus_no_translate(self):
+        s = "#nexus\nbegin trees;\ntree t1 = (a:1,b:1);\nend;"
+        (ds,) = list(pk.read_trees(io.StringIO(s)))
+        assert pk.to_newick(ds) == "(a:1,b:1);"
+
+    def test_format(self):
+        s = "#NEXUS\nbegin trees;\ntree t1 = (a:1,b:1);\nend;"
+        with pytest.raises(ValueError):
+            list(pk.read_trees(io.StringIO(s), file_format="newick"))
+        f = io.StringIO("(a:1,b:1);")
+        assert list(pk.read_trees(f, file_format="nexus")) == []
+        with pytest.raises(ValueError, match="Unknown"):
+            pk.read_trees(io.StringIO(s), file_format="xml")
+
+    def test_empty(self):
+        assert list(pk.read_trees(io.StringIO(""))) == []
+        assert list(pk.read_trees(io.StringIO(" ;\n;\n"))) == []
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [{"burnin": -1}, {"thin": 0}, {"batch_size": 0}, {"num_workers": -1}],
+    )
+    def test_bad_arguments(self, kwargs):
+        with pytest.raises(ValueError):
+            pk.read_trees(io.StringIO("(a,b);"), **kwargs)
+
 
 class TestToNewick:
     @pytest.mark.parametrize("n", [3, 10, 20])
@@ -113,6 +534,69 @@ class TestToNewick:
         pk_tree = pk.from_tskit(tsk_tree)
         assert tsk_tree.as_newick() == pk.to_newick(pk_tree)
 
+    def test_deep_comb(self):
+        tsk_tree = tskit.Tree.generate_comb(10000)
+        pk_tree = pk.from_tskit(tsk_tree)
+        assert tsk_tree.as_newick() == pk.to_newick(pk_tree)
+
+    def test_multiroot(self):
+        ts = tskit.Tree.generate_balanced(9, arity=2).tree_sequence
+        tsk_tree = ts.decapitate(1.5).first()
+        pk_tree = pk.from_tskit(tsk_tree)
+        expected = [
+            "((n0:1,n1:1):0.5);",
+            "((n2:1,n3:1):0.5);",
+            "(n6:1.5);",
+            "((n7:1,n8:1):0.5);",
+            "((n4:1,n5:1):0.5);",
+        ]
+        assert pk.to_newick(pk_tree) == "\n".join(expected)
+
+    def test_no_roots(self):
+        ds = pk.from_newick("(a:1,b:1);")
+        ds.node_left_child.data[-1] = -1
+        assert pk.to_newick(ds) == ""
+
+    def test_sample_id(self):
+        ds = pk.from_newick("(α:1,(b:1,'c d':1):1);")
+        assert pk.to_newick(ds) == "(α:1,(b:1,c d:1):1);"
+
+    @pytest.mark.parametrize("precision", [0, 1, 3, 6, 14, 17])
+    def test_precision(self, precision):
+        tsk_tree = msprime.sim_ancestry(10, ploidy=1, random_seed=1).first()
+        pk_tree = pk.from_tskit(tsk_tree)
+        s = pk.to_newick(pk_tree, precision=precision)
+        parent = pk_tree.node_parent.data
+        bl = pk_tree.node_branch_length.data
+        expected = sorted(
+            "%.*g" % (precision, bl[u]) for u in range(len(parent)) if parent[u] != -1
+        )
+        assert sorted(re.findall(r":([^,);]+)", s)) == expected
+
+    @pytest.mark.parametrize(
+        "x", [1e-30, 1e30, 123456789, 0.5, 2.5, 1e-5, 99999.95, 0.0001234]
+    )
+    def test_branch_length_formatting(self, x):
+        s = f"(a:{x!r},b:1);"
+        ds = pk.from_newick(s)
+        assert pk.to_newick(ds) == "(a:%g,b:1);" % x
+
+    @pytest.mark.parametrize("buffer_size", [1, 10, 2**20])
+    def test_text_file(self, buffer_size):
+        tsk_tree = msprime.sim_ancestry(50, ploidy=1, random_seed=1).first()
+        pk_tree = pk.from_tskit(tsk_tree)
+        f = io.StringIO()
+        assert pk.to_newick(pk_tree, file=f, buffer_size=buffer_size) is None
+        assert f.getvalue() == pk.to_newick(pk_tree)
+
+    @pytest.mark.parametrize("buffer_size", [1, 10, 2**20])
+    def test_binary_file(self, buffer_size):
+        tsk_tree = msprime.sim_ancestry(50, ploidy=1, random_seed=1).first()
+        pk_tree = pk.from_tskit(tsk_tree)
+        f = io.BytesIO()
+        pk.to_newick(pk_tree, file=f, buffer_size=buffer_size)
+        assert f.getvalue().decode() == pk.to_newick(pk_tree)
+
 
 @pytest.mark.parametrize(
     "s",
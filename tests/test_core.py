@@ -1,6 +1,10 @@
 import numpy as np
+import pytest
+import tskit
 import xarray
+from numpy.testing import assert_array_equal
 
+import phylokit as pk
 from phylokit import core
 
 
@@ -16,3 +20,68 @@ class TestCreateTreeDataset:
         assert isinstance(ds, xarray.Dataset)
         assert ds.sizes[core.DIM_NODE] == 2
         assert ds.sizes[core.DIM_SAMPLE] == 1
+
+
+class TestForestDataset:
+    def trees(self):
+        return [
+            pk.from_tskit(tskit.Tree.generate_balanced(3)),
+            pk.from_tskit(tskit.Tree.generate_comb(5)),
+            pk.from_tskit(tskit.TableCollection(1).tree_sequence().first()),
+            pk.from_tskit(tskit.Tree.generate_star(10)),
+        ]
+
+    def test_concat_trees(self):
+        ds = core.concat_trees(self.trees())
+        assert core.get_num_trees(ds) == 4
+        assert_array_equal(ds.tree_node_offset, [0, 6, 16, 17, 29])
+        assert_array_equal(ds.tree_sample_offset, [0, 3, 8, 8, 18])
+        assert_array_equal(ds.tree_traversal_offset, [0, 5, 14, 14, 25])
+
+    @pytest.mark.parametrize("index", [0, 1, 2, 3, -1])
+    def test_get_tree(self, index):
+        trees = self.trees()
+        ds = core.concat_trees(trees)
+        xarray.testing.assert_identical(core.get_tree(ds, index), trees[index])
+
+    @pytest.mark.parametrize("index", [4, -5])
+    def test_get_tree_out_of_range(self, index):
+        ds = core.concat_trees(self.trees())
+        with pytest.raises(IndexError):
+            core.get_tree(ds, index)
+
+    def test_create_computes_traversals(self):
+        forest = core.concat_trees(self.trees())
+        ds = core.create_forest_dataset(
+            parent=forest.node_parent.data,
+            left_child=forest.node_left_child.data,
+            right_sib=forest.node_right_sib.data,
+            samples=forest.sample_node.data,
+            node_offset=forest.tree_node_offset.data,
+            sample_offset=forest.tree_sample_offset.data,
+            time=forest.node_time.data,
+        )
+        xarray.testing.assert_equal(ds, forest)
+
+    def test_tree_id(self):
+        ds = core.concat_trees(self.trees(), tree_id=["a", "b", "c", "d"])
+        assert ds.sizes[core.DIM_TREE] == 4
+        assert "tree_id" not in core.get_tree(ds, 0)
+
+    def test_missing_traversal_offset(self):
+        forest = core.concat_trees(self.trees())
+        with pytest.raises(ValueError):
+            core.create_forest_dataset(
+                parent=forest.node_parent.data,
+                left_child=forest.node_left_child.data,
+                right_sib=forest.node_right_sib.data,
+                samples=forest.sample_node.data,
+                node_offset=forest.tree_node_offset.data,
+                sample_offset=forest.tree_sample_offset.data,
+                preorder=forest.traversal_preorder.data,
+                postorder=forest.traversal_postorder.data,
+            )
+
+    def test_no_trees(self):
+        with pytest.raises(ValueError):
+            core.concat_trees([])
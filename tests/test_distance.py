@@ -2,8 +2,11 @@
 import itertools
 
 import dendropy
+import msprime
+import numpy as np
 import pytest
 import tskit
+from numpy.testing import assert_array_equal
 
 import phylokit as pk
 
@@ -229,6 +232,80 @@ class TestAllRootsN5:
             pk.rf_distance(self.tree(), self.tree())
 
 
+class TestMrcaIndex:
+    def tsk_trees():
+        yield tskit.Tree.generate_balanced(10)
+        yield tskit.Tree.generate_balanced(10, arity=3)
+        yield tskit.Tree.generate_comb(50)
+        yield tskit.Tree.generate_star(7)
+        yield TestTreeMultiRoots().tsk_tree2()
+        yield TestAllRootsN5().tsk_tree()
+        yield TestEmpty().tsk_tree1()
+        yield msprime.sim_ancestry(40, ploidy=1, random_seed=1).first()
+        # Trees with unary nodes and nodes which are not in the tree.
+        ts = msprime.sim_ancestry(
+            8,
+            sequence_length=100,
+            recombination_rate=0.01,
+            record_full_arg=True,
+            random_seed=1,
+        )
+        yield ts.at_index(ts.num_trees // 2)
+        yield msprime.sim_ancestry(20, population_size=1e4, random_seed=1).decapitate(
+            1e4
+        ).first()
+
+    @pytest.mark.parametrize("tsk_tree", tsk_trees())
+    def test_all_pairs(self, tsk_tree):
+        ds = pk.from_tskit(tsk_tree)
+        indexed = pk.append_mrca_index(ds.copy())
+        virtual_root = ds.sizes["nodes"] - 1
+        for u, v in itertools.product(range(virtual_root + 1), repeat=2):
+            expected = pk.mrca(ds, u, v)
+            assert pk.mrca(indexed, u, v) == expected
+            if virtual_root not in (u, v):
+                assert expected == tsk_tree.mrca(u, v)
+
+    def test_kc_distance(self):
+        tree1 = pk.from_tskit(msprime.sim_ancestry(20, ploidy=1, random_seed=1).first())
+        tree2 = pk.from_tskit(msprime.sim_ancestry(20, ploidy=1, random_seed=2).first())
+        expected = pk.kc_distance(tree1, tree2, 0.5)
+        pk.append_mrca_index(tree1)
+        assert pk.kc_distance(tree1, tree2, 0.5) == expected
+        pk.append_mrca_index(tree2)
+        assert pk.kc_distance(tree1, tree2, 0.5) == expected
+
+
+class TestMrcaBatch:
+    @pytest.mark.parametrize("tsk_tree", TestMrcaIndex.tsk_trees())
+    @pytest.mark.parametrize("index", [False, True])
+    def test_all_pairs(self, tsk_tree, index):
+        ds = pk.from_tskit(tsk_tree)
+        if index:
+            pk.append_mrca_index(ds)
+        pairs = np.array(list(itertools.product(range(ds.sizes["nodes"]), repeat=2)))
+        result = pk.mrca_batch(ds, pairs[:, 0], pairs[:, 1])
+        assert_array_equal(result, [pk.mrca(ds, u, v) for u, v in pairs])
+
+    def test_shape(self):
+        ds = pk.from_tskit(tskit.Tree.generate_balanced(4))
+        us = np.array([[0, 1], [2, 3]])
+        vs = np.array([[1, 0], [3, 0]], dtype=np.int32)
+        assert_array_equal(pk.mrca_batch(ds, us, vs), [[4, 4], [5, 6]])
+        assert pk.mrca_batch(ds, [], []).shape == (0,)
+
+    @pytest.mark.parametrize("u", [-1, 8])
+    def test_out_of_range(self, u):
+        ds = pk.from_tskit(tskit.Tree.generate_balanced(4))
+        with pytest.raises(ValueError, match=f"Node {u} is not"):
+            pk.mrca_batch(ds, [0, 1], [2, u])
+
+    def test_shape_mismatch(self):
+        ds = pk.from_tskit(tskit.Tree.generate_balanced(4))
+        with pytest.raises(ValueError, match="same shape"):
+            pk.mrca_batch(ds, [0, 1], [2])
+
+
 class TestRFDistance:
     def setup_method(self):
         self.taxon_namespace = dendropy.TaxonNamespace()
@@ -274,3 +351,351 @@ class TestRFDistance:
         t1 = self.get_non_consecutive_leaf_tree()
         t2 = tskit.Tree.generate_balanced(4)
         assert pk.rf_distance(pk.from_tskit(t1), pk.from_tskit(t2)) == 10
+
+    def naive_rf_distance(self, tree1, tree2):
+        def splits(tree):
+            # The sets of leaves below each node, including the empty set if
+            # any node is not in the tree.
+            ret = {frozenset(tree.leaves(u)) for u in tree.nodes()}
+            if len(list(tree.nodes())) < tree.tree_sequence.num_nodes:
+                ret.add(frozenset())
+            return ret
+
+        return len(splits(tree1) ^ splits(tree2))
+
+    def single_root_trees():
+        yield tskit.Tree.generate_balanced(10)
+        yield tskit.Tree.generate_balanced(10, arity=3)
+        yield tskit.Tree.generate_comb(10)
+        yield tskit.Tree.generate_star(10)
+        yield msprime.sim_ancestry(10, ploidy=1, random_seed=1).first()
+        ts = msprime.sim_ancestry(
+            10,
+            ploidy=1,
+            sequence_length=100,
+            recombination_rate=0.01,
+            record_full_arg=True,
+            random_seed=1,
+        )
+        yield ts.at_index(ts.num_trees // 2)
+        yield ts.last()
+
+    @pytest.mark.parametrize(
+        ("tree1", "tree2"),
+        itertools.combinations_with_replacement(single_root_trees(), 2),
+    )
+    def test_naive(self, tree1, tree2):
+        expected = self.naive_rf_distance(tree1, tree2)
+        assert pk.rf_distance(pk.from_tskit(tree1), pk.from_tskit(tree2)) == expected
+        assert pk.rf_distance(pk.from_tskit(tree2), pk.from_tskit(tree1)) == expected
+
+    def test_large_tree(self):
+        ds1 = pk.from_tskit(msprime.sim_ancestry(1000, ploidy=1, random_seed=1).first())
+        ds2 = pk.from_tskit(msprime.sim_ancestry(1000, ploidy=1, random_seed=2).first())
+        assert pk.rf_distance(ds1, ds1) == 0
+        distance = pk.rf_distance(ds1, ds2)
+        assert distance == pk.rf_distance(ds2, ds1)
+        # The leaves and the root are shared, leaving 998 internal splits each.
+        assert 0 < distance <= 2 * 998
+
+
+class TestRFDistanceMatrix:
+    def trees(self):
+        trees = [
+            pk.from_tskit(msprime.sim_ancestry(10, ploidy=1, random_seed=j).first())
+            for j in range(1, 10)
+        ]
+        trees += [
+            pk.from_tskit(tsk_tree)
+            for tsk_tree in TestRFDistance.single_root_trees()
+            if tsk_tree.tree_sequence.num_samples == 10
+        ]
+        return trees
+
+    def expected(self, trees):
+        return np.array([[pk.rf_distance(t1, t2) for t2 in trees] for t1 in trees])
+
+    def test_list(self):
+        trees = self.trees()
+        assert_array_equal(pk.rf_distance_matrix(trees), self.expected(trees))
+
+    def test_iterator(self):
+        trees = self.trees()
+        assert_array_equal(pk.rf_distance_matrix(iter(trees)), self.expected(trees))
+
+    def test_forest(self):
+        trees = self.trees()
+        forest = pk.core.concat_trees(trees)
+        assert_array_equal(pk.rf_distance_matrix(forest), self.expected(trees))
+
+    def test_tree_sequence(self):
+        ts = msprime.sim_ancestry(
+            10, ploidy=1, sequence_length=100, recombination_rate=0.05, random_seed=1
+        )
+        assert ts.num_trees > 5
+        trees = [pk.from_tskit(tree) for tree in ts.trees()]
+        forest = pk.from_tskit_sequence(ts, forest=True)
+        assert_array_equal(pk.rf_distance_matrix(forest), self.expected(trees))
+
+    def test_single_tree(self):
+        ds = pk.from_tskit(tskit.Tree.generate_balanced(5))
+        assert_array_equal(pk.rf_distance_matrix(ds), [[0]])
+        assert_array_equal(pk.rf_distance_matrix([ds, ds]), np.zeros((2, 2)))
+
+    @pytest.mark.parametrize("chunks", [1, 4, 7, 100])
+    def test_chunks(self, chunks):
+        trees = self.trees()
+        result = pk.rf_distance_matrix(trees, chunks=chunks)
+        assert result.chunksize == (min(chunks, len(trees)),) * 2
+        assert_array_equal(result.compute(), self.expected(trees))
+
+    def test_bad_chunks(self):
+        with pytest.raises(ValueError, match="Chunk size"):
+            pk.rf_distance_matrix(self.trees(), chunks=0)
+
+    def test_multiple_roots(self):
+        trees = self.trees()
+        trees.append(pk.from_tskit(TestTreeMultiRoots().tsk_tree2()))
+        with pytest.raises(ValueError, match="single root"):
+            pk.rf_distance_matrix(trees)
+
+
+class TestKCVector:
+    def tsk_trees():
+        yield tskit.Tree.generate_balanced(6, sample_lists=True)
+        yield tskit.Tree.generate_balanced(6, arity=3, sample_lists=True)
+        yield tskit.Tree.generate_comb(6, sample_lists=True)
+        yield tskit.Tree.generate_star(6, sample_lists=True)
+        for seed in range(1, 5):
+            ts = msprime.sim_ancestry(6, ploidy=1, random_seed=seed)
+            yield ts.first(sample_lists=True)
+
+    @pytest.mark.parametrize(("tree1", "tree2"), itertools.combinations(tsk_trees(), 2))
+    @pytest.mark.parametrize("lambda_", [0, 0.25, 1])
+    def test_kc_distance(self, tree1, tree2, lambda_):
+        ds1 = pk.from_tskit(tree1)
+        ds2 = pk.from_tskit(tree2)
+        expected = tree1.kc_distance(tree2, lambda_)
+        assert pk.kc_distance(ds1, ds2, lambda_) == pytest.approx(expected)
+        v1 = pk.kc_vector(ds1, lambda_)
+        v2 = pk.kc_vector(ds2, lambda_)
+        assert np.linalg.norm(v1 - v2) == pytest.approx(expected)
+
+    def test_balanced(self):
+        ds = pk.from_tskit(tskit.Tree.generate_balanced(4))
+        # Pairs (0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3), then the samples.
+        assert_array_equal(pk.kc_vector(ds), [1, 0, 0, 0, 0, 1, 1, 1, 1, 1])
+        assert_array_equal(pk.kc_vector(ds, 0.5), [1, 0, 0, 0, 0, 1, 1, 1, 1, 1])
+        ds = pk.from_tskit(tskit.Tree.generate_comb(4))
+        assert_array_equal(pk.kc_vector(ds), [0, 0, 0, 1, 1, 2, 1, 1, 1, 1])
+        assert_array_equal(pk.kc_vector(ds, 1), [0, 0, 0, 1, 1, 2, 3, 2, 1, 1])
+
+    def test_large_tree(self):
+        tree = msprime.sim_ancestry(200, ploidy=1, random_seed=1).first()
+        ds = pk.from_tskit(tree)
+        m = pk.kc_vector(ds, 0)
+        M = pk.kc_vector(ds, 1)
+        assert m.shape == (200 * 199 // 2 + 200,)
+        k = 0
+        for u in range(200):
+            for v in range(u + 1, 200):
+                mrca = tree.mrca(u, v)
+                assert m[k] == tree.depth(mrca)
+                assert M[k] == pytest.approx(tree.time(tree.root) - tree.time(mrca))
+                k += 1
+        assert_array_equal(M[k:], [tree.branch_length(u) for u in range(200)])
+
+    def test_multiple_roots(self):
+        with pytest.raises(ValueError, match="single root"):
+            pk.kc_vector(pk.from_tskit(TestTreeMultiRoots().tsk_tree2()))
+
+    def test_unary(self):
+        ts = msprime.sim_ancestry(
+            5,
+            sequence_length=100,
+            recombination_rate=0.01,
+            record_full_arg=True,
+            random_seed=1,
+        )
+        ds = pk.from_tskit(ts.first())
+        assert pk.is_unary(ds)
+        with pytest.raises(ValueError, match="Unary"):
+            pk.kc_vector(ds)
+
+
+class TestKCDistanceMatrix:
+    def trees(self):
+        return [
+            pk.from_tskit(msprime.sim_ancestry(8, ploidy=1, random_seed=j).first())
+            for j in range(1, 12)
+        ]
+
+    def expected(self, trees, lambda_):
+        return np.array(
+            [[pk.kc_distance(t1, t2, lambda_) for t2 in trees] for t1 in trees]
+        )
+
+    @pytest.mark.parametrize("lambda_", [0, 0.5, 1])
+    @pytest.mark.parametrize("block_size", [1, 4, 100])
+    def test_list(self, lambda_, block_size):
+        trees = self.trees()
+        result = pk.kc_distance_matrix(trees, lambda_, block_size=block_size)
+        np.testing.assert_allclose(result, self.expected(trees, lambda_), atol=1e-6)
+        assert_array_equal(result, result.T)
+        assert_array_equal(np.diag(result), 0)
+
+    @pytest.mark.parametrize("delta", [1e-6, 1e-3])
+    @pytest.mark.parametrize("lambda_", [0.5, 1])
+    def test_near_identical(self, delta, lambda_):
+        # Trees differing in one branch length are close enough for the
+        # Gram matrix form of the distance to cancel catastrophically.
+        tree1 = pk.from_tskit(
+            msprime.sim_ancestry(200, ploidy=1, random_seed=1).first()
+        )
+        tree2 = tree1.copy(deep=True)
+        tree2.node_branch_length[tree2.sample_node.data[0]] += delta
+        expected = pk.kc_distance(tree1, tree2, lambda_)
+        assert expected == pytest.approx(lambda_ * delta)
+        result = pk.kc_distance_matrix([tree1, tree2], lambda_)
+        assert result[0, 1] == pytest.approx(expected, rel=1e-9)
+        assert result[1, 0] == result[0, 1]
+
+    def test_forest(self):
+        trees = self.trees()
+        forest = pk.core.concat_trees(trees)
+        np.testing.assert_allclose(
+            pk.kc_distance_matrix(forest, 0.5), self.expected(trees, 0.5), atol=1e-6
+        )
+
+    @pytest.mark.parametrize("batch_size", [1, 3, 100])
+    def test_vectors(self, batch_size):
+        trees = self.trees()
+        vectors = pk.kc_vectors(iter(trees), batch_size=batch_size)
+        assert vectors.sizes == {"trees": 11, "kc_entries": 8 * 7 // 2 + 8}
+        for j, tree in enumerate(trees):
+            assert_array_equal(vectors.tree_kc_topology[j], pk.kc_vector(tree, 0))
+            assert_array_equal(vectors.tree_kc_branch_length[j], pk.kc_vector(tree, 1))
+        for lambda_ in [0, 0.25, 1]:
+            np.testing.assert_allclose(
+                pk.kc_distance_matrix(vectors, lambda_),
+                self.expected(trees, lambda_),
+                atol=1e-6,
+            )
+
+    def test_store(self, tmp_path):
+        trees = self.trees()
+        forest = pk.core.concat_trees(trees)
+        vectors = pk.kc_vectors(forest, store=tmp_path / "kc.zarr", batch_size=4)
+        expected = pk.kc_vectors(trees)
+        assert vectors.tree_kc_topology.chunks[0] == (4, 4, 3)
+        assert_array_equal(vectors.tree_kc_topology, expected.tree_kc_topology)
+        assert_array_equal(
+            vectors.tree_kc_branch_length, expected.tree_kc_branch_length
+        )
+        np.testing.assert_allclose(
+            pk.kc_distance_matrix(vectors, 0.5, block_size=5),
+            self.expected(trees, 0.5),
+            atol=1e-6,
+        )
+
+    @pytest.mark.parametrize("batch_size", [1, 100])
+    def test_different_samples(self, batch_size):
+        trees = self.trees()
+        trees.append(pk.from_tskit(tskit.Tree.generate_comb(7)))
+        with pytest.raises(ValueError, match="same samples"):
+            pk.kc_vectors(trees, batch_size=batch_size)
+
+    def test_multiple_roots(self):
+        trees = [pk.from_tskit(TestTreeMultiRoots().tsk_tree2())]
+        with pytest.raises(ValueError, match="single root"):
+            pk.kc_distance_matrix(trees)
+
+    def test_bad_sizes(self):
+        with pytest.raises(ValueError, match="Block size"):
+            pk.kc_distance_matrix(self.trees(), block_size=0)
+        with pytest.raises(ValueError, match="Batch size"):
+            pk.kc_vectors(self.trees(), batch_size=0)
+
+
+class TestPatristicDistances:
+    def tsk_trees():
+        yield tskit.Tree.generate_balanced(7, arity=3)
+        yield tskit.Tree.generate_comb(6)
+        yield msprime.sim_ancestry(20, ploidy=1, random_seed=1).first()
+        ts = msprime.sim_ancestry(
+            8,
+            sequence_length=100,
+            recombination_rate=0.01,
+            record_full_arg=True,
+            random_seed=1,
+        )
+        yield ts.at_index(ts.num_trees // 2)
+        yield TestTreeMultiRoots().tsk_tree2()
+
+    def naive_patristic_distances(self, tsk_tree):
+        samples = tsk_tree.tree_sequence.samples()
+        ret = np.zeros((len(samples), len(samples)))
+        for i, u in enumerate(samples):
+            for j, v in enumerate(samples):
+                mrca = tsk_tree.mrca(u, v)
+                if mrca == tskit.NULL:
+                    ret[i, j] = np.inf
+                    continue
+                for w in [u, v]:
+                    while w != mrca:
+                        ret[i, j] += tsk_tree.branch_length(w)
+                        w = tsk_tree.parent(w)
+        return ret
+
+    @pytest.mark.parametrize("tsk_tree", tsk_trees())
+    def test_tskit(self, tsk_tree):
+        ds = pk.from_tskit(tsk_tree)
+        expected = self.naive_patristic_distances(tsk_tree)
+        # Samples in different trees are an infinite distance apart.
+        assert np.isinf(expected).any() == (tsk_tree.num_roots > 1)
+        np.testing.assert_allclose(pk.patristic_distances(ds), expected)
+        condensed = expected[np.triu_indices(expected.shape[0], 1)]
+        np.testing.assert_allclose(
+            pk.patristic_distances(ds, condensed=True), condensed
+        )
+
+    def test_branch_lengths(self):
+        # The distances use the branch lengths, not the node times.
+        ds = pk.from_newick("((0:1,1:2):3,(2:0.5,3:0.25):1);")
+        np.testing.assert_allclose(
+            pk.patristic_distances(ds),
+            [
+                [0, 3, 5.5, 5.25],
+                [3, 0, 6.5, 6.25],
+                [5.5, 6.5, 0, 0.75],
+                [5.25, 6.25, 0.75, 0],
+            ],
+        )
+
+    @pytest.mark.parametrize("chunks", [1, 7, 100])
+    def test_chunks(self, chunks):
+        ds = pk.from_tskit(msprime.sim_ancestry(20, ploidy=1, random_seed=1).first())
+        result = pk.patristic_distances(ds, chunks=chunks)
+        assert result.chunks[0][0] == min(chunks, 20)
+        assert result.chunks[1] == (20,)
+        np.testing.assert_array_equal(result.compute(), pk.patristic_distances(ds))
+
+    def test_many_rows(self):
+        # More rows than are processed by a single parallel task.
+        tsk_tree = msprime.sim_ancestry(150, ploidy=1, random_seed=1).first()
+        ds = pk.from_tskit(tsk_tree)
+        result = pk.patristic_distances(ds)
+        for u, v in [(0, 1), (0, 149), (64, 65), (128, 3)]:
+            expected = 2 * tsk_tree.time(tsk_tree.mrca(u, v))
+            assert result[u, v] == pytest.approx(expected)
+        np.testing.assert_allclose(
+            pk.patristic_distances(ds, condensed=True),
+            result[np.triu_indices(150, 1)],
+        )
+
+    def test_bad_arguments(self):
+        ds = pk.from_tskit(tskit.Tree.generate_balanced(4))
+        with pytest.raises(ValueError, match="Condensed"):
+            pk.patristic_distances(ds, condensed=True, chunks=2)
+        with pytest.raises(ValueError, match="Chunk size"):
+            pk.patristic_distances(ds, chunks=0)
@@ -2,6 +2,7 @@ import msprime
 import numpy as np
 import pytest
 import sgkit
+import tskit
 
 import phylokit as pk
 from phylokit.maximum_likelihood import felsenstein
@@ -58,6 +59,17 @@ class TestFelsensteinML:
         ds = ds_in.merge(pk_mts)
         return ds
 
+    def internal_sample_tree(self):
+        # A tree in which the grandparent of node 0 is also a sample.
+        tsa = msprime.sim_ancestry(10, ploidy=1, sequence_length=100, random_seed=5)
+        tables = tsa.dump_tables()
+        u = tsa.first().parent(tsa.first().parent(0))
+        flags = tables.nodes.flags
+        flags[u] = tskit.NODE_IS_SAMPLE
+        tables.nodes.flags = flags
+        ts = msprime.sim_mutations(tables.tree_sequence(), 0.03, random_seed=5)
+        return self.create_mutation_tree(ts)
+
     def test_same_base_transition_probability(self):
         assert felsenstein._transition_probability(
             0, 0, 1, 1, np.full((4, 4), 0.25, dtype=np.float64)
@@ -162,6 +174,383 @@ class TestFelsensteinML:
             pk_tree, mutation_rate
         ) == pytest.approx(felsenstein.likelihood_felsenstein(pk_tree, mutation_rate))
 
+    @pytest.mark.parametrize("mutation_rate", [0.01, 0.03])
+    def test_felsenstein_site_patterns(self, mutation_rate):
+        msprime_tree = self.simulate_ts(10, 100, mutation_rate, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        num_variants = pk_tree.sizes["variants"]
+        pk_tree = pk_tree.isel(variants=[j % num_variants for j in range(8)])
+        expected = felsenstein.likelihood_felsenstein(pk_tree, mutation_rate)
+        pk_tree = pk.append_site_patterns(pk_tree)
+        assert pk_tree.sizes["site_patterns"] == min(num_variants, 8)
+        assert felsenstein.likelihood_felsenstein(
+            pk_tree, mutation_rate
+        ) == pytest.approx(expected)
+
+    def test_transition_matrices(self):
+        msprime_tree = self.simulate_ts(10, 100, 0.01, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        pi = np.full((4, 4), 0.25, dtype=np.float64)
+        P = pk.transition_matrices(pk_tree, 0.01)
+        assert P.shape == (pk_tree.sizes["nodes"], 4, 4)
+        for u, t in enumerate(pk_tree.node_branch_length.data):
+            for i in range(4):
+                for j in range(4):
+                    assert P[u, i, j] == pytest.approx(
+                        felsenstein._transition_probability(i, j, t, 0.01, pi)
+                    )
+        assert np.allclose(np.sum(P, axis=2), 1)
+
+    def test_felsenstein_transition_matrices(self):
+        msprime_tree = self.simulate_ts(10, 100, 0.01, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        P = pk.transition_matrices(pk_tree, 0.01)
+        assert felsenstein.likelihood_felsenstein(
+            pk_tree, 0.01, transition_matrices=P
+        ) == pytest.approx(felsenstein.likelihood_felsenstein(pk_tree, 0.01))
+
+    def test_update_transition_matrix(self):
+        msprime_tree = self.simulate_ts(10, 100, 0.01, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        P = pk.transition_matrices(pk_tree, 0.01)
+        u = pk_tree.sample_node.data[0]
+        branch_length = pk_tree.node_branch_length.data.copy()
+        branch_length[u] *= 2
+        pk.update_transition_matrix(P, u, branch_length[u], 0.01)
+        pk_tree["node_branch_length"] = ("nodes", branch_length)
+        assert np.allclose(P, pk.transition_matrices(pk_tree, 0.01))
+        assert felsenstein.likelihood_felsenstein(
+            pk_tree, 0.01, transition_matrices=P
+        ) == pytest.approx(felsenstein.likelihood_felsenstein(pk_tree, 0.01))
+        with pytest.raises(ValueError):
+            pk.update_transition_matrix(P, P.shape[0], 1.0, 0.01)
+
+    @pytest.mark.parametrize("mutation_rate", [0.01, 0.02, 0.03])
+    def test_log_likelihood_felsenstein(self, mutation_rate):
+        msprime_tree = self.simulate_ts(100, 100, mutation_rate, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        GENOTYPE_ARRAY = np.array([b"A", b"C", b"G", b"T"], dtype="S")
+        expected = felsenstein._naive_likelihood_felsenstein(
+            pk_tree.node_left_child.data,
+            pk_tree.node_right_sib.data,
+            pk_tree.call_genotype.data,
+            pk_tree.nodes.shape[0],
+            pk_tree.traversal_postorder.data,
+            pk_tree.sample_node.data,
+            pk.util.base_mapping(pk_tree.variant_allele.data, GENOTYPE_ARRAY),
+            pk_tree.node_branch_length.data,
+            mutation_rate,
+            np.full((4, 4), 0.25, dtype=np.float64),
+        )
+        total, per_site = pk.log_likelihood_felsenstein(
+            pk_tree, mutation_rate, per_site=True
+        )
+        assert np.allclose(per_site, np.log(expected))
+        assert total == pytest.approx(np.sum(np.log(expected)))
+        assert pk.log_likelihood_felsenstein(pk_tree, mutation_rate) == total
+
+    def test_log_likelihood_felsenstein_no_underflow(self):
+        msprime_tree = self.simulate_ts(100, 100, 0.01, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        num_variants = pk_tree.sizes["variants"]
+        expected = pk.log_likelihood_felsenstein(pk_tree, 0.01)
+        pk_tree = pk_tree.isel(variants=np.tile(np.arange(num_variants), 1000))
+        assert felsenstein.likelihood_felsenstein(pk_tree, 0.01) == 0
+        assert pk.log_likelihood_felsenstein(pk_tree, 0.01) == pytest.approx(
+            1000 * expected
+        )
+
+    def test_log_likelihood_felsenstein_site_patterns(self):
+        msprime_tree = self.simulate_ts(10, 100, 0.03, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        num_variants = pk_tree.sizes["variants"]
+        pk_tree = pk_tree.isel(variants=[j % num_variants for j in range(8)])
+        total, per_site = pk.log_likelihood_felsenstein(pk_tree, 0.03, per_site=True)
+        pk_tree = pk.append_site_patterns(pk_tree)
+        pattern_total, pattern_per_site = pk.log_likelihood_felsenstein(
+            pk_tree, 0.03, per_site=True
+        )
+        assert pattern_total == pytest.approx(total)
+        assert np.allclose(pattern_per_site, per_site)
+
+    def test_model_jc69_matches_default(self):
+        msprime_tree = self.simulate_ts(20, 100, 0.01, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        expected = pk.log_likelihood_felsenstein(pk_tree, 0.01)
+        assert pk.log_likelihood_felsenstein(
+            pk_tree, 0.0075, model=pk.jc69_model()
+        ) == pytest.approx(expected)
+
+    @pytest.mark.parametrize(
+        "model",
+        [
+            pk.jc69_model(),
+            pk.hky_model(4.0, [0.1, 0.2, 0.3, 0.4]),
+            pk.gtr_model([0.5, 2.0, 1.0, 0.8, 3.0, 1.2], [0.3, 0.2, 0.25, 0.25]),
+        ],
+    )
+    def test_model_transition_matrices(self, model):
+        msprime_tree = self.simulate_ts(20, 100, 0.01, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        P = pk.transition_matrices(pk_tree, 0.01, model=model)
+        assert np.allclose(
+            P, model.transition_matrices(0.01 * pk_tree.node_branch_length.data)
+        )
+        u = pk_tree.sample_node.data[0]
+        pk.update_transition_matrix(P, u, 2.0, 0.01, model=model)
+        assert np.allclose(P[u], model.transition_matrices([0.02])[0])
+
+    def test_model_root_frequencies(self):
+        # With one sample under a root joined by a zero-length branch the
+        # likelihood of a site is the root frequency of its state.
+        msprime_tree = self.simulate_ts(20, 100, 0.01, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        model = pk.hky_model(2.0, [0.1, 0.2, 0.3, 0.4])
+        P = np.broadcast_to(np.eye(4), (pk_tree.sizes["nodes"], 4, 4)).copy()
+        per_site = pk.log_likelihood_felsenstein(
+            pk_tree, 0.01, transition_matrices=P, model=model, per_site=True
+        )[1]
+        alleles = pk_tree.variant_allele.data
+        genotypes = pk_tree.call_genotype.data[:, :, 0]
+        for i, value in enumerate(per_site):
+            states = set(alleles[i, genotypes[i]])
+            if len(states) == 1:
+                j = [b"A", b"C", b"G", b"T"].index(states.pop())
+                assert value == pytest.approx(np.log(model.frequencies[j]))
+            else:
+                assert value == -np.inf
+
+    def test_model_and_pi(self):
+        msprime_tree = self.simulate_ts(20, 100, 0.01, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        with pytest.raises(ValueError):
+            pk.likelihood_felsenstein(
+                pk_tree,
+                0.01,
+                np.full((4, 4), 0.25, dtype=np.float64),
+                model=pk.jc69_model(),
+            )
+
+    @pytest.mark.parametrize(
+        "rate_categories",
+        [
+            pk.gamma_rate_categories(0.5),
+            pk.gamma_rate_categories(2, 6),
+            pk.gamma_rate_categories(proportion_invariant=0.4),
+            pk.gamma_rate_categories(0.3, 4, 0.2),
+        ],
+    )
+    @pytest.mark.parametrize("model", [None, pk.hky_model(3.0, [0.1, 0.2, 0.3, 0.4])])
+    def test_rate_categories(self, rate_categories, model):
+        msprime_tree = self.simulate_ts(20, 100, 0.03, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        # The likelihood of each site is the weighted mean of its likelihoods
+        # with the rate scaled by each category rate.
+        per_category = [
+            pk.log_likelihood_felsenstein(
+                pk_tree, 0.03 * r, model=model, per_site=True
+            )[1]
+            for r in rate_categories[0]
+        ]
+        log_weights = np.log(rate_categories[1])[:, np.newaxis]
+        expected = np.logaddexp.reduce(log_weights + np.array(per_category), axis=0)
+        total, per_site = pk.log_likelihood_felsenstein(
+            pk_tree,
+            0.03,
+            model=model,
+            rate_categories=rate_categories,
+            per_site=True,
+        )
+        assert np.allclose(per_site, expected)
+        assert total == pytest.approx(np.sum(expected))
+
+    def test_rate_categories_single(self):
+        msprime_tree = self.simulate_ts(20, 100, 0.03, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        assert pk.log_likelihood_felsenstein(
+            pk_tree, 0.03, rate_categories=pk.gamma_rate_categories()
+        ) == pytest.approx(pk.log_likelihood_felsenstein(pk_tree, 0.03))
+
+    @pytest.mark.parametrize("model", [None, pk.jc69_model()])
+    def test_rate_categories_transition_matrices(self, model):
+        msprime_tree = self.simulate_ts(20, 100, 0.03, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        rate_categories = pk.gamma_rate_categories(0.5, 4, 0.1)
+        P = pk.transition_matrices(
+            pk_tree, 0.03, model=model, rate_categories=rate_categories
+        )
+        assert P.shape == (pk_tree.sizes["nodes"], 5, 4, 4)
+        for k, r in enumerate(rate_categories[0]):
+            assert np.allclose(
+                P[:, k], pk.transition_matrices(pk_tree, 0.03 * r, model=model)
+            )
+        expected = pk.log_likelihood_felsenstein(
+            pk_tree, 0.03, model=model, rate_categories=rate_categories
+        )
+        assert pk.log_likelihood_felsenstein(
+            pk_tree,
+            0.03,
+            transition_matrices=P,
+            model=model,
+            rate_categories=rate_categories,
+        ) == pytest.approx(expected)
+
+        u = pk_tree.sample_node.data[0]
+        pk.update_transition_matrix(
+            P, u, 2.0, 0.03, model=model, rate_categories=rate_categories
+        )
+        for k, r in enumerate(rate_categories[0]):
+            P_single = pk.transition_matrices(pk_tree, 0.03 * r, model=model)
+            pk.update_transition_matrix(P_single, u, 2.0, 0.03 * r, model=model)
+            assert np.allclose(P[:, k], P_single)
+
+        with pytest.raises(ValueError):
+            pk.log_likelihood_felsenstein(
+                pk_tree, 0.03, transition_matrices=P, model=model
+            )
+        with pytest.raises(ValueError):
+            pk.update_transition_matrix(P, u, 2.0, 0.03, model=model)
+
+    def retree(self, state, ds):
+        # The tree of the state with the genotypes of ds.
+        tree = state.to_dataset()
+        return tree.merge(ds.drop_vars([v for v in tree.data_vars if v in ds]))
+
+    @pytest.mark.parametrize(
+        ["model", "rate_categories"],
+        [
+            (None, None),
+            (pk.hky_model(2.0, [0.1, 0.2, 0.3, 0.4]), None),
+            (None, pk.gamma_rate_categories(0.5, 4, 0.1)),
+        ],
+    )
+    def test_likelihood_state(self, model, rate_categories):
+        msprime_tree = self.simulate_ts(30, 100, 0.03, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        kwargs = {"model": model, "rate_categories": rate_categories}
+        state = pk.LikelihoodState(pk_tree, 0.03, **kwargs)
+        total, per_site = state.log_likelihood(per_site=True)
+        expected_total, expected = pk.log_likelihood_felsenstein(
+            pk_tree, 0.03, per_site=True, **kwargs
+        )
+        assert total == pytest.approx(expected_total)
+        assert np.allclose(per_site, expected)
+
+        u = pk_tree.sample_node.data[3]
+        state.set_branch_length(u, 0.5)
+        depth = 0
+        v = pk_tree.node_parent.data[u]
+        while v != -1:
+            depth += 1
+            v = pk_tree.node_parent.data[v]
+        assert state.num_dirty_nodes == depth
+        branch_length = pk_tree.node_branch_length.data.copy()
+        branch_length[u] = 0.5
+        pk_tree["node_branch_length"] = ("nodes", branch_length)
+        assert state.log_likelihood() == pytest.approx(
+            pk.log_likelihood_felsenstein(pk_tree, 0.03, **kwargs)
+        )
+        assert state.num_dirty_nodes == 0
+
+    @pytest.mark.parametrize("seed", [1, 2, 3])
+    def test_likelihood_state_spr(self, seed):
+        msprime_tree = self.simulate_ts(20, 100, 0.03, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        pk_tree = pk.append_site_patterns(pk_tree)
+        rate_categories = pk.gamma_rate_categories(1.0)
+        state = pk.LikelihoodState(pk_tree, 0.03, rate_categories=rate_categories)
+        rng = np.random.default_rng(seed)
+        num_nodes = pk_tree.sizes["nodes"] - 1
+        num_moves = 0
+        while num_moves < 20:
+            u, v = rng.integers(num_nodes, size=2)
+            p = state.parent[u]
+            w = v
+            while w != -1 and w != u:
+                w = state.parent[w]
+            if p == -1 or w == u or v == p:
+                with pytest.raises(ValueError):
+                    state.spr(u, v)
+                continue
+            state.spr(u, v)
+            if rng.random() < 0.5:
+                state.set_branch_length(v, rng.random())
+            num_moves += 1
+            tree = self.retree(state, pk_tree)
+            assert pk.get_num_roots(tree) == 1
+            assert len(tree.traversal_postorder) == num_nodes
+            total, per_site = state.log_likelihood(per_site=True)
+            expected_total, expected = pk.log_likelihood_felsenstein(
+                tree, 0.03, rate_categories=rate_categories, per_site=True
+            )
+            assert total == pytest.approx(expected_total)
+            assert np.allclose(per_site, expected)
+
+    def test_likelihood_state_spr_root(self):
+        msprime_tree = self.simulate_ts(10, 100, 0.03, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        state = pk.LikelihoodState(pk_tree, 0.03)
+        root = state.root
+        # Regrafting onto the root makes the parent of u the new root, and
+        # pruning a child of the root makes its sibling the new root.
+        sample = pk_tree.sample_node.data[0]
+        state.spr(sample, root)
+        assert state.root == state.parent[sample]
+        tree = self.retree(state, pk_tree)
+        assert state.log_likelihood() == pytest.approx(
+            pk.log_likelihood_felsenstein(tree, 0.03)
+        )
+        state.spr(sample, state.left_child[root])
+        assert state.root == root
+        tree = self.retree(state, pk_tree)
+        assert state.log_likelihood() == pytest.approx(
+            pk.log_likelihood_felsenstein(tree, 0.03)
+        )
+
+    def test_likelihood_state_internal_sample(self):
+        pk_tree = self.internal_sample_tree()
+        state = pk.LikelihoodState(pk_tree, 0.03)
+        expected = pk.log_likelihood_felsenstein(pk_tree, 0.03)
+        assert state.log_likelihood() == pytest.approx(expected)
+        # Node 0 is below the internal sample, so changing its branch or
+        # moving its sibling does not change the likelihood.
+        parent = pk_tree.node_parent.data
+        state.set_branch_length(0, 3.0)
+        assert state.num_dirty_nodes == 1
+        assert state.log_likelihood() == pytest.approx(expected)
+        sibling = state.left_child[parent[0]]
+        if sibling == 0:
+            sibling = state.right_sib[0]
+        state.spr(sibling, parent[parent[0]])
+        assert state.log_likelihood() == pytest.approx(
+            pk.log_likelihood_felsenstein(self.retree(state, pk_tree), 0.03)
+        )
+        # Moving the subtree out from under the sample does change it.
+        state.spr(0, state.root)
+        tree = self.retree(state, pk_tree)
+        assert state.log_likelihood() == pytest.approx(
+            pk.log_likelihood_felsenstein(tree, 0.03)
+        )
+        assert state.log_likelihood() != pytest.approx(expected)
+
+    def test_likelihood_state_errors(self):
+        msprime_tree = self.simulate_ts(10, 100, 0.03, seed=1234)
+        pk_tree = self.create_mutation_tree(msprime_tree)
+        state = pk.LikelihoodState(pk_tree, 0.03)
+        num_nodes = pk_tree.sizes["nodes"] - 1
+        with pytest.raises(ValueError):
+            state.set_branch_length(num_nodes, 1.0)
+        with pytest.raises(ValueError):
+            state.spr(state.root, 0)
+        with pytest.raises(ValueError):
+            state.spr(0, -1)
+
+    def test_log_likelihood_internal_sample(self):
+        pk_tree = self.internal_sample_tree()
+        assert pk.log_likelihood_felsenstein(pk_tree, 0.03) == pytest.approx(
+            np.log(felsenstein.naive_likelihood_felsenstein(pk_tree, 0.03))
+        )
+
     def test_felsenstein_error(self):
         msprime_tree = self.simulate_ts(100, 100, 0.01, seed=1234)
         pk_tree = self.create_mutation_tree(msprime_tree)
@@ -172,3 +561,9 @@ class TestFelsensteinML:
                 0.01,
                 np.full((4, 3), 0.25, dtype=np.float64),
             )
+        with pytest.raises(ValueError):
+            felsenstein.likelihood_felsenstein(
+                pk_tree,
+                0.01,
+                transition_matrices=np.zeros((3, 4, 4), dtype=np.float64),
+            )
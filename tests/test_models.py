@@ -0,0 +1,91 @@
+# Tests for the nucleotide substitution models
+import numpy as np
+import pytest
+import scipy.linalg
+
+import phylokit as pk
+
+MODELS = [
+    pk.jc69_model(),
+    pk.hky_model(4.0, [0.1, 0.2, 0.3, 0.4]),
+    pk.gtr_model([0.5, 2.0, 1.0, 0.8, 3.0, 1.2], [0.3, 0.2, 0.25, 0.25]),
+]
+
+
+class TestSubstitutionModel:
+    @pytest.mark.parametrize("model", MODELS)
+    def test_rate_matrix(self, model):
+        Q = model.rate_matrix
+        assert np.allclose(np.sum(Q, axis=1), 0)
+        assert -np.sum(model.frequencies * np.diag(Q)) == pytest.approx(1)
+        assert np.allclose(model.frequencies @ Q, 0)
+
+    @pytest.mark.parametrize("model", MODELS)
+    def test_transition_matrices(self, model):
+        branch_length = np.array([0, 0.01, 0.5, 2, 100])
+        P = model.transition_matrices(branch_length)
+        assert P.shape == (5, 4, 4)
+        for t, Pt in zip(branch_length, P):
+            assert np.allclose(Pt, scipy.linalg.expm(model.rate_matrix * t))
+        assert np.allclose(P[0], np.eye(4))
+        assert np.allclose(np.sum(P, axis=2), 1)
+        assert np.allclose(P[-1], model.frequencies)
+        # Detailed balance
+        F = np.diag(model.frequencies)
+        for Pt in P:
+            assert np.allclose(F @ Pt, (F @ Pt).T)
+
+    def test_jc69(self):
+        # The normalised JC69 model at time t is the Jukes-Cantor formula
+        # of _transition_probability with rate 4 / 3.
+        P = pk.jc69_model().transition_matrices(np.array([0.3]))[0]
+        assert P[0, 0] == pytest.approx(0.25 + 0.75 * np.exp(-0.4))
+        assert P[0, 1] == pytest.approx(0.25 - 0.25 * np.exp(-0.4))
+
+    def test_hky_kappa_one(self):
+        P1 = pk.hky_model(1, np.full(4, 0.25)).transition_matrices([0.2, 1.5])
+        P2 = pk.jc69_model().transition_matrices([0.2, 1.5])
+        assert np.allclose(P1, P2)
+
+    @pytest.mark.parametrize(
+        ["rates", "frequencies"],
+        [
+            (np.ones(5), np.full(4, 0.25)),
+            ([1, 1, 1, 1, 1, -1], np.full(4, 0.25)),
+            (np.ones(6), np.full(3, 1 / 3)),
+            (np.ones(6), [0.5, 0.5, 0.5, 0.5]),
+            (np.ones(6), [0, 0.5, 0.25, 0.25]),
+        ],
+    )
+    def test_bad_parameters(self, rates, frequencies):
+        with pytest.raises(ValueError):
+            pk.SubstitutionModel(rates, frequencies)
+
+
+class TestGammaRateCategories:
+    def test_yang_1994(self):
+        rates, weights = pk.gamma_rate_categories(0.5)
+        assert np.allclose(rates, [0.0334, 0.2519, 0.8203, 2.8944], atol=1e-4)
+        assert np.allclose(weights, 0.25)
+
+    @pytest.mark.parametrize("alpha", [None, 0.1, 1, 10])
+    @pytest.mark.parametrize("num_categories", [1, 4, 8])
+    @pytest.mark.parametrize("proportion_invariant", [0, 0.3])
+    def test_mean_rate(self, alpha, num_categories, proportion_invariant):
+        rates, weights = pk.gamma_rate_categories(
+            alpha, num_categories, proportion_invariant
+        )
+        assert np.sum(weights) == pytest.approx(1)
+        assert np.sum(rates * weights) == pytest.approx(1)
+        assert np.all(np.diff(rates) > 0)
+        if proportion_invariant > 0:
+            assert rates[0] == 0
+            assert weights[0] == proportion_invariant
+
+    @pytest.mark.parametrize(
+        ["alpha", "num_categories", "proportion_invariant"],
+        [(0, 4, 0), (-1, 4, 0), (1, 0, 0), (1, 4, -0.1), (1, 4, 1)],
+    )
+    def test_bad_parameters(self, alpha, num_categories, proportion_invariant):
+        with pytest.raises(ValueError):
+            pk.gamma_rate_categories(alpha, num_categories, proportion_invariant)
@@ -1,6 +1,7 @@
 import msprime
 import numpy as np
 import pytest
+import tskit
 import xarray.testing as xt
 
 import phylokit as pk
@@ -55,3 +56,183 @@ class Test_Hartigan_Parsimony_Vectorised:
             pk.append_parsimony_score(ds).compute().squeeze("ploidy"),
             _ds.squeeze("ploidy"),
         )
+
+
+class TestHartiganParsimonyScore:
+    def check(self, tree, genotypes, alleles):
+        ds = pk.from_tskit(tree)
+        score = pk.parsimony.hartigan.hartigan_parsimony_score(
+            ds.traversal_preorder.data,
+            ds.traversal_postorder.data,
+            ds.node_parent.data,
+            ds.node_left_child.data,
+            ds.node_right_sib.data,
+            ds.sample_node.data,
+            genotypes,
+        )
+        expected = [len(tree.map_mutations(g, alleles)[1]) for g in genotypes]
+        np.testing.assert_array_equal(score, expected)
+        return ds, score
+
+    @pytest.mark.parametrize("seed", [1, 2, 3])
+    def test_matches_vectorised(self, seed):
+        ts = simulate_ts(200, 500, seed=seed)
+        genotypes = ts.genotype_matrix().astype(np.int32)
+        alleles = [str(j) for j in range(np.max(genotypes) + 1)]
+        ds, score = self.check(ts.first(), genotypes, alleles)
+        for j, g in enumerate(genotypes):
+            expected = pk.numba_hartigan_parsimony_vectorised(
+                ds.node_left_child.data,
+                ds.node_right_sib.data,
+                ds.sample_node.data,
+                g.reshape(1, -1),
+            )
+            assert score[j] == expected[0]
+
+    @pytest.mark.parametrize("model", ["yule", "uniform"])
+    def test_random_trees(self, model):
+        tree = pk.to_tskit(pk.sim_trees(50, model=model, random_seed=1))
+        rng = np.random.default_rng(1)
+        genotypes = rng.integers(0, 4, size=(300, 50)).astype(np.int32)
+        self.check(tree, genotypes, ["A", "C", "G", "T"])
+
+    def test_deep_tree(self):
+        # A caterpillar tree deeper than the recursion limit.
+        n = 5000
+        tree = tskit.Tree.generate_comb(n)
+        rng = np.random.default_rng(2)
+        genotypes = rng.integers(0, 2, size=(10, n)).astype(np.int32)
+        self.check(tree, genotypes, ["0", "1"])
+
+    def test_leading_dimensions(self):
+        ts = simulate_ts(20, 200)
+        ds = pk.from_tskit(ts.first())
+        genotypes = ts.genotype_matrix().astype(np.int32)
+        args = (
+            ds.traversal_preorder.data,
+            ds.traversal_postorder.data,
+            ds.node_parent.data,
+            ds.node_left_child.data,
+            ds.node_right_sib.data,
+            ds.sample_node.data,
+        )
+        score = pk.parsimony.hartigan.hartigan_parsimony_score(*args, genotypes)
+        score_3d = pk.parsimony.hartigan.hartigan_parsimony_score(
+            *args, genotypes[:, np.newaxis, :]
+        )
+        assert score_3d.shape == (genotypes.shape[0], 1)
+        np.testing.assert_array_equal(score, score_3d[:, 0])
+
+    def test_no_sites(self):
+        ds = pk.from_tskit(tskit.Tree.generate_balanced(4))
+        score = pk.parsimony.hartigan.hartigan_parsimony_score(
+            ds.traversal_preorder.data,
+            ds.traversal_postorder.data,
+            ds.node_parent.data,
+            ds.node_left_child.data,
+            ds.node_right_sib.data,
+            ds.sample_node.data,
+            np.zeros((0, 4), dtype=np.int32),
+        )
+        assert score.shape == (0,)
+
+
+class TestFitchParsimonyScore:
+    def scores(self, ds, genotypes):
+        fitch_score = pk.parsimony.fitch.fitch_parsimony_score(
+            ds.traversal_postorder.data,
+            ds.node_left_child.data,
+            ds.node_right_sib.data,
+            ds.sample_node.data,
+            genotypes,
+        )
+        hartigan_score = pk.parsimony.hartigan.hartigan_parsimony_score(
+            ds.traversal_preorder.data,
+            ds.traversal_postorder.data,
+            ds.node_parent.data,
+            ds.node_left_child.data,
+            ds.node_right_sib.data,
+            ds.sample_node.data,
+            genotypes,
+        )
+        return fitch_score, hartigan_score
+
+    @pytest.mark.parametrize(
+        "tree",
+        [
+            tskit.Tree.generate_balanced(30, arity=2),
+            tskit.Tree.generate_balanced(30, arity=3),
+            tskit.Tree.generate_star(10),
+            tskit.Tree.generate_comb(100),
+            pk.to_tskit(pk.sim_trees(40, model="uniform", random_seed=1)),
+        ],
+    )
+    @pytest.mark.parametrize("num_alleles", [2, 4, 7])
+    @pytest.mark.parametrize("num_sites", [1, 63, 64, 65, 300])
+    def test_matches_hartigan(self, tree, num_alleles, num_sites):
+        ds = pk.from_tskit(tree)
+        rng = np.random.default_rng(num_sites)
+        genotypes = rng.integers(
+            0, num_alleles, size=(num_sites, ds.sizes["samples"])
+        ).astype(np.int32)
+        fitch_score, hartigan_score = self.scores(ds, genotypes)
+        np.testing.assert_array_equal(fitch_score, hartigan_score)
+        expected = [
+            len(tree.map_mutations(g, [str(k) for k in range(num_alleles)])[1])
+            for g in genotypes
+        ]
+        np.testing.assert_array_equal(fitch_score, expected)
+
+    def test_multiple_roots(self):
+        tables = tskit.Tree.generate_balanced(8).tree_sequence.dump_tables()
+        tables.edges.truncate(len(tables.edges) - 2)
+        ds = pk.from_tskit(tables.tree_sequence().first())
+        assert pk.get_num_roots(ds) == 2
+        rng = np.random.default_rng(1)
+        genotypes = rng.integers(0, 3, size=(100, 8)).astype(np.int32)
+        fitch_score, hartigan_score = self.scores(ds, genotypes)
+        np.testing.assert_array_equal(fitch_score, hartigan_score)
+
+    def test_internal_sample(self):
+        tables = tskit.Tree.generate_balanced(4).tree_sequence.dump_tables()
+        flags = tables.nodes.flags
+        flags[4] = tskit.NODE_IS_SAMPLE
+        tables.nodes.flags = flags
+        ds = pk.from_tskit(tables.tree_sequence().first())
+        with pytest.raises(ValueError, match="leaves"):
+            self.scores(ds, np.zeros((1, 5), dtype=np.int32))
+
+    @pytest.mark.parametrize("chunk_size", [1, 64, 100])
+    def test_backend(self, chunk_size):
+        ts = simulate_ts(100, 1000)
+        ds = pk.from_tskit(ts.first()).merge(
+            pk.parsimony.hartigan.ts_to_dataset(ts, chunk_size)
+        )
+        xt.assert_equal(
+            pk.get_hartigan_parsimony_score(ds, backend="fitch").compute(),
+            pk.get_hartigan_parsimony_score(ds).compute(),
+        )
+
+    def test_bad_backend(self):
+        ts = simulate_ts(10, 100)
+        ds = pk.from_tskit(ts.first()).merge(pk.parsimony.hartigan.ts_to_dataset(ts))
+        with pytest.raises(ValueError, match="Unknown parsimony backend"):
+            pk.get_hartigan_parsimony_score(ds, backend="sankoff")
+
+
+class TestSitePatternScores:
+    @pytest.mark.parametrize("backend", ["hartigan", "fitch"])
+    @pytest.mark.parametrize("chunk_size", [None, 7])
+    def test_same_scores(self, backend, chunk_size):
+        ts = simulate_ts(50, 500, seed=2)
+        ds = pk.from_tskit(ts.first()).merge(pk.parsimony.hartigan.ts_to_dataset(ts))
+        # Repeat the sites so there are duplicate patterns.
+        ds = ds.isel(variants=np.tile(np.arange(ds.sizes["variants"]), 3))
+        if chunk_size is not None:
+            ds = ds.chunk({"variants": chunk_size})
+        expected = pk.get_hartigan_parsimony_score(ds, backend=backend).compute()
+        ds = pk.append_site_patterns(ds)
+        assert ds.sizes["site_patterns"] < ds.sizes["variants"]
+        xt.assert_equal(
+            pk.get_hartigan_parsimony_score(ds, backend=backend).compute(), expected
+        )
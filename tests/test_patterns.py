@@ -0,0 +1,78 @@
+# Tests for the site pattern compression
+import msprime
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+import phylokit as pk
+
+
+def naive_site_patterns(genotypes, alleles=None):
+    keys = {}
+    site_pattern = []
+    for i in range(genotypes.shape[0]):
+        key = tuple(genotypes[i].ravel())
+        if alleles is not None:
+            key += tuple(alleles[i].ravel())
+        if key not in keys:
+            keys[key] = len(keys)
+        site_pattern.append(keys[key])
+    return np.array(site_pattern)
+
+
+class TestSitePatterns:
+    @pytest.mark.parametrize("num_alleles", [1, 2, 4])
+    @pytest.mark.parametrize("with_alleles", [True, False])
+    def test_random(self, num_alleles, with_alleles):
+        rng = np.random.default_rng(num_alleles)
+        genotypes = rng.integers(-1, num_alleles, size=(500, 4, 1))
+        alleles = None
+        if with_alleles:
+            alleles = np.array([[b"A", b"C"], [b"C", b"A"]])[rng.integers(0, 2, 500)]
+        site_pattern, pattern_site, weight = pk.site_patterns(genotypes, alleles)
+        assert_array_equal(site_pattern, naive_site_patterns(genotypes, alleles))
+        assert_array_equal(site_pattern[pattern_site], np.arange(len(pattern_site)))
+        assert_array_equal(weight, np.bincount(site_pattern))
+        assert weight.sum() == 500
+        assert np.all(np.diff(pattern_site) > 0)
+
+    def test_missing_data_differs(self):
+        genotypes = np.array([[0, 0], [0, -1], [-1, 0], [0, 0]])
+        site_pattern, pattern_site, weight = pk.site_patterns(genotypes)
+        assert_array_equal(site_pattern, [0, 1, 2, 0])
+        assert_array_equal(pattern_site, [0, 1, 2])
+        assert_array_equal(weight, [2, 1, 1])
+
+    def test_alleles_differ(self):
+        genotypes = np.zeros((3, 2), dtype=np.int32)
+        alleles = np.array([[b"A", b"C"], [b"G", b"C"], [b"A", b"C"]])
+        site_pattern, _, weight = pk.site_patterns(genotypes, alleles)
+        assert_array_equal(site_pattern, [0, 1, 0])
+        assert_array_equal(weight, [2, 1])
+
+    def test_no_sites(self):
+        site_pattern, pattern_site, weight = pk.site_patterns(
+            np.zeros((0, 5), dtype=np.int32)
+        )
+        assert site_pattern.shape == pattern_site.shape == weight.shape == (0,)
+
+    def test_append_site_patterns(self):
+        ts = msprime.sim_mutations(
+            msprime.sim_ancestry(10, sequence_length=1000, ploidy=1, random_seed=1),
+            rate=0.01,
+            random_seed=1,
+        )
+        ds = pk.from_tskit(ts.first()).merge(pk.parsimony.hartigan.ts_to_dataset(ts))
+        ds = ds.isel(variants=np.tile(np.arange(ds.sizes["variants"]), 3))
+        ds = pk.append_site_patterns(ds)
+        num_variants = ds.sizes["variants"]
+        assert ds.sizes["site_patterns"] <= num_variants // 3
+        assert ds.variant_site_pattern.dims == ("variants",)
+        assert ds.site_pattern_weight.dims == ("site_patterns",)
+        assert ds.site_pattern_weight.sum() == num_variants
+        assert_array_equal(
+            ds.call_genotype.data,
+            ds.call_genotype.data[
+                ds.site_pattern_variant.data[ds.variant_site_pattern.data]
+            ],
+        )
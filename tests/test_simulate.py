@@ -0,0 +1,102 @@
+# Tests for the random tree generators
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+import phylokit as pk
+
+MODELS = ["yule", "kingman", "uniform"]
+
+
+class TestSimTrees:
+    @pytest.mark.parametrize("model", MODELS)
+    @pytest.mark.parametrize("n", [1, 2, 3, 10, 57])
+    def test_valid_tree(self, model, n):
+        ds = pk.sim_trees(n, model=model, random_seed=1)
+        assert ds.node_parent.shape[0] == 2 * n
+        assert pk.get_num_roots(ds) == 1
+        assert not pk.is_unary(ds)
+        assert_array_equal(ds.sample_node, np.arange(n))
+        assert len(pk.postorder(ds)) == 2 * n - 1
+        leaves = np.where(ds.node_left_child.data[:-1] == -1)[0]
+        assert_array_equal(leaves, np.arange(n))
+        assert ds.node_time.data[-1] == np.inf
+
+    @pytest.mark.parametrize("model", MODELS)
+    def test_times_increase_to_root(self, model):
+        ds = pk.sim_trees(30, model=model, random_seed=2)
+        parent = ds.node_parent.data[:-2]
+        time = ds.node_time.data
+        assert np.all(time[parent] > time[:-2])
+        assert np.all(time[:30] == 0)
+
+    @pytest.mark.parametrize("model", MODELS)
+    def test_reproducible(self, model):
+        ds1 = pk.sim_trees(20, model=model, random_seed=5)
+        ds2 = pk.sim_trees(20, model=model, random_seed=5)
+        ds3 = pk.sim_trees(20, model=model, random_seed=6)
+        assert_array_equal(ds1.node_parent, ds2.node_parent)
+        assert_array_equal(ds1.node_time, ds2.node_time)
+        assert not np.array_equal(ds1.node_time, ds3.node_time)
+
+    @pytest.mark.parametrize("model", MODELS)
+    def test_forest_prefix(self, model):
+        single = pk.sim_trees(12, model=model, random_seed=7)
+        small = pk.sim_trees(12, 3, model=model, random_seed=7)
+        large = pk.sim_trees(12, 10, model=model, random_seed=7)
+        assert pk.core.get_num_trees(small) == 3
+        for j in range(3):
+            tree = pk.core.get_tree(large, j)
+            assert_array_equal(tree.node_parent, pk.core.get_tree(small, j).node_parent)
+            assert_array_equal(tree.node_time, pk.core.get_tree(small, j).node_time)
+        assert_array_equal(single.node_parent, pk.core.get_tree(large, 0).node_parent)
+
+    @pytest.mark.parametrize("model", MODELS)
+    def test_forest_trees_valid(self, model):
+        forest = pk.sim_trees(8, 20, model=model, random_seed=8)
+        assert_array_equal(forest.tree_id, np.arange(20))
+        for j in range(20):
+            tree = pk.core.get_tree(forest, j)
+            assert pk.get_num_roots(tree) == 1
+            assert not pk.is_unary(tree)
+            assert_array_equal(tree.traversal_postorder, pk.postorder(tree))
+
+    def test_yule_mean_sackin(self):
+        # The expected Sackin index of a Yule tree is 2n(H_n - 1).
+        n = 20
+        expected = 2 * n * (np.sum(1 / np.arange(1, n + 1)) - 1)
+        forest = pk.sim_trees(n, 5000, model="yule", random_seed=1)
+        assert np.mean(pk.forest_sackin_index(forest)) == pytest.approx(
+            expected, rel=0.02
+        )
+
+    def test_kingman_mean_root_time(self):
+        # The expected time to the MRCA of n lineages is 2(1 - 1/n).
+        n = 10
+        forest = pk.sim_trees(n, 5000, model="kingman", random_seed=1)
+        root_time = forest.node_time.data[2 * n - 2 :: 2 * n]
+        assert np.mean(root_time) == pytest.approx(2 * (1 - 1 / n), rel=0.05)
+
+    def test_uniform_topologies(self):
+        # Three of the 15 rooted binary topologies on 4 leaves are balanced.
+        forest = pk.sim_trees(4, 15000, model="uniform", random_seed=1)
+        sackin = pk.forest_sackin_index(forest)
+        assert np.mean(sackin == 8) == pytest.approx(0.2, abs=0.02)
+
+    def test_uniform_times_are_heights(self):
+        ds = pk.sim_trees(25, model="uniform", random_seed=3)
+        assert ds.node_time.data[pk.postorder(ds)[-1]] == np.max(ds.node_time.data[:-1])
+        assert np.all(ds.node_branch_length.data[pk.postorder(ds)[:-1]] >= 1)
+
+    def test_bad_model(self):
+        with pytest.raises(ValueError, match="Unknown model"):
+            pk.sim_trees(5, model="birth_death")
+
+    @pytest.mark.parametrize("n", [0, -1])
+    def test_bad_num_leaves(self, n):
+        with pytest.raises(ValueError, match="leaf"):
+            pk.sim_trees(n)
+
+    def test_bad_num_trees(self):
+        with pytest.raises(ValueError, match="tree"):
+            pk.sim_trees(5, 0)
@@ -201,3 +201,36 @@ class TestAllRootsN5:
 
     def test_preorder(self):
         assert np.array_equal(pk.preorder(self.tree()), [0, 1, 2, 3, 4])
+
+
+class TestForest:
+    def trees(self):
+        return [
+            TestBalancedBinaryOdd().tree(),
+            TestBalancedTernary().tree(),
+            TestEmpty().tree(),
+            TestMultiRootBinary().tree(),
+            TestAllRootsN5().tree(),
+            TestCombN5().tree(),
+        ]
+
+    def forest(self):
+        return pk.core.concat_trees(self.trees())
+
+    def test_postorder(self):
+        postorder, offset = pk.forest_postorder(self.forest())
+        trees = self.trees()
+        assert len(offset) == len(trees) + 1
+        for j, tree in enumerate(trees):
+            assert np.array_equal(
+                postorder[offset[j] : offset[j + 1]], pk.postorder(tree)
+            )
+
+    def test_preorder(self):
+        preorder, offset = pk.forest_preorder(self.forest())
+        trees = self.trees()
+        assert len(offset) == len(trees) + 1
+        for j, tree in enumerate(trees):
+            assert np.array_equal(
+                preorder[offset[j] : offset[j + 1]], pk.preorder(tree)
+            )